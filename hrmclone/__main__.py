@@ -0,0 +1,24 @@
+"""
+Command line entry point:
+
+    python -m hrmclone serve ...      # see hrmclone.server
+    python -m hrmclone benchmark ...  # see hrmclone.benchmark
+"""
+import sys
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in ('serve', 'benchmark'):
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    command, *rest = argv
+    if command == 'serve':
+        from .server import main as command_main
+    else:
+        from .benchmark import main as command_main
+    return command_main(rest)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
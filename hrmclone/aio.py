@@ -0,0 +1,123 @@
+"""
+Runs programs under asyncio, with the inbox read from an async source and
+the outbox written to an async sink.
+
+    async def player(program, reader, writer):
+        run = program.bind()
+        await run_async(run, lines(reader), writer_sink(writer))
+
+One event loop can host thousands of these. Each run executes at most about
+`quantum` steps before letting the other tasks have a go, so a program stuck
+in a busy loop can't starve the rest. Outputs are handed to the sink between
+slices of the run, and each one is awaited before the run carries on, so
+a slow consumer holds its producer back. At most about `buffer` outputs
+are held waiting for the sink.
+"""
+import asyncio
+import inspect
+import time
+
+from . import exceptions
+
+
+# Steps a run may take before yielding to the event loop. Big enough that the
+# cost of switching tasks disappears, small enough to keep other runs responsive.
+DEFAULT_QUANTUM = 10000
+
+# With a sink, steps a run may take between handing its outputs over (and so,
+# roughly, the most outputs it can get ahead of the sink by).
+DEFAULT_BUFFER = 1000
+
+
+async def _items(inbox):
+    if hasattr(inbox, '__aiter__'):
+        async for item in inbox:
+            yield item
+    else:
+        for item in inbox:
+            yield item
+
+
+async def run_async(run, inbox, sink=None, *, engine='compiled', quantum=DEFAULT_QUANTUM,
+                    buffer=DEFAULT_BUFFER, max_steps=None, timeout=None, detect_loops=False):
+    """
+    Runs `run` (a ProgramRun) until it finishes or `inbox` is exhausted, and
+    returns it.
+
+    `inbox` is an async iterable (or a plain one) that's only read from when
+    an INBOX needs another item. Items it's already been fed are read first.
+
+    `sink` is called with each OUTBOXed value; if it returns an awaitable,
+    that's awaited before the run carries on. Leave it out to collect the
+    outbox in run.outbox as usual. run.sink is put back as it was when
+    run_async() returns.
+
+    With a sink, the run is paused every `buffer` steps to hand its outputs
+    over, so no more than about `buffer` of them are ever waiting (every
+    OUTBOX is a step).
+
+    The quantum is only checked on backward jumps (as for max_steps), so a
+    run may go a little past it before yielding.
+
+    `max_steps` and `timeout` apply to the whole run; `timeout` counts only
+    the time spent executing, not the time spent waiting for the inbox or
+    the sink. `detect_loops` only spots loops within a single quantum.
+    """
+    pending = []
+    original_sink = run.sink
+    slice_steps = quantum
+    if sink is not None:
+        run.sink = pending.append
+        run._emit = run._make_emit()
+        slice_steps = min(quantum, buffer)
+
+    items = _items(inbox)
+    budget = timeout
+    try:
+        while True:
+            limit = (run.runtime or 0) + slice_steps
+            if max_steps is not None:
+                limit = min(limit, max_steps)
+
+            start = time.monotonic()
+            paused = False
+            error = None
+            try:
+                run.run(engine=engine, max_steps=limit, timeout=budget, detect_loops=detect_loops)
+            except exceptions.StepLimitExceeded as e:
+                if max_steps is not None and run.runtime > max_steps:
+                    error = e
+                else:
+                    paused = True
+            except (exceptions.RunError, exceptions.InvalidFloorIndex) as e:
+                error = e
+            if budget is not None:
+                budget -= time.monotonic() - start
+
+            # Everything OUTBOXed before an error still goes to the sink.
+            if pending:
+                sent = pending[:]
+                pending.clear()
+                for value in sent:
+                    result = sink(value)
+                    if inspect.isawaitable(result):
+                        await result
+            if error is not None:
+                raise error
+
+            if paused:
+                # Used up the slice; give everyone else a turn.
+                await asyncio.sleep(0)
+            elif run.waiting:
+                try:
+                    item = await items.__anext__()
+                except StopAsyncIteration:
+                    return run
+                run.feed([item.strip() if isinstance(item, str) else item])
+            else:
+                return run
+    finally:
+        if sink is not None:
+            run.sink = original_sink
+            run._emit = run._make_emit()
+        await items.aclose()
@@ -0,0 +1,434 @@
+"""
+Static analysis of a Program: its control flow graph, and what the hands and
+floor tiles can hold at each instruction.
+
+analyse() runs an abstract interpretation of the program's linked form. Each
+value (the hands, or a floor tile) is tracked as an AbstractValue: whether it
+might be empty, a number or a letter, and the range the number lies in. From
+that it works out:
+
+ * which instructions can never be reached,
+ * which floor tiles are never used,
+ * which of each instruction's runtime checks can never fail.
+
+The compiled engine uses the last of these to leave out checks (see
+hrmclone.compiler); the rest is mostly useful for validating solutions.
+
+Inbox items are assumed to be anything at all (any number or letter).
+"""
+import collections
+
+from .bytecode import (
+    ADD, BUMPDN, BUMPUP, COPYFROM, COPYTO, INBOX, JUMP, JUMPN, JUMPZ, NOP, OPCODE_NAMES,
+    OUTBOX, SUB,
+)
+from .core import FLOOR_TILES
+
+
+INF = float('inf')
+
+AbstractValue = collections.namedtuple('AbstractValue', 'empty number letter low high')
+AbstractValue.__doc__ = """
+Everything a value might be at some point in a program. `low` and `high`
+bound it when it's a number (and are meaningless if `number` is false).
+"""
+
+EMPTY = AbstractValue(True, False, False, INF, -INF)
+LETTER = AbstractValue(False, False, True, INF, -INF)
+ANYTHING = AbstractValue(False, True, True, -INF, INF)
+UNKNOWN = AbstractValue(True, True, True, -INF, INF)
+
+
+def number(low=-INF, high=INF):
+    return AbstractValue(False, True, False, low, high)
+
+
+def join(a, b):
+    if a == b:
+        return a
+    return AbstractValue(
+        a.empty or b.empty, a.number or b.number, a.letter or b.letter,
+        min(a.low, b.low), max(a.high, b.high),
+    )
+
+
+def widen(old, new):
+    """
+    Like join(), but any bound which is still moving goes straight to
+    infinity, so loops which count up or down reach a fixed point.
+    """
+    return new._replace(
+        low=new.low if new.low >= old.low else -INF,
+        high=new.high if new.high <= old.high else INF,
+    )
+
+
+def _filled(value):
+    return value._replace(empty=False)
+
+
+def _is_empty(value):
+    # definitely empty
+    return not value.number and not value.letter
+
+
+# The checks an instruction makes, by name. 'pointer' covers everything that
+# can go wrong resolving a [pointer]: an empty tile, a letter, or an index
+# off the end of the floor.
+CHECKS = {
+    COPYFROM: ('tile', 'pointer'),
+    COPYTO: ('hands', 'pointer'),
+    ADD: ('hands', 'tile', 'numbers', 'pointer'),
+    SUB: ('hands', 'tile', 'numbers', 'pointer'),
+    BUMPUP: ('tile', 'numbers', 'pointer'),
+    BUMPDN: ('tile', 'numbers', 'pointer'),
+    OUTBOX: ('hands',),
+    JUMPZ: ('hands',),
+    JUMPN: ('hands', 'numbers'),
+}
+
+
+def signature(hands, floor):
+    """
+    The types of the (typed) hands and each floor tile, as a tuple. Runs
+    which start with the same signature can share a specialisation (see
+    Program.compile()).
+
+    This is worked out for every compiled run, so it's kept as cheap as can be.
+    """
+    return (type(hands), *map(type, floor))
+
+
+_KINDS = {type(None): 0, int: 1, str: 2}
+_KIND_VALUES = (EMPTY, number(), LETTER)
+
+# A value of each type, for turning a signature back into hands and a floor
+# (for analyse() with exact=False).
+KIND_EXAMPLES = {type(None): None, int: 0, str: 'A'}
+
+
+def initial_state(hands=None, floor=None, *, exact=True):
+    """
+    The abstract state for a run starting with these (typed) hands and floor:
+    a tuple of (hands, floor, alias), where `alias` is the tile the hands are
+    known to be a copy of, if any.
+
+    With exact=False, numbers could be anything; the state then covers every
+    run with the same signature().
+    """
+    if floor is None:
+        floor = [None] * FLOOR_TILES
+
+    def abstract(value):
+        if exact and type(value) is int:
+            return number(value, value)
+        return _KIND_VALUES[_KINDS.get(type(value), 2)]
+
+    return abstract(hands), tuple(abstract(v) for v in floor), None
+
+
+class Analysis:
+    """
+    The results of analyse().
+
+    `graph` is the program's control_flow(). `states` maps each reachable
+    instruction to the abstract state on entry to it (see initial_state()). `safe` maps each reachable instruction to the
+    names (see CHECKS) of the checks it makes which can never fail.
+    """
+    def __init__(self, program, code, states, safe, touched):
+        self.program = program
+        self.code = code
+        self.graph = control_flow(code)
+        self.states = states
+        self.safe = safe
+        self.reachable = frozenset(states)
+        self.unreachable = [i for i in range(len(code)) if i not in states]
+        floor_size = len(next(iter(states.values()))[1]) if states else FLOOR_TILES
+        self.unused_tiles = [t for t in range(floor_size) if t not in touched]
+
+    def needed(self, index):
+        """
+        The checks instruction `index` makes which might fail.
+        """
+        op, _, indirect = self.code[index]
+        return [
+            check for check in CHECKS.get(op, ())
+            if check not in self.safe.get(index, ()) and (indirect or check != 'pointer')
+        ]
+
+    def report(self):
+        """
+        A human readable summary.
+        """
+        lines = []
+        for i, (op, arg, indirect) in enumerate(self.code):
+            if i not in self.reachable:
+                note = 'unreachable'
+            else:
+                needed = self.needed(i)
+                note = f'checks {", ".join(needed)}' if needed else 'can\'t fail'
+            operand = f' [{arg}]' if indirect else f' {arg}' if op not in (INBOX, OUTBOX, NOP) else ''
+            lines.append(f'{i:4} {OPCODE_NAMES[op] + operand:16} {note}')
+        if self.unused_tiles:
+            lines.append(f'unused floor tiles: {", ".join(map(str, self.unused_tiles))}')
+        return '\n'.join(lines)
+
+
+def control_flow(code):
+    """
+    The control flow graph of a LinkedProgram's code: a list holding, for
+    each instruction, the indices it can go to next. An index equal to
+    len(code) is the end of the program.
+    """
+    graph = []
+    for i, (op, arg, indirect) in enumerate(code):
+        if op == JUMP:
+            graph.append([arg])
+        elif op in (JUMPZ, JUMPN):
+            graph.append([arg, i + 1])
+        else:
+            graph.append([i + 1])
+    return graph
+
+
+def _resolve(floor, index):
+    """
+    The tiles a [pointer] in tile `index` might point to, and whether resolving
+    it can't fail.
+    """
+    pointer = _read(floor, index)
+    size = min(len(floor), FLOOR_TILES)
+    if not pointer.number:
+        return [], False
+    low = max(pointer.low, 0)
+    high = min(pointer.high, size - 1)
+    targets = list(range(int(low), int(high) + 1)) if low <= high else []
+    safe = (not pointer.empty and not pointer.letter and pointer.low >= 0 and pointer.high < size)
+    return targets, safe
+
+
+def _read(floor, tile):
+    return floor[tile] if tile < len(floor) else UNKNOWN
+
+
+def _operand(floor, arg, indirect, safe):
+    """
+    Reads an instruction's floor operand. Returns (value, targets), where
+    targets are the tiles it might have come from.
+    """
+    if not indirect:
+        targets = [arg] if arg < len(floor) else []
+        value = _read(floor, arg)
+    else:
+        targets, pointer_safe = _resolve(floor, arg)
+        if pointer_safe:
+            safe.add('pointer')
+        if targets:
+            value = floor[targets[0]]
+            for t in targets[1:]:
+                value = join(value, floor[t])
+        else:
+            value = EMPTY
+    if targets and not value.empty:
+        safe.add('tile')
+    return value, targets
+
+
+def _write(floor, targets, value):
+    floor = list(floor)
+    if len(targets) == 1:
+        floor[targets[0]] = value
+    else:
+        for t in targets:
+            floor[t] = join(floor[t], value)
+    return tuple(floor)
+
+
+def meet(a, b):
+    """
+    What a value might be, knowing it's described by both `a` and `b`.
+    """
+    return AbstractValue(
+        a.empty and b.empty, a.number and b.number, a.letter and b.letter,
+        max(a.low, b.low), min(a.high, b.high),
+    )
+
+
+def _refine(hands, floor, alias):
+    # Whatever was learnt about the hands applies to the tile they were copied from.
+    if alias is None:
+        return hands, floor, alias
+    value = meet(hands, floor[alias])
+    return value, _write(floor, [alias], value), alias
+
+
+def transfer(code, index, state):
+    """
+    Abstractly executes one instruction. Returns (successors, safe), where
+    successors is a list of (index, state) for each way it can carry on
+    without an error, and safe is the set of its checks which can't fail.
+    """
+    op, arg, indirect = code[index]
+    hands, floor, alias = state
+    safe = set()
+    following = index + 1
+    if op in CHECKS and 'hands' in CHECKS[op] and not hands.empty:
+        safe.add('hands')
+
+    if op == NOP:
+        return [(following, state)], safe
+    if op == INBOX:
+        return [(following, (ANYTHING, floor, None))], safe
+    if op == JUMP:
+        return [(arg, state)], safe
+    if op == OUTBOX:
+        if _is_empty(hands):
+            return [], safe
+        return [(following, (EMPTY, floor, None))], safe
+    if op == JUMPZ:
+        successors = []
+        if hands.number and hands.low <= 0 <= hands.high:
+            successors.append((arg, _refine(number(0, 0), floor, alias)))
+        if hands.letter or (hands.number and (hands.low, hands.high) != (0, 0)):
+            untaken = hands._replace(
+                empty=False,
+                low=1 if hands.low == 0 else hands.low,
+                high=-1 if hands.high == 0 else hands.high,
+            )
+            successors.append((following, _refine(untaken, floor, alias)))
+        return successors, safe
+    if op == JUMPN:
+        if not hands.letter:
+            safe.add('numbers')
+        successors = []
+        if hands.number and hands.low < 0:
+            taken = number(hands.low, min(hands.high, -1))
+            successors.append((arg, _refine(taken, floor, alias)))
+        if hands.letter or (hands.number and hands.high >= 0):
+            untaken = AbstractValue(
+                False, hands.number and hands.high >= 0, hands.letter,
+                max(hands.low, 0), hands.high,
+            )
+            successors.append((following, _refine(untaken, floor, alias)))
+        return successors, safe
+
+    if op == COPYTO:
+        if indirect:
+            targets, pointer_safe = _resolve(floor, arg)
+            if pointer_safe:
+                safe.add('pointer')
+        else:
+            targets = [arg]
+        if _is_empty(hands) or not targets:
+            return [], safe
+        hands = _filled(hands)
+        if len(targets) == 1:
+            alias = targets[0]
+        return [(following, (hands, _write(floor, targets, hands), alias))], safe
+
+    value, targets = _operand(floor, arg, indirect, safe)
+    if _is_empty(value) or not targets:
+        return [], safe
+    alias = targets[0] if len(targets) == 1 else None
+
+    if op == COPYFROM:
+        value = _filled(value)
+        if not indirect:
+            floor = _write(floor, targets, value)
+        return [(following, (value, floor, alias))], safe
+
+    if op in (BUMPUP, BUMPDN):
+        if not value.letter:
+            safe.add('numbers')
+        if not value.number:
+            return [], safe
+        step = 1 if op == BUMPUP else -1
+        result = number(value.low + step, value.high + step)
+        return [(following, (result, _write(floor, targets, result), alias))], safe
+
+    # ADD or SUB
+    if _is_empty(hands):
+        return [], safe
+    if not hands.letter and not value.letter:
+        safe.add('numbers')
+    result_number = hands.number and value.number
+    result_letter = op == SUB and hands.letter and value.letter
+    if not result_number and not result_letter:
+        return [], safe
+    if op == ADD:
+        low, high = hands.low + value.low, hands.high + value.high
+    else:
+        low, high = hands.low - value.high, hands.high - value.low
+    result = AbstractValue(False, result_number, result_letter, low, high)
+    if not result_number:
+        result = result._replace(low=INF, high=-INF)
+    return [(following, (result, floor, None))], safe
+
+
+def _join_states(a, b):
+    return (
+        join(a[0], b[0]),
+        tuple(join(x, y) for x, y in zip(a[1], b[1])),
+        a[2] if a[2] == b[2] else None,
+    )
+
+
+def _widen_states(old, new):
+    return (
+        widen(old[0], new[0]),
+        tuple(widen(x, y) for x, y in zip(old[1], new[1])),
+        new[2],
+    )
+
+
+# How many times an instruction's state may change before it's widened.
+WIDEN_AFTER = 3
+
+
+def analyse(program, floor=None, *, hands=None, exact=True):
+    """
+    Analyses `program` for a run starting at the first instruction with the
+    given (typed) hands and floor. See initial_state() for `exact`.
+    """
+    code = program.link().code
+    end = len(code)
+    state = initial_state(hands, floor, exact=exact)
+
+    states = {}
+    changes = collections.Counter()
+    work = [0] if end else []
+    if end:
+        states[0] = state
+    while work:
+        index = work.pop()
+        successors, _ = transfer(code, index, states[index])
+        for following, new in successors:
+            if following >= end:
+                continue
+            old = states.get(following)
+            if old is not None:
+                new = _join_states(old, new)
+                if new == old:
+                    continue
+                changes[following] += 1
+                if changes[following] > WIDEN_AFTER:
+                    new = _widen_states(old, new)
+            states[following] = new
+            work.append(following)
+
+    safe = {}
+    touched = set()
+    for index in states:
+        _, safe[index] = transfer(code, index, states[index])
+        safe[index] = frozenset(safe[index])
+        op, arg, indirect = code[index]
+        if op in (COPYFROM, COPYTO, ADD, SUB, BUMPUP, BUMPDN):
+            touched.add(arg)
+            if indirect:
+                targets, pointer_safe = _resolve(states[index][1], arg)
+                if pointer_safe:
+                    touched.update(targets)
+                else:
+                    # might be anywhere
+                    touched.update(range(FLOOR_TILES))
+    return Analysis(program, code, states, safe, touched)
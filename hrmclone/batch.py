@@ -0,0 +1,187 @@
+"""
+Runs one Program against lots of inboxes, optionally across a pool of
+worker processes.
+
+The program is pickled once and sent along with each chunk of inputs, but
+each worker only unpickles it the first time (see worker_state()).
+"""
+import concurrent.futures
+import itertools
+import os
+import pickle
+import uuid
+
+from . import exceptions
+
+
+DEFAULT_CHUNKSIZE = 32
+
+
+class RunResult:
+    """
+    The outcome of one case in a batch.
+
+    If the run raised an error, `error` holds the exception and the other
+    attributes describe the state at the point it was raised.
+    """
+    def __init__(self, index, outbox, floor, hands, runtime, error=None):
+        self.index = index
+        self.outbox = outbox
+        self.floor = floor
+        self.hands = hands
+        self.runtime = runtime
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.error is not None:
+            return f'<RunResult {self.index}: {type(self.error).__name__} after {self.runtime} steps>'
+        return f'<RunResult {self.index}: {len(self.outbox)} outboxed in {self.runtime} steps>'
+
+
+def run_case(program, index, inbox, floor, engine, typed, limits=None):
+    """
+    Runs a single case and wraps up the outcome as a RunResult.
+
+    `limits` is a dict of keyword arguments for ProgramRun.run()
+    (max_steps, timeout, detect_loops and the sandbox limits).
+    """
+    run = program.bind(inbox=inbox, floor=floor, typed=typed)
+    error = None
+    try:
+        run.run(engine=engine, **(limits or {}))
+    except (exceptions.RunError, exceptions.InvalidFloorIndex) as e:
+        error = e
+    return RunResult(index, run.outbox, run.floor, run.hands, run.runtime, error)
+
+
+def run_chunk(program, chunk, engine, typed, limits=None):
+    if engine == 'vector':
+        from .vector import run_lanes
+        return run_lanes(program, chunk, typed=typed, **(limits or {}))
+    return [
+        run_case(program, index, inbox, floor, engine, typed, limits)
+        for index, inbox, floor in chunk
+    ]
+
+
+# key -> value, for worker_state()
+_worker_state = {}
+
+
+def worker_state(key, make, *args):
+    """
+    Returns what this process keeps under `key`, calling make(*args) for it
+    the first time. It's for setting up worker processes lazily, since
+    ProcessPoolExecutor's `initializer` is only in Python 3.7 and up.
+    """
+    try:
+        return _worker_state[key]
+    except KeyError:
+        value = _worker_state[key] = make(*args)
+        return value
+
+
+def _run_worker_chunk(key, pickled, chunk, engine, typed, limits):
+    program = worker_state(key, pickle.loads, pickled)
+    return run_chunk(program, chunk, engine, typed, limits)
+
+
+def _cases(inboxes, floor, floors):
+    if floors is None:
+        floors = itertools.repeat(floor)
+    for index, (inbox, case_floor) in enumerate(zip(inboxes, floors)):
+        # Cases have to be pickled, so streamed inboxes are read up front.
+        if not isinstance(inbox, (str, list, tuple)):
+            inbox = list(inbox)
+        yield index, inbox, case_floor
+
+
+def _chunks(cases, chunksize):
+    while True:
+        chunk = list(itertools.islice(cases, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_many(program, inboxes, *, floor=None, floors=None, workers=None,
+             engine='compiled', typed=False, chunksize=DEFAULT_CHUNKSIZE, ordered=True,
+             max_steps=None, timeout=None, detect_loops=False,
+             max_outbox=None, max_value=None, deadline=None, max_memory=None):
+    """
+    Runs `program` once for each inbox in `inboxes`, and yields a RunResult for each.
+
+    `floor` is the starting floor for every case; alternatively `floors` gives
+    one starting floor per case.
+
+    `workers` is the number of worker processes to use; by default, one per
+    CPU. With workers=0 everything runs in this process.
+
+    `engine` is any of the engines ProgramRun.run() accepts, or 'vector' to run
+    each chunk in lockstep with hrmclone.vector (which wants a much bigger
+    chunksize to be worthwhile).
+
+    Errors raised by a run (EmptyHands etc) don't stop the batch; they're
+    reported in that case's RunResult. That includes going over the
+    `max_steps`, `timeout` and `detect_loops` limits, which apply to each
+    case separately, as do the sandbox limits (`max_outbox`, `max_value`,
+    `deadline` and `max_memory`; see hrmclone.limits.Guard).
+
+    If `ordered` is false, results are yielded as soon as they're ready
+    rather than in input order. RunResult.index says which case each one is.
+    """
+    chunks = _chunks(_cases(inboxes, floor, floors), chunksize)
+    limits = dict(
+        max_steps=max_steps, timeout=timeout, detect_loops=detect_loops,
+        max_outbox=max_outbox, max_value=max_value, deadline=deadline, max_memory=max_memory,
+    )
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 0:
+        for chunk in chunks:
+            yield from run_chunk(program, chunk, engine, typed, limits)
+        return
+
+    # Link once here, so the workers receive the linked form rather than each
+    # working it out for themselves.
+    program.link()
+    key = ('program', uuid.uuid4().hex)
+    pickled = pickle.dumps(program, pickle.HIGHEST_PROTOCOL)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep a few chunks per worker in flight, rather than queueing up
+        # the entire (possibly huge) input at once.
+        window = workers * 4
+        pending = []
+        for chunk in chunks:
+            pending.append(executor.submit(
+                _run_worker_chunk, key, pickled, chunk, engine, typed, limits,
+            ))
+            if len(pending) >= window:
+                pending = yield from _drain(pending, ordered, window // 2)
+        yield from _drain(pending, ordered, 0)
+
+
+def _drain(pending, ordered, keep):
+    """
+    Yields results from finished futures until at most `keep` are still pending.
+    Returns the futures which are still pending.
+    """
+    if ordered:
+        while len(pending) > keep:
+            yield from pending.pop(0).result()
+        return pending
+
+    pending = set(pending)
+    while len(pending) > keep:
+        done, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        for future in done:
+            yield from future.result()
+    return list(pending)
@@ -0,0 +1,445 @@
+"""
+Benchmarks for parsing, binding and running level solutions on each engine.
+
+Run it with:
+
+    python -m hrmclone.benchmark --output before.json
+    ... make changes ...
+    python -m hrmclone.benchmark --output after.json
+    python -m hrmclone.benchmark compare before.json after.json
+
+For every level solution it measures parse time, bind time for a large
+synthetic inbox, instructions per second on that inbox, latency percentiles
+for lots of small runs, and the peak memory used by a run.
+
+    python -m hrmclone.benchmark memory
+
+measures how much memory each of a large number of idle runs takes up:
+freshly bound, stopped waiting for more inbox, then compact()ed, and
+pack()ed to bytes.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import string
+import sys
+import time
+import tracemalloc
+
+from . import core
+from .core import Program
+
+
+ENGINES = ['object'] + list(core.ENGINES)
+
+
+def _numbers(low, high):
+    return lambda rng, size: [str(rng.randint(low, high)) for _ in range(size)]
+
+
+def _letters(rng, size):
+    return [rng.choice(string.ascii_uppercase) for _ in range(size)]
+
+
+def _with_zeros(rng, size):
+    return [rng.choice('0000ABCDE123') for _ in range(size)]
+
+
+# name -> (solution source, inbox generator, starting floor)
+# These are the level solutions from tests/testlevels.py.
+SOLUTIONS = {
+    'level_2_mail_room': ('''
+        a:
+            INBOX
+            OUTBOX
+            JUMP     a
+    ''', _letters, None),
+    'level_4_scrambler_handler': ('''
+        a:
+            INBOX
+            COPYTO   0
+            INBOX
+            OUTBOX
+            COPYFROM 0
+            OUTBOX
+            JUMP     a
+    ''', _letters, None),
+    'level_6_rainy_summer': ('''
+        a:
+            INBOX
+            COPYTO   0
+            INBOX
+            ADD      0
+            OUTBOX
+            JUMP     a
+    ''', _numbers(-99, 99), None),
+    'level_7_zero_exterminator': ('''
+        a:
+        b:
+            INBOX
+            JUMPZ    b
+            OUTBOX
+            JUMP     a
+    ''', _with_zeros, None),
+    'level_11_sub_hallway': ('''
+        a:
+            INBOX
+            COPYTO   0
+            INBOX
+            COPYTO   1
+            SUB      0
+            OUTBOX
+            COPYFROM 0
+            SUB      1
+            OUTBOX
+            JUMP     a
+    ''', _numbers(-99, 99), None),
+    'level_14_maximization_room': ('''
+            JUMP     c
+        a:
+            COPYFROM 0
+        b:
+            OUTBOX
+        c:
+            INBOX
+            COPYTO   0
+            INBOX
+            SUB      0
+            JUMPN    a
+            ADD      0
+            JUMP     b
+    ''', _numbers(-99, 99), None),
+    'level_19_countdown': ('''
+        a:
+            INBOX
+            COPYTO   0
+            JUMP     c
+        b:
+            BUMPUP   0
+        c:
+        d:
+            OUTBOX
+            COPYFROM 0
+            JUMPZ    a
+            JUMPN    b
+            BUMPDN   0
+            JUMP     d
+    ''', _numbers(-20, 20), None),
+    'level_35_duplicate_removal': ('''
+            INBOX
+            COPYTO   [14]
+        a:
+            COPYFROM [14]
+            OUTBOX
+            BUMPUP   14
+        b:
+            INBOX
+            COPYTO   [14]
+            COPYFROM 14
+            COPYTO   13
+        c:
+            BUMPDN   13
+            JUMPN    a
+            COPYFROM [13]
+            SUB      [14]
+            JUMPZ    b
+            JUMP     c
+    ''', _numbers(1, 10), {14: '0'}),
+}
+
+
+def _time(func, repeat):
+    """
+    Calls func() `repeat` times; returns the individual timings in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def bench_engine(program, engine, inbox, small_inboxes, floor, repeat):
+    """
+    Returns the measurements for one engine on one level.
+    """
+    # instructions per second, on the big inbox
+    best = None
+    steps = 0
+    for _ in range(repeat):
+        run = program.bind(inbox=inbox, floor=floor)
+        start = time.perf_counter()
+        run.run(engine=engine)
+        elapsed = time.perf_counter() - start
+        steps = run.runtime
+        best = elapsed if best is None else min(best, elapsed)
+
+    # per-run latency, with bind included, on lots of small inboxes
+    latencies = sorted(_time_each(program, engine, small_inboxes, floor))
+
+    # peak memory of a big run
+    tracemalloc.start()
+    try:
+        program.bind(inbox=inbox, floor=floor).run(engine=engine)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'steps': steps,
+        'run_seconds': best,
+        'instructions_per_second': steps / best if best else None,
+        'latency_p50_us': _percentile(latencies, 0.5) * 1e6,
+        'latency_p90_us': _percentile(latencies, 0.9) * 1e6,
+        'latency_p99_us': _percentile(latencies, 0.99) * 1e6,
+        'peak_memory_bytes': peak,
+    }
+
+
+def _time_each(program, engine, inboxes, floor):
+    for inbox in inboxes:
+        start = time.perf_counter()
+        program.bind(inbox=inbox, floor=floor).run(engine=engine)
+        yield time.perf_counter() - start
+
+
+def bench_level(name, engines, size, runs, repeat, seed):
+    source, make_inbox, floor = SOLUTIONS[name]
+    rng = random.Random(seed)
+    inbox = make_inbox(rng, size)
+    small_inboxes = [make_inbox(rng, rng.randint(1, 20)) for _ in range(runs)]
+
+    parse = _time(lambda: Program(source), repeat * 10)
+    program = Program(source)
+    # Warm the caches, so the engines aren't charged for linking/compiling.
+    program.link()
+    program.compile()
+    bind = _time(lambda: program.bind(inbox=inbox, floor=floor), repeat)
+
+    return {
+        'parse_us': statistics.median(parse) * 1e6,
+        'bind_us': statistics.median(bind) * 1e6,
+        'inbox_size': size,
+        'engines': {
+            engine: bench_engine(program, engine, inbox, small_inboxes, floor, repeat)
+            for engine in engines
+        },
+    }
+
+
+def _bytes_per_run(make_runs, count):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        runs = make_runs()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del runs
+    return (after - before) / count
+
+
+def bench_memory(levels=None, count=10000, size=8, seed=0):
+    """
+    Returns the memory used per idle run (in bytes) for each level, with
+    `count` runs of `size` item inboxes held at once.
+    """
+    results = {}
+    for name in levels or SOLUTIONS:
+        source, make_inbox, floor = SOLUTIONS[name]
+        rng = random.Random(seed)
+        inboxes = [make_inbox(rng, size) for _ in range(count)]
+        program = Program(source)
+        program.compile()
+
+        def bound():
+            return [program.bind(inbox=inbox, floor=floor) for inbox in inboxes]
+
+        def waiting(compact=False):
+            runs = []
+            for inbox in inboxes:
+                run = program.bind(inbox=inbox, floor=floor).run(engine='compiled')
+                runs.append(run.compact() if compact else run)
+            return runs
+
+        def packed():
+            return [
+                program.bind(inbox=inbox, floor=floor).run(engine='compiled').pack()
+                for inbox in inboxes
+            ]
+
+        results[name] = {
+            'bound': _bytes_per_run(bound, count),
+            'waiting': _bytes_per_run(waiting, count),
+            'compact': _bytes_per_run(lambda: waiting(compact=True), count),
+            'packed': _bytes_per_run(packed, count),
+        }
+    return {'count': count, 'inbox_size': size, 'levels': results}
+
+
+def run_benchmarks(levels=None, engines=None, size=10000, runs=500, repeat=3, seed=0):
+    """
+    Runs the benchmarks, and returns the results as a JSON-friendly dict.
+    """
+    levels = levels or list(SOLUTIONS)
+    engines = engines or ENGINES
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'size': size,
+            'runs': runs,
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'levels': {
+            name: bench_level(name, engines, size, runs, repeat, seed)
+            for name in levels
+        },
+    }
+
+
+# For comparisons: whether a bigger number is better
+HIGHER_IS_BETTER = {'instructions_per_second'}
+COMPARED = [
+    'run_seconds', 'instructions_per_second',
+    'latency_p50_us', 'latency_p99_us', 'peak_memory_bytes',
+]
+
+
+def compare(base, new, threshold=0.1):
+    """
+    Compares two sets of results. Returns a list of (level, engine, metric,
+    old, new, change) for everything that got worse by more than `threshold`
+    (a fraction).
+    """
+    regressions = []
+    for level, new_level in new['levels'].items():
+        base_level = base['levels'].get(level)
+        if base_level is None:
+            continue
+        for metric in ('parse_us', 'bind_us'):
+            change = _change(metric, base_level[metric], new_level[metric])
+            if change is not None and change > threshold:
+                regressions.append((level, None, metric, base_level[metric], new_level[metric], change))
+        for engine, new_engine in new_level['engines'].items():
+            base_engine = base_level['engines'].get(engine)
+            if base_engine is None:
+                continue
+            for metric in COMPARED:
+                change = _change(metric, base_engine[metric], new_engine[metric])
+                if change is not None and change > threshold:
+                    regressions.append((level, engine, metric, base_engine[metric], new_engine[metric], change))
+    return regressions
+
+
+def _change(metric, old, new):
+    """
+    How much worse `new` is than `old`, as a fraction. Negative is better.
+    """
+    if not old or not new:
+        return None
+    if metric in HIGHER_IS_BETTER:
+        return old / new - 1
+    return new / old - 1
+
+
+def _print_results(results, file):
+    for level, data in results['levels'].items():
+        print(f"{level}: parse {data['parse_us']:.1f}us, bind {data['bind_us']:.1f}us", file=file)
+        for engine, e in data['engines'].items():
+            print(
+                f"  {engine:10} {e['instructions_per_second'] / 1e6:7.2f}M instr/s"
+                f"  p50 {e['latency_p50_us']:8.1f}us  p99 {e['latency_p99_us']:8.1f}us"
+                f"  peak {e['peak_memory_bytes'] / 1024:8.1f}KiB",
+                file=file,
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m hrmclone.benchmark', description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks (the default)')
+    compare_parser = subparsers.add_parser('compare', help='compare two saved results')
+    memory_parser = subparsers.add_parser('memory', help='measure the memory used by idle runs')
+
+    for p in (parser, run_parser):
+        p.add_argument('--levels', help='comma separated level names (default: all)')
+        p.add_argument('--engines', help='comma separated engine names (default: all)')
+        p.add_argument('--size', type=int, default=10000, help='size of the big synthetic inbox')
+        p.add_argument('--runs', type=int, default=500, help='number of small runs for latency')
+        p.add_argument('--repeat', type=int, default=3)
+        p.add_argument('--seed', type=int, default=0)
+        p.add_argument('--output', help='save the results to this JSON file')
+        p.add_argument('--compare', metavar='BASE', help='compare against results saved earlier')
+        p.add_argument('--threshold', type=float, default=0.1)
+
+    memory_parser.add_argument('--levels', help='comma separated level names (default: all)')
+    memory_parser.add_argument('--count', type=int, default=10000, help='number of runs to hold')
+    memory_parser.add_argument('--size', type=int, default=8, help='size of each inbox')
+    memory_parser.add_argument('--seed', type=int, default=0)
+
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        return _report(compare(base, new, args.threshold))
+
+    if args.command == 'memory':
+        results = bench_memory(
+            levels=args.levels.split(',') if args.levels else None,
+            count=args.count, size=args.size, seed=args.seed,
+        )
+        print(f"bytes per idle run ({results['count']} runs, {results['inbox_size']} item inboxes)")
+        print(f"{'':28} {'bound':>8} {'waiting':>8} {'compact':>8} {'packed':>8}")
+        for level, data in results['levels'].items():
+            print(
+                f"{level:28} {data['bound']:8.0f} {data['waiting']:8.0f}"
+                f" {data['compact']:8.0f} {data['packed']:8.0f}"
+            )
+        return 0
+
+    results = run_benchmarks(
+        levels=args.levels.split(',') if args.levels else None,
+        engines=args.engines.split(',') if args.engines else None,
+        size=args.size, runs=args.runs, repeat=args.repeat, seed=args.seed,
+    )
+    _print_results(results, sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            return _report(compare(json.load(f), results, args.threshold))
+    return 0
+
+
+def _report(regressions):
+    for level, engine, metric, old, new, change in regressions:
+        where = level if engine is None else f'{level} [{engine}]'
+        print(f'REGRESSION {where} {metric}: {old:.4g} -> {new:.4g} ({change:+.0%})')
+    if not regressions:
+        print('No regressions.')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""
+A flat, array-backed encoding of a Program, and a tight loop that runs it.
+
+link() lowers a parsed Program into three parallel arrays (opcode, operand,
+indirect flag), with jump targets already resolved to instruction indices.
+execute() then runs a ProgramRun against that encoding, keeping all the state
+in local variables instead of calling Instruction.execute() for every step.
+
+The encoding is one slot per instruction, so program_pointer means the same
+thing here as it does for the object engine.
+
+On CPython 3.11, with 20000-item inboxes, this runs about 2-2.5x as fast as
+the object engine on countdown, maximization room and duplicate removal
+(python -m hrmclone.benchmark). That's short of "several times": the
+interpreter's own dispatch overhead is most of what's left. The 'compiled'
+engine (hrmclone.compiler), which turns the program into Python source,
+gets several times.
+"""
+from array import array
+
+from . import core
+from . import exceptions
+from .core import FLOOR_TILES
+
+
+# Opcodes. The dispatch loop tests them roughly in order of how often they
+# turn up in real solutions.
+COPYFROM = 0
+COPYTO = 1
+JUMP = 2
+JUMPZ = 3
+JUMPN = 4
+ADD = 5
+SUB = 6
+BUMPUP = 7
+BUMPDN = 8
+INBOX = 9
+OUTBOX = 10
+NOP = 11
+
+OPCODE_NAMES = {
+    COPYFROM: 'COPYFROM',
+    COPYTO: 'COPYTO',
+    JUMP: 'JUMP',
+    JUMPZ: 'JUMPZ',
+    JUMPN: 'JUMPN',
+    ADD: 'ADD',
+    SUB: 'SUB',
+    BUMPUP: 'BUMPUP',
+    BUMPDN: 'BUMPDN',
+    INBOX: 'INBOX',
+    OUTBOX: 'OUTBOX',
+    NOP: 'NOP',
+}
+
+# Checked in order, so subclasses must come before their bases.
+_LOWERING = [
+    (core.Inbox, INBOX),
+    (core.Outbox, OUTBOX),
+    (core.JumpZ, JUMPZ),
+    (core.JumpN, JUMPN),
+    (core.Jump, JUMP),
+    (core.CopyFrom, COPYFROM),
+    (core.CopyTo, COPYTO),
+    (core.Sub, SUB),
+    (core.Add, ADD),
+    (core.BumpDn, BUMPDN),
+    (core.BumpUp, BUMPUP),
+    (core._Noop, NOP),
+]
+
+JUMPS = (JUMP, JUMPZ, JUMPN)
+
+
+def lower(instruction, program):
+    """
+    Returns the (opcode, operand, indirect) triple for a single instruction.
+    """
+    for klass, opcode in _LOWERING:
+        if isinstance(instruction, klass):
+            break
+    else:
+        raise exceptions.NoSuchInstruction(str(instruction))
+
+    if opcode in JUMPS:
+        return opcode, program.jump_targets[instruction.jump_target], 0
+    if opcode == NOP or not isinstance(instruction, core._FloorInstruction):
+        return opcode, 0, 0
+    return opcode, instruction.floor_index, int(instruction.pointer)
+
+
+class LinkedProgram:
+    """
+    The lowered form of a Program. Doesn't hold any run state, so one of these
+    can be shared between any number of runs.
+    """
+    def __init__(self, opcodes, operands, indirect):
+        self.opcodes = opcodes
+        self.operands = operands
+        self.indirect = indirect
+        # Tuples of small ints are quicker to index from Python than arrays.
+        self.code = tuple(zip(opcodes, operands, indirect))
+        self.dispatch, self.counted = _specialise(self.code)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getstate__(self):
+        return (self.opcodes, self.operands, self.indirect)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def dump(self):
+        """
+        Returns a human readable listing of the encoding.
+        """
+        lines = []
+        for i, (opcode, operand, indirect) in enumerate(self.code):
+            name = OPCODE_NAMES[opcode]
+            if opcode in (INBOX, OUTBOX, NOP):
+                lines.append(f'{i:4} {name}')
+            elif indirect:
+                lines.append(f'{i:4} {name} [{operand}]')
+            else:
+                lines.append(f'{i:4} {name} {operand}')
+        return '\n'.join(lines)
+
+
+def link(program):
+    """
+    Lowers a parsed (and validated) Program into a LinkedProgram.
+    """
+    opcodes = array('b')
+    operands = array('i')
+    indirect = array('b')
+    for instruction in program.instructions:
+        opcode, operand, ind = lower(instruction, program)
+        opcodes.append(opcode)
+        operands.append(operand)
+        indirect.append(ind)
+    return LinkedProgram(opcodes, operands, indirect)
+
+
+def _resolve_pointer(floor, index):
+    """
+    Same checks as _FloorInstruction.resolve_floor_index().
+    """
+    floor_index = floor[index]
+    if floor_index is None:
+        raise exceptions.EmptyFloorTile
+    if type(floor_index) is not int:
+        raise exceptions.MathDomainError
+    if floor_index >= FLOOR_TILES or floor_index < 0:
+        raise exceptions.InvalidFloorIndex
+    return floor_index
+
+
+# execute() runs a specialised form of the encoding: (opcode, operand) pairs,
+# with opcodes of its own which are split by addressing mode (all the
+# pointer ones share _D_INDIRECT, whose operand is the (opcode, tile) pair),
+# numbered so that the dispatch loop can halve them with a single test, and
+# with an _D_END after the last instruction, so the loop needn't check for
+# running off the end.
+_D_COPYFROM = 0
+_D_COPYTO = 1
+_D_JUMP = 2
+_D_JUMPZ = 3
+_D_JUMPN = 4
+_D_OUTBOX = 5
+_D_INBOX = 6
+_D_BUMPUP = 7
+_D_BUMPDN = 8
+_D_ADD = 9
+_D_SUB = 10
+_D_INDIRECT = 11
+_D_END = 12
+_D_NOP = 13
+
+_SPECIALISED = {
+    COPYFROM: _D_COPYFROM,
+    COPYTO: _D_COPYTO,
+    JUMP: _D_JUMP,
+    JUMPZ: _D_JUMPZ,
+    JUMPN: _D_JUMPN,
+    OUTBOX: _D_OUTBOX,
+    INBOX: _D_INBOX,
+    BUMPUP: _D_BUMPUP,
+    BUMPDN: _D_BUMPDN,
+    ADD: _D_ADD,
+    SUB: _D_SUB,
+    NOP: _D_NOP,
+}
+
+
+def _specialise(code):
+    """
+    Returns execute()'s form of `code`, and the number of instructions which
+    count towards runtime (everything but NOPs) before each slot.
+    """
+    dispatch = []
+    counted = [0]
+    for op, arg, indirect in code:
+        if indirect:
+            dispatch.append((_D_INDIRECT, (op, arg)))
+        else:
+            dispatch.append((_SPECIALISED[op], arg))
+        counted.append(counted[-1] + (op != NOP))
+    dispatch.append((_D_END, 0))
+    return tuple(dispatch), tuple(counted)
+
+
+# For the unusual cases (letters), the engines defer to the instructions themselves.
+_add = core.Add._do_math
+_sub = core.Sub._do_math
+
+
+def _indirect(op, tile, hands, floor):
+    """
+    Runs a COPYFROM, COPYTO, ADD, SUB, BUMPUP or BUMPDN through the pointer
+    on `tile`, with the same checks in the same order as the object engine.
+    Returns the new hands.
+    """
+    if hands is None and (op == COPYTO or op == ADD or op == SUB):
+        raise exceptions.EmptyHands
+    index = _resolve_pointer(floor, tile)
+    value = floor[index]
+    if op == COPYTO:
+        floor[index] = hands
+        return hands
+    if value is None:
+        raise exceptions.EmptyFloorTile
+    if op == COPYFROM:
+        return value
+    if op == BUMPUP or op == BUMPDN:
+        if type(value) is not int:
+            raise exceptions.MathDomainError
+        floor[index] = value = value + 1 if op == BUMPUP else value - 1
+        return value
+    if type(hands) is int and type(value) is int:
+        return hands + value if op == ADD else hands - value
+    return _add(None, hands, value) if op == ADD else _sub(None, hands, value)
+
+
+def execute(run, guard=None):
+    """
+    Runs `run` to completion using its program's linked form.
+
+    `guard`, if given, is called after every backward jump (see hrmclone.limits).
+    """
+    dispatch = run.program.link().dispatch
+    counted = run.program.link().counted
+    floor = run._floor
+    emit = run._emit
+    inbox = run._inbox
+    inbox_pos = run._inbox_pos
+    inbox_len = len(inbox)
+    source = run._inbox_source
+    hands = run._hands
+    pc = run.program_pointer
+    # runtime is only brought up to date at each taken jump (and at the end),
+    # by counting the instructions from `start`, where the jump landed, up to
+    # the jump; in between, the run goes straight down the program.
+    runtime = run.runtime
+    start = pc
+
+    try:
+        while True:
+            op, arg = dispatch[pc]
+
+            if op < _D_OUTBOX:
+                if op == _D_COPYFROM:
+                    hands = floor[arg]
+                    if hands is None:
+                        raise exceptions.EmptyFloorTile
+                elif op == _D_COPYTO:
+                    if hands is None:
+                        raise exceptions.EmptyHands
+                    floor[arg] = hands
+                elif (
+                    op == _D_JUMP
+                    or (hands == 0 if op == _D_JUMPZ else type(hands) is int and hands < 0)
+                ):
+                    runtime += counted[pc + 1] - counted[start]
+                    if arg <= pc and guard is not None:
+                        pc = start = arg
+                        guard(pc, runtime, hands, inbox_pos)
+                    pc = start = arg
+                    continue
+                elif hands is None:
+                    # JUMPZ or JUMPN, not taken because there's nothing to test
+                    raise exceptions.EmptyHands
+            elif op == _D_OUTBOX:
+                if hands is None:
+                    raise exceptions.EmptyHands
+                emit(hands)
+                hands = None
+            elif op == _D_INBOX:
+                if inbox_pos >= inbox_len:
+                    if source is None:
+                        # End of the program (see ProgramRun._run)
+                        break
+                    run._inbox_pos = inbox_pos
+                    if not run._pull_inbox():
+                        break
+                    inbox = run._inbox
+                    inbox_pos = 0
+                    inbox_len = len(inbox)
+                hands = inbox[inbox_pos]
+                inbox_pos += 1
+            elif op <= _D_BUMPDN:
+                value = floor[arg]
+                if value is None:
+                    raise exceptions.EmptyFloorTile
+                if type(value) is not int:
+                    raise exceptions.MathDomainError
+                hands = floor[arg] = value + 1 if op == _D_BUMPUP else value - 1
+            elif op <= _D_SUB:
+                if hands is None:
+                    raise exceptions.EmptyHands
+                operand = floor[arg]
+                if operand is None:
+                    raise exceptions.EmptyFloorTile
+                if type(hands) is int and type(operand) is int:
+                    hands = hands + operand if op == _D_ADD else hands - operand
+                elif op == _D_ADD:
+                    hands = _add(None, hands, operand)
+                else:
+                    hands = _sub(None, hands, operand)
+            elif op == _D_INDIRECT:
+                base, tile = arg
+                if base == COPYFROM:
+                    hands = None
+                hands = _indirect(base, tile, hands, floor)
+            elif op == _D_END:
+                break
+            # else NOP, which doesn't count towards runtime (see `counted`)
+
+            pc += 1
+    finally:
+        run._inbox_pos = inbox_pos
+        run._hands = hands
+        run.program_pointer = pc
+        run.runtime = runtime + counted[pc] - counted[start]
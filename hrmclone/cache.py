@@ -0,0 +1,142 @@
+"""
+Caches parsed Programs, keyed by a hash of their source.
+
+Parsing and validating is cheap for one program, but not when the same few
+solutions are submitted over and over. A ProgramCache keeps recently used
+Programs in memory, and can also store them on disk, so a fresh process
+(a restarted worker, say) doesn't have to parse them again either.
+"""
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+from .core import Program
+
+
+# Bump this whenever Program's pickled form changes, so old files on disk
+# get ignored instead of loaded.
+CACHE_VERSION = 4
+
+
+def normalise(text):
+    """
+    Returns the parts of the source the parser pays attention to: stripped
+    lines, without blank lines or '--' comments, each along with the line
+    and column it starts at (which end up in Program.positions).
+    """
+    lines = []
+    for lineno, line in enumerate(text.split('\n'), 1):
+        stripped = line.strip()
+        if stripped and not stripped.startswith('--'):
+            lines.append(f'{lineno}:{line.find(stripped) + 1}:{stripped}')
+    return '\n'.join(lines)
+
+
+def source_key(text):
+    """
+    The cache key for a program's source. Sources which only differ in
+    trailing whitespace or what their comments say get the same key; not
+    ones where anything the parser keeps is on a different line or column,
+    since the cached Program's positions would be wrong for them.
+    """
+    return hashlib.sha256(normalise(text).encode('utf-8')).hexdigest()
+
+
+class ProgramCache:
+    """
+    A bounded LRU cache of Programs, optionally backed by a directory on disk.
+
+    Programs parsed with errors aren't cached; the error is raised every time.
+
+    Files in `directory` are pickles, so only point it somewhere nobody
+    else can write to.
+    """
+    def __init__(self, maxsize=1024, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.programs = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.programs)
+
+    def get(self, text):
+        """
+        Returns the Program for `text`, parsing it only if it's not already cached.
+        """
+        key = source_key(text)
+        with self.lock:
+            program = self.programs.get(key)
+            if program is not None:
+                self.programs.move_to_end(key)
+                self.hits += 1
+                return program
+
+        program = self._load(key)
+        if program is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            program = Program(text)
+            # Link it now so the linked form is saved along with it.
+            program.link()
+            self._save(key, program)
+
+        with self.lock:
+            self.programs[key] = program
+            while len(self.programs) > self.maxsize:
+                self.programs.popitem(last=False)
+        return program
+
+    def clear(self):
+        """
+        Empties the in-memory cache. Anything on disk is left alone.
+        """
+        with self.lock:
+            self.programs.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.programs),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.v{CACHE_VERSION}.pickle')
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # Corrupt, or from an incompatible version of the code. Parse it again.
+            return None
+
+    def _save(self, key, program):
+        if self.directory is None:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and move it into place, so other processes
+        # never see a half-written file.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(program, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
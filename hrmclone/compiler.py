@@ -0,0 +1,340 @@
+"""
+Compiles a Program into a specialised Python function.
+
+The program is split into basic blocks, and each block becomes a run of
+straight-line Python with the instruction semantics (and their error checks)
+written out inline, operands and all. Hands, floor and the program pointer
+live in local variables, and the pointer is only consulted when control
+moves between blocks.
+
+Compiling is done once per Program (see Program.compile()); after that every
+run of the program goes straight to the generated function.
+
+A program can also be compiled for a particular starting signature (what kind
+of value the hands and each floor tile hold). hrmclone.analysis then works
+out which checks can never fail from that start, and they're left out.
+"""
+from . import bytecode
+from . import exceptions
+from .bytecode import (
+    ADD, BUMPDN, BUMPUP, COPYFROM, COPYTO, INBOX, JUMP, JUMPN, JUMPZ, NOP, OUTBOX, SUB,
+)
+from .analysis import KIND_EXAMPLES, analyse, signature
+from .core import FLOOR_TILES, Add, Sub
+
+
+class CompiledProgram:
+    """
+    The generated function for a program, along with the source it was built from.
+    """
+    def __init__(self, source, function, leaders):
+        self.source = source
+        self.function = function
+        self.leaders = leaders
+
+    def __call__(self, run, guard=None):
+        return self.function(run, guard)
+
+
+def find_leaders(code):
+    """
+    Returns the indices that start a basic block.
+
+    As well as the usual leaders (jump targets, and whatever follows a jump),
+    every INBOX starts a block, since that's where a run stops when the inbox
+    runs dry, and so where it might be resumed from.
+    """
+    end = len(code)
+    leaders = {0}
+    for i, (op, arg, indirect) in enumerate(code):
+        if op in bytecode.JUMPS:
+            leaders.add(arg)
+            leaders.add(i + 1)
+        elif op == INBOX:
+            leaders.add(i)
+    return sorted(leader for leader in leaders if leader < end)
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+
+    def __call__(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def source(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _emit_resolve(w, arg, indirect, safe=()):
+    """
+    Emits the floor index for an instruction; for pointers that means emitting the
+    checks from _FloorInstruction.resolve_floor_index(). Returns the expression
+    that holds the index.
+    """
+    if not indirect:
+        return str(arg)
+    w(f'index = floor[{arg}]')
+    if 'pointer' in safe:
+        return 'index'
+    w('if index is None:')
+    w('    raise EmptyFloorTile')
+    w('if type(index) is not int:')
+    w('    raise MathDomainError')
+    w(f'if index >= {FLOOR_TILES} or index < 0:')
+    w('    raise InvalidFloorIndex')
+    return 'index'
+
+
+def _emit_instruction(w, op, arg, indirect, safe=()):
+    """
+    Emits the body of one instruction which doesn't transfer control, leaving
+    out the checks named in `safe` (see hrmclone.analysis.CHECKS).
+    """
+    def check(name, condition, error):
+        if name not in safe:
+            w(f'if {condition}:')
+            w(f'    raise {error}')
+
+    if op == COPYFROM:
+        w('hands = None')
+        index = _emit_resolve(w, arg, indirect, safe)
+        w(f'hands = floor[{index}]')
+        check('tile', 'hands is None', 'EmptyFloorTile')
+    elif op == COPYTO:
+        check('hands', 'hands is None', 'EmptyHands')
+        index = _emit_resolve(w, arg, indirect, safe)
+        w(f'floor[{index}] = hands')
+    elif op in (ADD, SUB):
+        check('hands', 'hands is None', 'EmptyHands')
+        index = _emit_resolve(w, arg, indirect, safe)
+        w(f'value = floor[{index}]')
+        check('tile', 'value is None', 'EmptyFloorTile')
+        sign = '+' if op == ADD else '-'
+        if 'numbers' in safe:
+            w(f'hands = hands {sign} value')
+        else:
+            w('if type(hands) is int and type(value) is int:')
+            w(f'    hands = hands {sign} value')
+            w('else:')
+            w(f'    hands = {"add_other" if op == ADD else "sub_other"}(None, hands, value)')
+    elif op in (BUMPUP, BUMPDN):
+        index = _emit_resolve(w, arg, indirect, safe)
+        w(f'value = floor[{index}]')
+        check('tile', 'value is None', 'EmptyFloorTile')
+        check('numbers', 'type(value) is not int', 'MathDomainError')
+        w(f'hands = floor[{index}] = value {"+" if op == BUMPUP else "-"} 1')
+    elif op == OUTBOX:
+        check('hands', 'hands is None', 'EmptyHands')
+        w('emit(hands)')
+        w('hands = None')
+    else:
+        raise AssertionError(f"can't inline opcode {op}")
+
+
+class AtLoopHead(exceptions.RunAborted):
+    """
+    Raised by code compiled with `watch` when it arrives at the head of a loop
+    that has gone round enough times in a row (see hrmclone.loops).
+    """
+
+
+def _emit_guard(w, i, target, watch=None):
+    """
+    Emits a call to the guard, if the jump from `i` to `target` goes backwards;
+    and for watched loops, keeps count of how many times in a row each one
+    has gone round.
+    """
+    if target <= i:
+        w('if guard is not None:')
+        w('    guard(pc, runtime, hands, inbox_pos)')
+    hot = None
+    for head, (back, warm_up) in sorted((watch or {}).items()):
+        if not head <= i <= back:
+            continue
+        if i == back and target == head:
+            hot = head, warm_up
+        elif not head <= target <= back:
+            # leaving the loop
+            w(f'hot_{head} = 0')
+    if hot is not None:
+        head, warm_up = hot
+        w(f'hot_{head} += 1')
+        w(f'if hot_{head} >= {warm_up}:')
+        w('    raise AtLoopHead')
+
+
+def generate(linked, safe=None, watch=None):
+    """
+    Returns the Python source for a LinkedProgram, its block leaders, and the
+    counted_before table the source refers to.
+
+    `safe`, if given, maps instruction indices to the checks which can be left
+    out of them (see hrmclone.analysis.Analysis.safe).
+
+    `watch`, if given, maps loop heads to (index of the jump back, warm up).
+    The code raises AtLoopHead, stopped at the head, once one of those loops
+    has gone round `warm up` times in a row, counting in local variables
+    rather than calling out on every iteration.
+    """
+    code = linked.code
+    safe = safe or {}
+    end = len(code)
+    leaders = find_leaders(code)
+
+    # For each instruction, how many counted instructions come before it in its
+    # own block. Used to fix up runtime when an instruction raises.
+    counted_before = [0] * end
+
+    w = _Writer()
+    w('def run_compiled(run, guard):')
+    w.indent += 1
+    w('floor = run._floor')
+    w('emit = run._emit')
+    w('inbox = run._inbox')
+    w('inbox_pos = run._inbox_pos')
+    w('inbox_len = len(inbox)')
+    w('source = run._inbox_source')
+    w('hands = run._hands')
+    w('pc = run.program_pointer')
+    w('runtime = run.runtime')
+    w('pos = pc')
+    for head in sorted(watch or ()):
+        w(f'hot_{head} = 0')
+    w('try:')
+    w.indent += 1
+    w('while True:')
+    w.indent += 1
+
+    for b, start in enumerate(leaders):
+        stop = leaders[b + 1] if b + 1 < len(leaders) else end
+        w(f'{"if" if b == 0 else "elif"} pc == {start}:')
+        w.indent += 1
+        counted = 0
+        for i in range(start, stop):
+            op, arg, indirect = code[i]
+            counted_before[i] = counted
+            w(f'# {i}: {bytecode.OPCODE_NAMES[op]}')
+            if op == NOP:
+                continue
+            if op == JUMP:
+                w(f'pc = {arg}')
+                w(f'runtime += {counted + 1}')
+                _emit_guard(w, i, arg, watch)
+                w('continue')
+                break
+            w(f'pos = {i}')
+            checks = safe.get(i, ())
+            if op in (JUMPZ, JUMPN):
+                if 'hands' not in checks:
+                    w('if hands is None:')
+                    w('    raise EmptyHands')
+                if op == JUMPZ:
+                    w('if hands == 0:')
+                elif 'numbers' in checks:
+                    w('if hands < 0:')
+                else:
+                    w('if type(hands) is int and hands < 0:')
+                w(f'    pc = {arg}')
+                w(f'    runtime += {counted + 1}')
+                w.indent += 1
+                _emit_guard(w, i, arg, watch)
+                w.indent -= 1
+                w('    continue')
+                counted += 1
+                w(f'pc = {i + 1}')
+                w(f'runtime += {counted}')
+                _emit_guard(w, i, i + 1, watch)
+                w('continue')
+                break
+            if op == INBOX:
+                # INBOX is always first in its block.
+                w('if inbox_pos >= inbox_len:')
+                w('    if source is None:')
+                w('        break')
+                w('    run._inbox_pos = inbox_pos')
+                w('    if not run._pull_inbox():')
+                w('        break')
+                w('    inbox = run._inbox')
+                w('    inbox_pos = 0')
+                w('    inbox_len = len(inbox)')
+                w('hands = inbox[inbox_pos]')
+                w('inbox_pos += 1')
+            else:
+                _emit_instruction(w, op, arg, indirect, checks)
+            counted += 1
+        else:
+            # fell off the end of the block, into the next one (or the end of
+            # the program)
+            w(f'pc = {stop}')
+            w(f'runtime += {counted}')
+            w('continue')
+        w.indent -= 1
+
+    w('else:' if leaders else 'if True:')
+    w('    # the end of the program, or somewhere we can\'t enter')
+    w('    break')
+    w.indent -= 2
+    w('except RunAborted:')
+    w('    # raised by the guard, with the state already up to date')
+    w('    raise')
+    w('except (RunError, InvalidFloorIndex):')
+    w('    pc = pos')
+    w('    runtime += counted_before[pos]')
+    w('    raise')
+    w('finally:')
+    w('    run._inbox_pos = inbox_pos')
+    w('    run._hands = hands')
+    w('    run.program_pointer = pc')
+    w('    run.runtime = runtime')
+
+    return w.source(), leaders, tuple(counted_before)
+
+
+def compile_program(program, signature=None, watch=None):
+    """
+    Builds a CompiledProgram for a (validated) Program; specialised for runs
+    which start at the first instruction with the given signature (see
+    hrmclone.analysis.signature()), if there is one. `watch` is as for generate().
+    """
+    safe = None
+    if signature is not None:
+        hands, *floor = (KIND_EXAMPLES[kind] for kind in signature)
+        safe = analyse(program, floor, hands=hands, exact=False).safe
+    source, leaders, counted_before = generate(program.link(), safe, watch)
+    namespace = {
+        'counted_before': counted_before,
+        'add_other': Add._do_math,
+        'sub_other': Sub._do_math,
+        'RunError': exceptions.RunError,
+        'RunAborted': exceptions.RunAborted,
+        'AtLoopHead': AtLoopHead,
+        'EmptyHands': exceptions.EmptyHands,
+        'EmptyFloorTile': exceptions.EmptyFloorTile,
+        'MathDomainError': exceptions.MathDomainError,
+        'InvalidFloorIndex': exceptions.InvalidFloorIndex,
+    }
+    exec(compile(source, f'<hrmclone compiled program {id(program):#x}>', 'exec'), namespace)
+    return CompiledProgram(source, namespace['run_compiled'], frozenset(leaders))
+
+
+def execute(run, guard=None):
+    """
+    Runs `run` to completion using its program's compiled form.
+
+    `guard`, if given, is called after every backward jump (see hrmclone.limits).
+    """
+    program = run.program
+    if run.program_pointer == 0:
+        # Where the analysis starts from, so the checks it proved unnecessary
+        # for a run starting like this one can be left out.
+        compiled = program.compile(signature(run._hands, run._floor))
+    else:
+        compiled = program.compile()
+    if run.program_pointer in compiled.leaders or run.program_pointer >= len(run.program.instructions):
+        compiled(run, guard)
+    else:
+        # Resuming from the middle of a block. That can't be done from the
+        # generated code, so let the bytecode engine deal with it.
+        bytecode.execute(run, guard)
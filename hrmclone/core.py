@@ -1,12 +1,20 @@
-import re
+import array
+import collections.abc
+import copy
+import importlib
+import itertools
+import marshal
 import string
-import sys
 
 from . import exceptions
+from .drawings import DRAWING_MODES, DrawingSpan
 
 
 FLOOR_TILES = 20
 
+# How many specialised compilations a Program keeps (see Program.compile()).
+MAX_SPECIALIZED = 32
+
 
 def is_int(x):
     try:
@@ -16,13 +24,41 @@ def is_int(x):
         return False
 
 
+def parse_value(value):
+    """
+    Converts a value from the outside world into the form the engines use:
+    numbers are ints, letters stay as (one-character) strings, and empty is None.
+
+    This is done once, when a program is bound to its inbox and floor.
+    """
+    if value is None or type(value) is int:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def format_value(value):
+    """
+    The reverse of parse_value(): every value becomes a string again (except None).
+    """
+    if value is None:
+        return None
+    return str(value)
+
+
 class InstructionRegistry(type):
     """
     A nice little thingy that registers instructions automatically.
+
+    It also gives every instruction class empty __slots__ unless it declares
+    its own, so instructions don't each carry a __dict__ around.
     """
     instructions = {}
 
     def __new__(meta, name, bases, classdict):
+        classdict.setdefault('__slots__', ())
         klass = super().__new__(meta, name, bases, classdict)
         if not name.startswith('_'):
             command_text = name.lower().replace('_', ' ')
@@ -31,6 +67,8 @@ class InstructionRegistry(type):
 
 
 class Instruction(object, metaclass=InstructionRegistry):
+    __slots__ = ('text',)
+
     @staticmethod
     def get(line):
         """
@@ -78,22 +116,23 @@ class Instruction(object, metaclass=InstructionRegistry):
 
 class Inbox(Instruction):
     def execute(self, program):
-        try:
-            item = program.inbox.pop(0)
-        except IndexError:
+        if program._inbox_pos >= len(program._inbox) and not program._pull_inbox():
             raise exceptions.EmptyInbox
-        program.hands = item
+        program._hands = program._inbox[program._inbox_pos]
+        program._inbox_pos += 1
 
 
 class Outbox(Instruction):
     def execute(self, program):
-        if not program.hands:
+        if program._hands is None:
             raise exceptions.EmptyHands
-        program.outbox.append(program.hands)
-        program.hands = None
+        program._emit(program._hands)
+        program._hands = None
 
 
 class Jump(Instruction):
+    __slots__ = ('jump_target',)
+
     def __init__(self, jump_target):
         self.jump_target = jump_target
 
@@ -111,27 +150,24 @@ class Jump(Instruction):
 
 class JumpZ(Jump):
     def execute(self, program):
-        if not program.hands:
+        if program._hands is None:
             raise exceptions.EmptyHands
-        if program.hands == '0':
+        if program._hands == 0:
             super().execute(program)
 
 
 class JumpN(Jump):
     def execute(self, program):
-        if not program.hands:
+        if program._hands is None:
             raise exceptions.EmptyHands
-        try:
-            val = int(program.hands)
-        except ValueError:
-            # 'A' < 0? Ignore.
-            pass
-        else:
-            if val < 0:
-                super().execute(program)
+        # 'A' < 0? Ignore.
+        if type(program._hands) is int and program._hands < 0:
+            super().execute(program)
 
 
 class _FloorInstruction(Instruction):
+    __slots__ = ('pointer', 'floor_index')
+
     def __init__(self, floor_index):
         self.pointer = False
         if floor_index.startswith('['):
@@ -143,15 +179,13 @@ class _FloorInstruction(Instruction):
     def resolve_floor_index(self, program):
         if self.pointer:
             # Resolve the pointer!
-            floor_index = program.floor[self.floor_index]
+            floor_index = program._floor[self.floor_index]
             if floor_index is None:
                 # null pointer!
                 raise exceptions.EmptyFloorTile
 
             # pointer values must be numeric
-            try:
-                floor_index = int(floor_index)
-            except ValueError:
+            if type(floor_index) is not int:
                 raise exceptions.MathDomainError
 
             # and point to a valid floor tile
@@ -170,42 +204,39 @@ class _FloorInstruction(Instruction):
 
 class CopyFrom(_FloorInstruction):
     def execute(self, program):
-        program.hands = None
+        program._hands = None
         floor_index = self.resolve_floor_index(program)
-        if not program.floor[floor_index]:
+        if program._floor[floor_index] is None:
             raise exceptions.EmptyFloorTile
-        program.hands = program.floor[floor_index]
+        program._hands = program._floor[floor_index]
 
 
 class CopyTo(_FloorInstruction):
     def execute(self, program):
-        if not program.hands:
+        if program._hands is None:
             raise exceptions.EmptyHands
         floor_index = self.resolve_floor_index(program)
-        program.floor[floor_index] = program.hands
+        program._floor[floor_index] = program._hands
 
 
 class _MathInstruction(_FloorInstruction):
     def execute(self, program):
-        if program.hands is None:
+        if program._hands is None:
             raise exceptions.EmptyHands
 
         floor_index = self.resolve_floor_index(program)
 
-        if not program.floor[floor_index]:
+        operand = program._floor[floor_index]
+        if operand is None:
             raise exceptions.EmptyFloorTile
 
-        operand = program.floor[floor_index]
-
-        program.hands = self._do_math(program.hands, operand)
+        program._hands = self._do_math(program._hands, operand)
 
 
 class Add(_MathInstruction):
     def _do_math(self, a, b):
         # You can't ADD when either operand is a letter
-        try:
-            a, b = int(a), int(b)
-        except ValueError:
+        if type(a) is not int or type(b) is not int:
             raise exceptions.MathDomainError(
                 f"Can't ADD '{a}' and '{b}'"
             )
@@ -223,16 +254,16 @@ class Add(_MathInstruction):
 
         #     return result
         # else:
-        # '1' + '1' == '2'
-        return str(a + b)
+        # 1 + 1 == 2
+        return a + b
 
 
 class Sub(Add):
     def _do_math(self, a, b):
         # You can SUB when a and b are *both* numbers, or *both* letters.
-        if (is_int(a), is_int(b)) == (True, True):
-            return str(int(a) - int(b))
-        elif (is_int(a), is_int(b)) == (False, False):
+        if (type(a) is int, type(b) is int) == (True, True):
+            return a - b
+        elif (type(a) is int, type(b) is int) == (False, False):
             # Convert both to integers, sum them, and convert back to chars.
 
             if b.upper() < a.upper():
@@ -254,6 +285,8 @@ class _Noop(Instruction):
 
 
 class Comment(_Noop):
+    __slots__ = ('comment_key',)
+
     def __init__(self, comment_key):
         # This is a key into program.comment_data,
         # But that dict will be empty until validate() time.
@@ -266,24 +299,38 @@ class Comment(_Noop):
 
 class _ExtraLines(_Noop):
     def _parse_extra_lines(self, program, lines_iter):
-        line = ''
-        data = ''
+        """
+        Reads the drawing data after a DEFINE, up to the ';' that ends it.
+
+        Depending on program.drawings, returns it as a str, returns a
+        DrawingSpan of where it is in the source, or skips it and returns None.
+        """
+        mode = program.drawings
+        start = lines_iter.offset if mode == 'offsets' else None
+        parts = []
         while True:
-            line = next(lines_iter)
+            line = next(lines_iter, '')
             if not line:
                 # EOF !?
                 raise exceptions.ParseError(
                     "Reached EOF while processing DEFINE COMMENT. Should end with a ';'"
                 )
             line = line.strip()
-            data += line
             if line.endswith(';'):
-                data = data[:-1]
                 break
-        return data
+            if mode == 'keep':
+                parts.append(line)
+        if mode == 'keep':
+            parts.append(line[:-1])
+            return ''.join(parts)
+        if mode == 'offsets':
+            return DrawingSpan(start, lines_iter.offset)
+        return None
 
 
 class Define_Comment(_ExtraLines):
+    __slots__ = ('comment_index',)
+
     def __init__(self, comment_index):
         self.comment_index = int(comment_index)
 
@@ -293,6 +340,8 @@ class Define_Comment(_ExtraLines):
 
 
 class Define_Label(_FloorInstruction, _ExtraLines):
+    # Only one base of a class can have non-empty __slots__, which is why
+    # _ExtraLines and _Noop have none.
     def parse_extra_lines(self, program, lines_iter):
         data = self._parse_extra_lines(program, lines_iter)
         program.label_data[self.floor_index] = data
@@ -304,95 +353,449 @@ class BumpUp(_FloorInstruction):
     def execute(self, program):
         floor_index = self.resolve_floor_index(program)
 
-        if not program.floor[floor_index]:
+        val = program._floor[floor_index]
+        if val is None:
             raise exceptions.EmptyFloorTile
-        try:
-            val = int(program.floor[floor_index])
-        except ValueError:
+        if type(val) is not int:
             raise exceptions.MathDomainError
-        program.floor[floor_index] = str(val + self.amount)
-        program.hands = program.floor[floor_index]
+        program._floor[floor_index] = program._hands = val + self.amount
 
 
 class BumpDn(BumpUp):
     amount = -1
 
 
+# Execution engines other than the plain object one.
+# Maps engine name to the module with its execute(run) function.
+ENGINES = {
+    'bytecode': 'hrmclone.bytecode',
+    'peephole': 'hrmclone.peephole',
+    'compiled': 'hrmclone.compiler',
+    'accelerated': 'hrmclone.loops',
+}
+
+
+def get_engine(name):
+    """
+    Returns the execute(run) function for the named engine.
+    """
+    try:
+        module_name = ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown engine: {name!r}")
+    return importlib.import_module(module_name).execute
+
+
 class Program:
     """
     Represents a sequence of instructions which can be run, but has no associated state.
     """
-    def _parse(self, text):
-        line_iterator = iter(text.split('\n'))
-        instructions = []
-        jump_targets = {}
-        for line in line_iterator:
-            line = line.strip()
-            if (not line) or line.startswith('--'):
-                # empty or an actual comment, can discard.
-                # there's one of these comments in the header of each program.
-                continue
+    def _parse(self, source):
+        from .parser import parse
+        return parse(self, source)
 
-            match = re.match(r'([a-z]):$', line)
-            if match:
-                # This is a label for a jump target, not an instruction.
-                jump_targets[match.group(1)] = len(instructions)
-                continue
+    @classmethod
+    def from_source(cls, text, cache=None):
+        """
+        Returns a Program for `text`.
 
-            instruction = Instruction.get(line)
+        If `cache` (a hrmclone.cache.ProgramCache) is given, the program comes
+        from the cache when it's been seen before, without being parsed again.
+        """
+        if cache is None:
+            return cls(text)
+        return cache.get(text)
+
+    @classmethod
+    def from_file(cls, path, drawings='keep'):
+        """
+        Parses the program saved in the file at `path`.
+        """
+        from .parser import open_source
+        source, f = open_source(path)
+        try:
+            return cls(source, drawings=drawings)
+        finally:
+            if source:
+                source.close()
+            f.close()
 
-            # For complex instructions ('DEFINE COMMENT') extra lines might be
-            # required. Give the instruction parser access to the instruction stream
-            # so it can fetch more lines if necessary.
-            instruction.parse_extra_lines(self, line_iterator)
-            instructions.append(instruction)
-        return instructions, jump_targets
+    def __init__(self, text, drawings='keep'):
+        """
+        `text` is the program source; a str, bytes, an mmap or an open file.
 
-    def __init__(self, text):
+        `drawings` says what to do with the drawings DEFINE COMMENT and
+        DEFINE LABEL carry, which running the program never needs: 'keep'
+        them in comment_data and label_data, only record their 'offsets' in
+        the source there (as hrmclone.drawings.DrawingSpans), or 'skip' them
+        and record None.
+        """
+        if drawings not in DRAWING_MODES:
+            raise ValueError(f"Unknown drawings mode: {drawings!r}")
+        self.drawings = drawings
         self.comment_data = {}
         self.label_data = {}
-        self.instructions, self.jump_targets = self._parse(text)
-        for instruction in self.instructions:
-            instruction.validate(self)
+        self.instructions, self.jump_targets, self.positions = self._parse(text)
+        for instruction, (line, column) in zip(self.instructions, self.positions):
+            try:
+                instruction.validate(self)
+            except exceptions.ParseError as e:
+                e.locate(line, column)
+                raise
+        self._linked = None
+        self._optimized = None
+        self._compiled = None
+        # signature -> CompiledProgram; see compile()
+        self._specialized = {}
+
+    def drawing(self, index, *, label=False, source=None):
+        """
+        Decodes the drawing from DEFINE COMMENT `index` (or DEFINE LABEL, with
+        label=True) into a hrmclone.drawings.Drawing.
+
+        If this program was parsed with drawings='offsets', pass the `source`
+        it was parsed from (a str, bytes or mmap) to read it from.
+        """
+        from . import drawings
+        data = (self.label_data if label else self.comment_data)[index]
+        if isinstance(data, DrawingSpan):
+            if source is None:
+                raise ValueError("Only the drawing's offsets were kept; pass its source")
+            data = drawings.read(source, data)
+        elif data is None:
+            raise ValueError("This program's drawings were skipped")
+        return drawings.decode(data)
+
+    @property
+    def size(self):
+        """
+        The number of instructions, not counting comments and labels (as the
+        game counts them for the size challenge).
+        """
+        return sum(1 for instruction in self.instructions if not isinstance(instruction, _Noop))
+
+    def link(self):
+        """
+        Returns the flat bytecode form of this program (see hrmclone.bytecode).
+
+        This is only worked out once per program.
+        """
+        if self._linked is None:
+            from .bytecode import link
+            self._linked = link(self)
+        return self._linked
 
-    def bind(self, *, inbox='', floor=None):
+    def optimize(self):
+        """
+        Returns the peephole-optimised form of link() (see hrmclone.peephole).
+
+        This is only worked out once per program.
+        """
+        if self._optimized is None:
+            from .peephole import optimize
+            self._optimized = optimize(self.link())
+        return self._optimized
+
+    def compile(self, signature=None):
+        """
+        Returns this program compiled to a Python function (see hrmclone.compiler).
+
+        With a `signature` (see hrmclone.analysis.signature()), the function
+        is specialised for runs that start at the first instruction with
+        hands and floor like that, and leaves out any checks the analysis
+        proves can't fail. Only the first MAX_SPECIALIZED signatures seen get
+        their own function; after that, the general one is used.
+
+        Each of these is only done once per program.
+        """
+        if signature is not None:
+            compiled = self._specialized.get(signature)
+            if compiled is not None:
+                return compiled
+            if len(self._specialized) < MAX_SPECIALIZED:
+                from .compiler import compile_program
+                compiled = self._specialized[signature] = compile_program(self, signature)
+                return compiled
+        if self._compiled is None:
+            from .compiler import compile_program
+            self._compiled = compile_program(self)
+        return self._compiled
+
+    def __getstate__(self):
+        # Generated functions can't be pickled; they get rebuilt on demand.
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        state['_specialized'] = {}
+        return state
+
+    def bind(self, *, inbox='', floor=None, typed=False, sink=None):
         """
         Binds this program to a particular state, ready to run.
 
+        Values in the inbox and floor can be ints or strings. With typed=True the
+        resulting ProgramRun reports ints and letters rather than strings.
+
+        The inbox can be any iterable. Sequences are read up front; anything
+        else (generators, open files...) is read one item at a time, as INBOX
+        instructions need them. If `sink` is given, it's called with each
+        OUTBOXed value, and the run's own outbox stays empty.
+
         Returns a ProgramRun instance.
         """
-        return ProgramRun(self, inbox=inbox, floor=floor)
+        return ProgramRun(self, inbox=inbox, floor=floor, typed=typed, sink=sink)
 
-    def run(self, *, inbox='', floor=None):
+    def unpack(self, data, *, inbox=None, sink=None):
+        """
+        Returns a ProgramRun carrying on from `data`, which ProgramRun.pack()
+        returned for a run of this program. `inbox` is a stream to carry on
+        reading from, as for ProgramRun.restore(), and `sink` is as for bind().
+        """
+        typed, counts, hands, tiles, rest, outbox = marshal.loads(data)
+        program_pointer, runtime, inbox_pulled, sunk, size = _thaw(counts)
+        tiles = _thaw(tiles)
+        floor = [None] * size
+        for tile, value in zip(tiles[::2], tiles[1::2]):
+            floor[tile] = value
+        outbox = _thaw(outbox)
+        state = RunState(
+            program_pointer=program_pointer,
+            runtime=None if runtime < 0 else runtime,
+            hands=hands,
+            floor=_intern_floor(floor),
+            inbox=_thaw(rest),
+            inbox_pos=0,
+            inbox_source=None,
+            inbox_pulled=inbox_pulled,
+            outbox=((outbox, len(outbox)),) if outbox else (),
+            sunk=sunk,
+        )
+        return self.bind(typed=typed, sink=sink).restore(state, inbox=inbox)
+
+    def run(self, *, inbox='', floor=None, typed=False, sink=None, engine='object', trace=None,
+            max_steps=None, timeout=None, detect_loops=False, memo=None, **sandbox):
         """
         This is a shortcut for bind().run().
 
         This one looks nicer in tests, but self.bind() gives access to the ProgramRun object
         in case an exception happens later while running.
+
+        `memo` is an optional hrmclone.memo.RunMemo to look the outcome up in
+        (and remember it in). It can't be used along with a sink or a trace.
+
+        `sandbox` is any of the sandbox limits ProgramRun.run() takes
+        (max_outbox, max_value, deadline and max_memory).
+        """
+        if memo is not None:
+            if sink is not None or trace is not None:
+                raise ValueError("A memoised run can't have a sink or a trace")
+            return memo.run(
+                self, inbox=inbox, floor=floor, typed=typed, engine=engine,
+                max_steps=max_steps, timeout=timeout, detect_loops=detect_loops, **sandbox,
+            )
+        run = self.bind(inbox=inbox, floor=floor, typed=typed, sink=sink)
+        return run.run(
+            engine=engine, trace=trace,
+            max_steps=max_steps, timeout=timeout, detect_loops=detect_loops, **sandbox,
+        )
+
+    def run_many(self, inboxes, *, floor=None, floors=None, workers=None,
+                 engine='compiled', typed=False, chunksize=None, ordered=True,
+                 max_steps=None, timeout=None, detect_loops=False, **sandbox):
+        """
+        Runs this program against each of `inboxes`, possibly in parallel,
+        and yields a hrmclone.batch.RunResult for each.
+
+        See hrmclone.batch.run_many() for the details.
         """
-        return self.bind(inbox=inbox, floor=floor).run()
+        from .batch import run_many, DEFAULT_CHUNKSIZE
+        return run_many(
+            self, inboxes, floor=floor, floors=floors, workers=workers,
+            engine=engine, typed=typed, chunksize=chunksize or DEFAULT_CHUNKSIZE,
+            ordered=ordered, max_steps=max_steps, timeout=timeout, detect_loops=detect_loops,
+            **sandbox,
+        )
+
+
+# Floors are stored as tuples while they're shared, and runs which start
+# with the same floor share one (for up to this many different floors).
+MAX_INTERNED_FLOORS = 4096
+_interned_floors = {}
+
+
+def _intern_floor(values):
+    floor = tuple(values)
+    interned = _interned_floors.get(floor)
+    if interned is not None:
+        return interned
+    if len(_interned_floors) >= MAX_INTERNED_FLOORS:
+        return floor
+    return _interned_floors.setdefault(floor, floor)
+
+
+_EMPTY_FLOOR = _intern_floor([None] * FLOOR_TILES)
+
+
+# Array typecodes from smallest to biggest, with the range of ints each holds.
+_ARRAY_TYPES = [
+    (typecode, -2 ** (8 * size - 1), 2 ** (8 * size - 1) - 1)
+    for typecode, size in ((typecode, array.array(typecode).itemsize) for typecode in 'bhiq')
+]
+
+
+def _pack(values):
+    """
+    Packs a sequence of values as tightly as it'll go: an array (of the
+    smallest type that holds them) for all numbers, a str for all letters,
+    or else a tuple. Each of them can be indexed, sliced and added to a list
+    like the list it came from.
+    """
+    if not values:
+        return ()
+    kinds = set(map(type, values))
+    if kinds == {int}:
+        low, high = min(values), max(values)
+        for typecode, smallest, biggest in _ARRAY_TYPES:
+            if smallest <= low and high <= biggest:
+                return array.array(typecode, values)
+    elif kinds == {str}:
+        return ''.join(values)
+    return tuple(values)
+
+
+def _freeze(values):
+    """
+    Like _pack(), but in a form marshal can save: arrays become bytes (their
+    typecode, then their contents). _thaw() turns it back into a list.
+    """
+    packed = _pack(values)
+    if type(packed) is array.array:
+        return packed.typecode.encode() + packed.tobytes()
+    return packed
+
+
+def _thaw(frozen):
+    if type(frozen) is bytes:
+        values = array.array(chr(frozen[0]))
+        values.frombytes(frozen[1:])
+        return values.tolist()
+    return list(frozen)
+
+
+def _unpack_floor(floor):
+    """
+    The values on a floor, which compact() may have marshalled to bytes.
+    """
+    if type(floor) is bytes:
+        return marshal.loads(floor)
+    return floor
+
+
+class RunState:
+    """
+    Where a ProgramRun was up to when ProgramRun.snapshot() was called.
+    Pass it to ProgramRun.restore() to carry on from there.
+
+    The floor, inbox and outbox are shared with the run (and any other runs
+    restored from this state) rather than copied, and must not be changed.
+    A RunState can be pickled (to checkpoint a long run, say), apart from
+    any inbox stream it holds; see ProgramRun.restore().
+    """
+    __slots__ = (
+        'program_pointer', 'runtime', 'hands', 'floor', 'inbox', 'inbox_pos',
+        'inbox_source', 'inbox_pulled', 'outbox', 'sunk',
+    )
+
+    def __init__(self, *, program_pointer, runtime, hands, floor, inbox, inbox_pos,
+                 inbox_source, inbox_pulled, outbox, sunk):
+        self.program_pointer = program_pointer
+        self.runtime = runtime
+        self.hands = hands
+        self.floor = floor
+        self.inbox = inbox
+        self.inbox_pos = inbox_pos
+        self.inbox_source = inbox_source
+        self.inbox_pulled = inbox_pulled
+        # (list, length) pairs, see ProgramRun._outbox_base
+        self.outbox = outbox
+        self.sunk = sunk
+
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in self.__slots__}
+        # Iterators can't be pickled, and the outbox pieces may as well be joined up.
+        state['inbox_source'] = None
+        outbox = []
+        for items, length in self.outbox:
+            outbox += items[:length]
+        state['outbox'] = ((outbox, len(outbox)),)
+        # Only what's left of the inbox is worth saving.
+        state['inbox'] = self.inbox[self.inbox_pos:]
+        state['inbox_pos'] = 0
+        # (no __dict__, so everything goes in the slots part)
+        return None, state
 
 
 class ProgramRun:
     """
     A particular instance of a program run, complete with state.
+
+    A run which is going to sit idle for a while (waiting for inbox, say) can
+    be compact()ed to take up less memory.
     """
-    def __init__(self, program, *, inbox='', floor=None):
+    __slots__ = (
+        'program', 'typed', '_hands', '_outbox', '_outbox_base', '_inbox', '_inbox_source',
+        '_inbox_pos', '_inbox_pulled', 'sink', '_sunk', '_emit', '_floor', '_floor_shared',
+        'program_pointer', 'runtime',
+    )
+
+    def __init__(self, program, *, inbox='', floor=None, typed=False, sink=None):
         self.program = program
 
-        # Variables and stuff
-        self.inbox = list(inbox)
-        self.hands = None
-        self.outbox = []
+        # If this is set, hands/floor/inbox/outbox give back ints and letters,
+        # rather than converting everything to strings.
+        self.typed = typed
+
+        # Variables and stuff.
+        # These hold values as parse_value() returns them; the public
+        # properties below convert them back to strings.
+        self._hands = None
+        self._outbox = []
+        # Outbox items from before this run was restored from a RunState:
+        # (list, length) pairs, which are shared with other runs and never changed.
+        self._outbox_base = ()
+
+        # The inbox is consumed with a cursor, not by popping items off the front.
+        # Sequences (strings, lists...) are read up front. Anything else is
+        # treated as a stream, and is only pulled from when an INBOX needs it.
+        if isinstance(inbox, collections.abc.Sequence):
+            self._inbox = [parse_value(v) for v in inbox]
+            self._inbox_source = None
+        else:
+            self._inbox = []
+            self._inbox_source = iter(inbox)
+        self._inbox_pos = 0
+
+        # How many items have been pulled from an inbox stream
+        self._inbox_pulled = 0
+
+        # If there's a sink, everything OUTBOXed goes to it instead of self.outbox
+        self.sink = sink
+        self._sunk = 0
+        self._emit = self._make_emit()
 
         if floor is None:
-            self.floor = [None] * 20
-        elif isinstance(floor, dict):
-            self.floor = [None] * 20
-            for i, v in floor.items():
-                self.floor[i] = v
+            self._floor = _EMPTY_FLOOR
         else:
-            self.floor = floor[:]
+            if isinstance(floor, dict):
+                values = [None] * FLOOR_TILES
+                for i, v in floor.items():
+                    values[i] = parse_value(v)
+            else:
+                values = [parse_value(v) for v in floor]
+            self._floor = _intern_floor(values)
+        # Set when the floor is shared (with a RunState, see snapshot(), or
+        # with other runs that start with the same floor); it's copied before
+        # this run changes it.
+        self._floor_shared = True
 
         # Where the current program is up to (int from 0 to len(program))
         self.program_pointer = 0
@@ -400,15 +803,377 @@ class ProgramRun:
         # How many total instructions we've executed
         self.runtime = None
 
-    def run(self):
-        self.runtime = 0
+    @property
+    def hands(self):
+        if self.typed:
+            return self._hands
+        return format_value(self._hands)
+
+    @hands.setter
+    def hands(self, value):
+        self._hands = parse_value(value)
+
+    @property
+    def floor(self):
+        if self.typed:
+            self._unshare()
+            return self._floor
+        return [format_value(v) for v in _unpack_floor(self._floor)]
+
+    @floor.setter
+    def floor(self, values):
+        self._floor = [parse_value(v) for v in values]
+        self._floor_shared = False
+
+    @property
+    def inbox(self):
+        """
+        What's left in the inbox. For streamed inboxes, that's only the items
+        which have been read from the stream but not consumed yet.
+        """
+        remaining = list(self._inbox[self._inbox_pos:])
+        if self.typed:
+            return remaining
+        return [format_value(v) for v in remaining]
+
+    @property
+    def outbox(self):
+        values = self._outbox_values()
+        if self.typed:
+            return values
+        return [format_value(v) for v in values]
+
+    def _outbox_values(self):
+        values = self._outbox
+        if self._outbox_base or type(values) is not list:
+            values = []
+            for items, length in self._outbox_base:
+                values += items[:length]
+            values += self._outbox
+        return values
+
+    def _make_emit(self):
+        if self.sink is None:
+            return self._outbox.append
+        sink = self.sink
+        typed = self.typed
+
+        def emit(value):
+            self._sunk += 1
+            sink(value if typed else str(value))
+        return emit
+
+    @property
+    def outbox_count(self):
+        """
+        How many items have been OUTBOXed so far (whether or not there's a sink).
+        """
+        return len(self._outbox) + sum(length for _, length in self._outbox_base) + self._sunk
+
+    def _pull_inbox(self):
+        """
+        Called when the inbox cursor has caught up with everything read so far.
+        Reads the next item from the inbox stream, if there is one.
+
+        Consumed items are dropped, so a streamed run never holds more than one
+        inbox item at a time. Returns False if the stream is exhausted.
+        """
+        if self._inbox_source is None:
+            return False
+        try:
+            item = next(self._inbox_source)
+        except StopIteration:
+            self._inbox_source = None
+            return False
+        if isinstance(item, str):
+            # lines from files and pipes
+            item = item.strip()
+        self._inbox = [parse_value(item)]
+        self._inbox_pos = 0
+        self._inbox_pulled += 1
+        return True
+
+    def run(self, *, engine='object', trace=None, max_steps=None, timeout=None, detect_loops=False,
+            max_outbox=None, max_value=None, deadline=None, max_memory=None):
+        """
+        Runs the program until it finishes or runs out of inbox.
+
+        `finished` and `waiting` say which of those happened. A waiting run
+        can be fed more inbox with feed() and run again to carry on.
+
+        `engine` picks how the program is executed (see ENGINES). 'object' calls
+        each Instruction's execute() in turn; the others are faster, but
+        produce exactly the same results.
+
+        `trace` is an optional hrmclone.tracing.Tracer, which gets called after
+        every step. Leave it out and the run isn't traced at all.
+        Tracing always uses the 'object' engine.
+
+        `max_steps`, `timeout` and `detect_loops` put limits on the run, so
+        that a program which never finishes can't run forever. `max_outbox`,
+        `max_value`, `deadline` and `max_memory` sandbox it further, for
+        programs that can't be trusted. See hrmclone.limits.Guard.
+        """
+        if self.runtime is None:
+            self.runtime = 0
+        self._unshare()
+
+        guard = None
+        sandbox = (max_outbox, max_value, deadline, max_memory)
+        if max_steps is not None or timeout is not None or detect_loops or sandbox != (None,) * 4:
+            from .limits import make_guard
+            guard = make_guard(
+                self, max_steps=max_steps, timeout=timeout, detect_loops=detect_loops,
+                max_outbox=max_outbox, max_value=max_value, deadline=deadline,
+                max_memory=max_memory,
+            )
+
+        if trace is not None:
+            self._run_checked(trace, guard)
+        elif engine == 'object':
+            if guard is None:
+                self._run()
+            else:
+                self._run_checked(None, guard)
+        else:
+            get_engine(engine)(self, guard)
+        if guard is not None and guard.sandboxed:
+            # A run too short to reach a check on the way still gets one.
+            guard.check_sandbox(self._hands)
+
+        # Makes it easier for test assertions if this returns self.
+        # (no other reason really)
+        return self
+
+    def snapshot(self):
+        """
+        Returns a RunState holding everything about where this run is up to.
+
+        Nothing is copied: the floor, inbox and outbox are shared with the
+        snapshot, and whichever side changes its floor first takes its own
+        copy then. So this is cheap enough to do at every step if need be.
+        """
+        self._floor_shared = True
+        source = self._inbox_source
+        if source is not None:
+            # Both this run and the snapshot need to read the rest of the stream.
+            source, self._inbox_source = itertools.tee(source)
+        return RunState(
+            program_pointer=self.program_pointer,
+            runtime=self.runtime,
+            hands=self._hands,
+            floor=_unpack_floor(self._floor),
+            inbox=self._inbox,
+            inbox_pos=self._inbox_pos,
+            inbox_source=source,
+            inbox_pulled=self._inbox_pulled,
+            outbox=self._outbox_base + ((self._outbox, len(self._outbox)),),
+            sunk=self._sunk,
+        )
+
+    def restore(self, state, *, inbox=None):
+        """
+        Puts this run back to the point `state` was taken at.
+
+        A state which has been pickled has lost its inbox stream (if it had
+        one); pass `inbox` to carry on reading from a stream which has
+        already had `state.inbox_pulled` items read from it.
+        """
+        self.program_pointer = state.program_pointer
+        self.runtime = state.runtime
+        self._hands = state.hands
+        self._floor = state.floor
+        self._floor_shared = True
+        self._inbox = state.inbox
+        self._inbox_pos = state.inbox_pos
+        if inbox is not None:
+            self._inbox_source = iter(inbox)
+        elif state.inbox_source is not None:
+            # tee objects copy cheaply, and the copies are independent
+            self._inbox_source = copy.copy(state.inbox_source)
+        else:
+            self._inbox_source = None
+        self._inbox_pulled = state.inbox_pulled
+        self._outbox_base = state.outbox
+        self._outbox = []
+        self._sunk = state.sunk
+        self._emit = self._make_emit()
+        return self
+
+    def fork(self):
+        """
+        Returns a new ProgramRun which carries on from where this one is,
+        independently of it. Costs about as much as a snapshot().
+        """
+        run = ProgramRun(self.program, typed=self.typed, sink=self.sink)
+        return run.restore(self.snapshot())
+
+    @property
+    def finished(self):
+        """
+        True once the program has run off its end.
+        """
+        return self.program_pointer >= len(self.program.instructions)
+
+    @property
+    def waiting(self):
+        """
+        True if the run is stopped at an INBOX, with nothing left to read.
+        feed() it more inbox and it can carry on.
+        """
+        instructions = self.program.instructions
+        return (
+            self.program_pointer < len(instructions)
+            and isinstance(instructions[self.program_pointer], Inbox)
+            and self._inbox_pos >= len(self._inbox)
+            and self._inbox_source is None
+        )
+
+    def feed(self, items):
+        """
+        Adds more items to the end of the inbox. They're read before anything
+        still to come from an inbox stream.
+        """
+        # Rather than appending, so an inbox shared with a RunState stays as it was.
+        self._inbox = [*self._inbox[self._inbox_pos:], *(parse_value(v) for v in items)]
+        self._inbox_pos = 0
+
+    def step(self):
+        """
+        Executes a single instruction.
+
+        Returns False, without doing anything, if the program has finished or
+        is waiting for inbox; otherwise True.
+        """
+        if self.runtime is None:
+            self.runtime = 0
+        self._unshare()
+        try:
+            instruction = self.program.instructions[self.program_pointer]
+        except IndexError:
+            return False
+        try:
+            instruction.execute(self)
+        except exceptions.EmptyInbox:
+            return False
+        self.program_pointer += 1
+        self.runtime += 1
+        return True
+
+    def run_until(self, until):
+        """
+        Runs step by step until `until` is met, or the program finishes or is
+        waiting for inbox.
+
+        `until` is either a number of steps to run, or a function which is
+        called with the run after each step and returns true to stop.
+        Returns True if the run stopped because `until` was met.
+        """
+        if isinstance(until, int):
+            if until <= 0:
+                return True
+            target = (self.runtime or 0) + until
+            until = lambda run: run.runtime >= target
+        while self.step():
+            if until(self):
+                return True
+        return False
+
+    def outputs(self):
+        """
+        Runs the program step by step, yielding each value as it's OUTBOXed.
 
+        When an INBOX finds nothing to read, this yields None. feed() the run
+        some more (or send() the items in) and it carries on; if nothing has
+        been fed by the time it's resumed, the iterator stops. It also stops
+        when the program finishes.
+        """
+        instructions = self.program.instructions
+        end = len(instructions)
         while True:
-            # TODO: detect infinite loop for never-ending non-interactive programs.
-            # maybe by just stopping if we reach runtime=100000 or something
+            index = self.program_pointer
+            outboxing = index < end and isinstance(instructions[index], Outbox)
+            value = self._hands
+            if self.step():
+                if outboxing:
+                    yield value if self.typed else format_value(value)
+                continue
+            if self.finished:
+                return
+            items = yield None
+            if items is not None:
+                self.feed(items)
+            if self.waiting:
+                return
+
+    def compact(self):
+        """
+        Shrinks the memory this run takes up while it isn't running. Its
+        floor is shared with other runs if it's the same as one they started
+        with, and marshalled to bytes if not; its outbox and the rest of its
+        inbox are packed into arrays (or strs, for letters).
+
+        It's undone automatically when the run is next run or stepped, so
+        it's always safe to call; it just costs a little to undo.
+        """
+        floor = tuple(_unpack_floor(self._floor))
+        # Only starting floors get interned; most runs have a floor of their
+        # own by the time they're compacted.
+        self._floor = _interned_floors.get(floor) or marshal.dumps(floor)
+        self._floor_shared = True
+        self._inbox = _pack(self._inbox[self._inbox_pos:])
+        self._inbox_pos = 0
+        if self.sink is None:
+            self._outbox = _pack(self._outbox)
+            self._emit = None
+        return self
+
+    def pack(self):
+        """
+        Returns everything about where this run is up to as bytes, which take
+        up far less memory than even a compact()ed run. For holding a great
+        many runs which are waiting for inbox: Program.unpack() turns the
+        bytes back into a run that carries on from here.
+
+        The sink and the inbox stream (if there are any) aren't included;
+        pass them to unpack(). The bytes are only meant to be unpacked on the
+        same machine.
+        """
+        floor = _unpack_floor(self._floor)
+        # Just the tiles with something on them, as tile, value, tile, ...
+        tiles = []
+        for tile, value in enumerate(floor):
+            if value is not None:
+                tiles += (tile, value)
+        counts = [
+            self.program_pointer, -1 if self.runtime is None else self.runtime,
+            self._inbox_pulled, self._sunk, len(floor),
+        ]
+        return marshal.dumps((
+            self.typed, _freeze(counts), self._hands, _freeze(tiles),
+            _freeze(self._inbox[self._inbox_pos:]), _freeze(self._outbox_values()),
+        ))
+
+    def _unshare(self):
+        """
+        Gets the run ready to change its state, undoing compact() and taking
+        its own copy of a shared floor.
+        """
+        if self._floor_shared:
+            self._floor = list(_unpack_floor(self._floor))
+            self._floor_shared = False
+        if self._emit is None:
+            self._outbox = list(self._outbox)
+            self._emit = self._make_emit()
+
+    def _run(self):
+        instructions = self.program.instructions
+        while True:
+            # NOTE: this never checks for infinite loops. Runs with limits
+            # go through _run_checked() instead.
 
             try:
-                instruction = self.program.instructions[self.program_pointer]
+                instruction = instructions[self.program_pointer]
             except IndexError:
                 # program finished!
                 break
@@ -416,18 +1181,46 @@ class ProgramRun:
             try:
                 instruction.execute(self)
             except exceptions.EmptyInbox:
-                # TODO: evaluate goal state here.
-                # for now assume end of program.
+                # End of the program. Whether it met its goal is up to the
+                # caller (see hrmclone.levels).
                 break
-            finally:
-                print(
-                    f"{instruction}:\n\tinbox={self.inbox}\n\tfloor={self.floor}\n\toutbox={self.outbox}",
-                    file=sys.stderr
-                )
 
             self.program_pointer += 1
             self.runtime += 1
 
-        # Makes it easier for test assertions if this returns self.
-        # (no other reason really)
-        return self
+    def _run_checked(self, tracer, guard):
+        """
+        Same as _run(), but calls the tracer hooks along the way (if there's
+        a tracer) and checks limits on backward jumps (if there's a guard).
+        """
+        instructions = self.program.instructions
+        if tracer is not None:
+            tracer.start(self)
+        try:
+            while True:
+                index = self.program_pointer
+                try:
+                    instruction = instructions[index]
+                except IndexError:
+                    break
+
+                try:
+                    instruction.execute(self)
+                except exceptions.EmptyInbox:
+                    break
+                except (exceptions.RunError, exceptions.InvalidFloorIndex) as e:
+                    if tracer is not None:
+                        tracer.error(self, index, instruction, e)
+                    raise
+                finally:
+                    if tracer is not None:
+                        tracer.step(self, index, instruction)
+
+                self.program_pointer += 1
+                self.runtime += 1
+
+                if guard is not None and self.program_pointer <= index:
+                    guard(self.program_pointer, self.runtime, self._hands, self._inbox_pos)
+        finally:
+            if tracer is not None:
+                tracer.finish(self)
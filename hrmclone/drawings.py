@@ -0,0 +1,119 @@
+"""
+Decodes the drawings that DEFINE COMMENT and DEFINE LABEL carry.
+
+In a saved program each one is a base64 blob of zlib-compressed data: a
+little-endian uint32 count of points, then that many (x, y) pairs of
+uint16s, where (0, 0) lifts the pen between strokes.
+
+Running a program never needs them, and they can be most of a save, so how
+the parser handles them is up to the Program:
+
+    Program(text)                       # keep each blob as a str
+    Program(text, drawings='offsets')   # only record where each one is
+    Program(text, drawings='skip')      # don't keep anything
+
+Either way, decode() turns a blob into points and strokes when it's wanted.
+"""
+import array
+import binascii
+import collections
+import functools
+import struct
+import sys
+import zlib
+
+
+DRAWING_MODES = ('keep', 'offsets', 'skip')
+
+# How many decoded drawings decode() remembers.
+DECODE_CACHE_SIZE = 256
+
+
+DrawingSpan = collections.namedtuple('DrawingSpan', 'start end')
+DrawingSpan.__doc__ = """
+Where a drawing's blob is in a program's source, as offsets which slice it
+out (characters for a str, bytes for anything else). The slice may include
+line breaks, indentation and the ';' that ends it; read() strips them.
+"""
+
+
+class Drawing(collections.namedtuple('Drawing', 'points strokes')):
+    """
+    A decoded drawing. `points` is an array of x and y coordinates, one after
+    the other, and `strokes` an array of where each stroke starts in it,
+    counting in points, with the number of points on the end.
+    """
+    __slots__ = ()
+
+    def lines(self):
+        """
+        Returns each stroke as a list of (x, y) tuples.
+        """
+        points = self.points
+        return [
+            [(points[2 * i], points[2 * i + 1]) for i in range(start, end)]
+            for start, end in zip(self.strokes, self.strokes[1:])
+        ]
+
+
+def read(source, span):
+    """
+    Returns the blob at `span` (a DrawingSpan) in `source`: the str, bytes
+    or mmap the program was parsed from.
+    """
+    data = source[span.start:span.end]
+    if not isinstance(data, str):
+        data = bytes(data).decode('ascii')
+    return ''.join(data.split()).rstrip(';')
+
+
+@functools.lru_cache(maxsize=DECODE_CACHE_SIZE)
+def decode(data):
+    """
+    Decodes a drawing's blob (as it's stored in Program.comment_data or
+    label_data) into a Drawing. The last DECODE_CACHE_SIZE are remembered,
+    and the same Drawing is returned for the same blob, so don't change it.
+
+    Raises ValueError if it isn't a drawing.
+    """
+    try:
+        raw = zlib.decompress(binascii.a2b_base64(data + '=' * (-len(data) % 4)))
+    except (binascii.Error, zlib.error) as e:
+        raise ValueError(f'Bad drawing data: {e}')
+    if len(raw) < 4:
+        raise ValueError('Bad drawing data: too short')
+    count, = struct.unpack_from('<I', raw)
+    if 4 + 4 * count > len(raw):
+        raise ValueError(f'Bad drawing data: {count} points, but not enough data')
+
+    values = array.array('H', raw[4:4 + 4 * count])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    points = array.array('H')
+    strokes = array.array('I')
+    pen_down = False
+    for i in range(0, len(values), 2):
+        if values[i] == 0 and values[i + 1] == 0:
+            pen_down = False
+            continue
+        if not pen_down:
+            strokes.append(len(points) // 2)
+            pen_down = True
+        points += values[i:i + 2]
+    strokes.append(len(points) // 2)
+    return Drawing(points, strokes)
+
+
+def encode(strokes):
+    """
+    The opposite of decode(): returns the blob for a list of strokes, each
+    a list of (x, y) tuples.
+    """
+    values = []
+    for stroke in strokes:
+        if values:
+            values += (0, 0)
+        for x, y in stroke:
+            values += (x, y)
+    raw = struct.pack(f'<I{len(values)}H', len(values) // 2, *values)
+    return binascii.b2a_base64(zlib.compress(raw), newline=False).decode('ascii')
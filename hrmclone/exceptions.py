@@ -3,6 +3,25 @@ class ParseError(Exception):
     """
     Base of compile errors
     """
+    # Where in the source the error is, if known (both 1-based)
+    line = None
+    column = None
+
+    def locate(self, line, column):
+        """
+        Records where the error happened, unless that's already known.
+        """
+        if self.line is None:
+            self.line = line
+        if self.column is None:
+            self.column = column
+        return self
+
+    def __str__(self):
+        message = super().__str__()
+        if self.line is None:
+            return message
+        return f'{message} (line {self.line}, column {self.column})'
 
 
 class NoSuchInstruction(ParseError):
@@ -50,3 +69,47 @@ class Overflow(RunError):
 
 class MathDomainError(RunError):
     pass
+
+
+class RunAborted(RunError):
+    """
+    Base of errors where the run was stopped because of a limit imposed on
+    it, rather than because the program itself did something wrong.
+    """
+
+
+class StepLimitExceeded(RunAborted):
+    pass
+
+
+class TimeLimitExceeded(RunAborted):
+    pass
+
+
+class DeadlineExceeded(TimeLimitExceeded):
+    """
+    The run was still going at its `deadline`.
+    """
+
+
+class OutboxLimitExceeded(RunAborted):
+    pass
+
+
+class ValueLimitExceeded(RunAborted, Overflow):
+    """
+    A number went outside the range the run was limited to (the game's own
+    range is -999 to 999).
+    """
+
+
+class MemoryLimitExceeded(RunAborted):
+    pass
+
+
+class InfiniteLoop(RunAborted):
+    """
+    The run got back to exactly the same state it had been in before,
+    without reading any inbox or writing any outbox in between.
+    So it's never going to stop.
+    """
@@ -0,0 +1,368 @@
+"""
+The game's levels, and scoring solutions against them.
+
+Each Level knows how to make random inboxes like the game's, what the
+outbox should be for any given inbox, how the floor starts out, and the size
+and speed challenge targets.
+
+    result = score(program, 19, cases=1000)
+    result.passed, result.average_runtime, result.meets_speed
+
+A run which stops because its inbox ran dry is judged by its outbox; see
+Level.check().
+"""
+import collections
+import random
+import string
+import threading
+
+from .core import Program, parse_value
+
+
+class Level:
+    """
+    One level of the game.
+
+    `generate(rng)` returns a new inbox (a list of ints and letters), and
+    `expected(inbox, floor)` the outbox a correct solution produces for it.
+    `floor` is the starting floor, as a dict of tile -> value.
+    `size` and `speed` are the targets for the size and speed challenges.
+    """
+    # How many seeds' worth of cases cases() keeps.
+    max_seeds = 16
+
+    def __init__(self, number, name, generate, expected, *, floor=None, size=None, speed=None):
+        self.number = number
+        self.name = name
+        self.generate = generate
+        self.expected = expected
+        self.floor = floor
+        self.size = size
+        self.speed = speed
+
+        # seed -> [(inbox, expected outbox), ...], extended as more are needed,
+        # for the last max_seeds seeds used.
+        self._cases = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<Level {self.number}: {self.name}>'
+
+    def cases(self, count, seed=0):
+        """
+        Returns `count` (inbox, expected outbox) pairs, as tuples.
+
+        The cases for a seed are always the same, and are only generated (and
+        their outboxes worked out) once: asking for more just adds to them.
+        Only the cases for the last `max_seeds` seeds are kept.
+        """
+        with self._lock:
+            cases = self._cases.get(seed)
+            if cases is None:
+                cases = self._cases[seed] = []
+                while len(self._cases) > self.max_seeds:
+                    self._cases.popitem(last=False)
+            else:
+                self._cases.move_to_end(seed)
+            if len(cases) < count:
+                floor = self.starting_floor()
+                for index in range(len(cases), count):
+                    # Seeded per case, so case N is the same however many are asked for.
+                    rng = random.Random(f'{self.number}:{seed}:{index}')
+                    inbox = tuple(self.generate(rng))
+                    cases.append((inbox, tuple(self.expected(inbox, floor))))
+            return cases[:count]
+
+    def starting_floor(self):
+        """
+        The starting floor as a dict of tile -> typed value.
+        """
+        return {tile: parse_value(value) for tile, value in (self.floor or {}).items()}
+
+    def check(self, run, inbox):
+        """
+        Whether a finished run (bound to `inbox`) met the level's goal.
+        """
+        expected = self.expected(tuple(parse_value(v) for v in inbox), self.starting_floor())
+        return list(run.outbox if run.typed else map(parse_value, run.outbox)) == list(expected)
+
+
+Failure = collections.namedtuple('Failure', 'index inbox expected outbox error')
+
+
+class Score:
+    """
+    The outcome of score(). `failures` holds a Failure for each case which
+    produced the wrong outbox or raised an error.
+    """
+    def __init__(self, level, size, cases, runtimes, failures):
+        self.level = level
+        self.size = size
+        self.cases = cases
+        self.runtimes = runtimes
+        self.failures = failures
+
+    @property
+    def passed(self):
+        return self.cases > 0 and not self.failures
+
+    @property
+    def average_runtime(self):
+        return sum(self.runtimes) / len(self.runtimes) if self.runtimes else None
+
+    @property
+    def worst_runtime(self):
+        return max(self.runtimes, default=None)
+
+    @property
+    def meets_size(self):
+        return self.passed and self.level.size is not None and self.size <= self.level.size
+
+    @property
+    def meets_speed(self):
+        return (
+            self.passed and self.level.speed is not None
+            and self.average_runtime <= self.level.speed
+        )
+
+    def __repr__(self):
+        if not self.passed:
+            return f'<Score {self.level.name}: failed {len(self.failures)} of {self.cases}>'
+        return (
+            f'<Score {self.level.name}: passed {self.cases}, size {self.size}, '
+            f'average {self.average_runtime:.1f} steps, worst {self.worst_runtime}>'
+        )
+
+
+def score(program, level, cases=100, *, seed=0, fail_fast=False, engine='compiled',
+          workers=0, max_steps=100000, **sandbox):
+    """
+    Runs `program` against `cases` random inboxes for `level` (a Level, or a
+    level number or name), and returns a Score.
+
+    The cases are batched through Program.run_many(); `workers` and `engine`
+    are passed along to it. With `fail_fast`, scoring stops at the first
+    failure (give or take the rest of its batch). `max_steps` stops any
+    case that runs away; that counts as a failure. So does going over any of
+    the sandbox limits (max_outbox, max_value, deadline and max_memory; see
+    hrmclone.limits.Guard), which are passed along to run_many() too.
+    """
+    if not isinstance(level, Level):
+        level = get_level(level)
+    if isinstance(program, str):
+        program = Program(program)
+
+    pairs = level.cases(cases, seed)
+    results = program.run_many(
+        [inbox for inbox, _ in pairs], floor=level.floor, workers=workers,
+        engine=engine, typed=True, max_steps=max_steps, **sandbox,
+    )
+    runtimes = []
+    failures = []
+    ran = 0
+    try:
+        for result in results:
+            ran += 1
+            inbox, expected = pairs[result.index]
+            if result.error is not None or tuple(result.outbox) != expected:
+                failures.append(Failure(result.index, inbox, expected, result.outbox, result.error))
+                if fail_fast:
+                    break
+            else:
+                runtimes.append(result.runtime)
+    finally:
+        results.close()
+    return Score(level, program.size, ran, runtimes, failures)
+
+
+# Input generators
+
+def _numbers(count, low=-9, high=9):
+    return lambda rng: [rng.randint(low, high) for _ in range(count)]
+
+
+def _letters(count):
+    return lambda rng: [rng.choice(string.ascii_uppercase) for _ in range(count)]
+
+
+def _mixed(count, zeros=0.0):
+    def generate(rng):
+        items = []
+        for _ in range(count):
+            if rng.random() < zeros:
+                items.append(0)
+            elif rng.random() < 0.5:
+                items.append(rng.choice(string.ascii_uppercase))
+            else:
+                items.append(rng.randint(-9, 9))
+        return items
+    return generate
+
+
+def _pairs(count, first, second):
+    def generate(rng):
+        items = []
+        for _ in range(count):
+            items += [first(rng), second(rng)]
+        return items
+    return generate
+
+
+def _number(low, high):
+    return lambda rng: rng.randint(low, high)
+
+
+def _nonzero(rng):
+    return rng.choice([-1, 1]) * rng.randint(1, 9)
+
+
+def _zero_terminated(count, item, length=(0, 5)):
+    def generate(rng):
+        items = []
+        for _ in range(count):
+            items += [item(rng) for _ in range(rng.randint(*length))] + [0]
+        return items
+    return generate
+
+
+# Expected outputs
+
+def _each(function):
+    return lambda inbox, floor: [function(x) for x in inbox]
+
+
+def _each_pair(function):
+    return lambda inbox, floor: [
+        y for a, b in zip(inbox[::2], inbox[1::2]) for y in function(a, b)
+    ]
+
+
+def _countdown(inbox, floor):
+    out = []
+    for x in inbox:
+        step = -1 if x > 0 else 1
+        out += list(range(x, 0, step)) + [0]
+    return out
+
+
+def _strings(inbox):
+    current = []
+    for x in inbox:
+        if x == 0:
+            yield current
+            current = []
+        else:
+            current.append(x)
+
+
+def _fibonacci(inbox, floor):
+    out = []
+    for x in inbox:
+        a, b = 1, 1
+        while a <= x:
+            out.append(a)
+            a, b = b, a + b
+    return out
+
+
+def _three_sort(inbox, floor):
+    out = []
+    for i in range(0, len(inbox) - 2, 3):
+        out += sorted(inbox[i:i + 3])
+    return out
+
+
+def _unique(inbox, floor):
+    seen = []
+    for x in inbox:
+        if x not in seen:
+            seen.append(x)
+    return seen
+
+
+_STORAGE_FLOOR = dict(enumerate('NKAEXTJUBG'))
+
+
+LEVELS = [
+    Level(1, 'Mail Room', _mixed(3), _each(lambda x: x), size=6, speed=6),
+    Level(2, 'Busy Mail Room', _letters(12), _each(lambda x: x), size=3, speed=25),
+    Level(
+        3, 'Copy Floor', lambda rng: [-99] * 4, lambda inbox, floor: ['B', 'U', 'G'],
+        floor=dict(enumerate('UJXGBE')), size=6, speed=6,
+    ),
+    Level(4, 'Scrambler Handler', _mixed(6), _each_pair(lambda a, b: (b, a)), size=7, speed=21),
+    Level(6, 'Rainy Summer', _numbers(8), _each_pair(lambda a, b: (a + b,)), size=6, speed=24),
+    Level(
+        7, 'Zero Exterminator', _mixed(8, zeros=0.4),
+        lambda inbox, floor: [x for x in inbox if x != 0], size=4, speed=23,
+    ),
+    Level(8, 'Tripler Room', _numbers(4), _each(lambda x: 3 * x), size=6, speed=24),
+    Level(
+        9, 'Zero Preservation Initiative', _mixed(8, zeros=0.4),
+        lambda inbox, floor: [x for x in inbox if x == 0], size=5, speed=25,
+    ),
+    Level(10, 'Octoplier Suite', _numbers(4), _each(lambda x: 8 * x), size=9, speed=36),
+    Level(
+        11, 'Sub Hallway', _numbers(8), _each_pair(lambda a, b: (b - a, a - b)),
+        size=10, speed=40,
+    ),
+    Level(12, 'Tetracontiplier', _numbers(4), _each(lambda x: 40 * x), size=14, speed=56),
+    Level(
+        13, 'Equalization Room', _pairs(4, _number(-3, 3), _number(-3, 3)),
+        _each_pair(lambda a, b: (a,) if a == b else ()), size=9, speed=27,
+    ),
+    Level(14, 'Maximization Room', _numbers(8), _each_pair(lambda a, b: (max(a, b),)), size=9, speed=34),
+    Level(16, 'Absolute Positivity', _numbers(5), _each(abs), size=8, speed=36),
+    Level(
+        17, 'Exclusive Lounge', _pairs(4, _nonzero, _nonzero),
+        _each_pair(lambda a, b: (int((a < 0) != (b < 0)),)),
+        floor={4: 0, 5: 1}, size=12, speed=28,
+    ),
+    Level(19, 'Countdown', _numbers(4), _countdown, size=10, speed=82),
+    Level(
+        20, 'Multiplication Workshop', _pairs(4, _number(0, 9), _number(0, 9)),
+        _each_pair(lambda a, b: (a * b,)), floor={9: 0}, size=15, speed=109,
+    ),
+    Level(
+        21, 'Zero Terminated Sum', _zero_terminated(4, _number(-9, 9)),
+        lambda inbox, floor: [sum(s) for s in _strings(inbox)],
+        floor={5: 0}, size=10, speed=72,
+    ),
+    Level(22, 'Fibonacci Visitor', _numbers(3, 1, 30), _fibonacci, floor={9: 0}, size=19, speed=156),
+    Level(
+        23, 'The Littlest Number', _zero_terminated(3, _number(1, 99), length=(1, 5)),
+        lambda inbox, floor: [min(s) for s in _strings(inbox)], size=13, speed=75,
+    ),
+    Level(
+        24, 'Mod Module', _pairs(4, _number(0, 20), _number(1, 9)),
+        _each_pair(lambda a, b: (a % b,)), size=12, speed=57,
+    ),
+    Level(
+        25, 'Cumulative Countdown', _numbers(4, 0, 9),
+        _each(lambda x: x * (x + 1) // 2), floor={5: 0}, size=12, speed=82,
+    ),
+    Level(
+        26, 'Small Divide', _pairs(4, _number(0, 30), _number(1, 9)),
+        _each_pair(lambda a, b: (a // b,)), floor={9: 0}, size=15, speed=76,
+    ),
+    Level(28, 'Three Sort', _numbers(12), _three_sort, size=34, speed=78),
+    Level(
+        29, 'Storage Floor', _numbers(6, 0, 9),
+        lambda inbox, floor: [floor[x] for x in inbox],
+        floor=_STORAGE_FLOOR, size=5, speed=25,
+    ),
+    Level(35, 'Duplicate Removal', _letters(14), _unique, floor={14: 0}, size=17, speed=167),
+]
+
+_BY_NUMBER = {level.number: level for level in LEVELS}
+_BY_NAME = {level.name.lower(): level for level in LEVELS}
+
+
+def get_level(level):
+    """
+    Looks up a level by number or (case insensitive) name.
+    """
+    found = _BY_NUMBER.get(level) if isinstance(level, int) else _BY_NAME.get(level.lower())
+    if found is None:
+        raise KeyError(f'No such level: {level!r}')
+    return found
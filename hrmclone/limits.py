@@ -0,0 +1,158 @@
+"""
+Limits on how long a run is allowed to go for, and on what it's allowed to
+do along the way.
+
+The engines call a Guard whenever a jump goes backwards. Every loop has a
+backward jump, and anything between backward jumps runs a bounded number of
+steps, so that's enough to stop any runaway program while leaving straight-line
+code alone. A run without limits doesn't get a Guard at all.
+"""
+import itertools
+import sys
+import time
+
+from . import exceptions
+
+
+class Guard:
+    """
+    Checks a run against its limits. Instances are called by the engines as
+    guard(pc, runtime, hands, inbox_pos), just after a backward jump.
+
+    `max_steps` and `timeout` (seconds of wall clock time) raise
+    StepLimitExceeded and TimeLimitExceeded. Since they're only checked on
+    backward jumps, a run can go slightly past max_steps before being stopped.
+
+    `deadline` is a time.monotonic() time to stop by, which raises
+    DeadlineExceeded; unlike `timeout`, it can be shared by several runs.
+
+    With `detect_loops`, the state of the run is fingerprinted every
+    `sample` backward jumps. If the same fingerprint turns up twice without
+    any inbox being read or outbox written in between, the program is in a
+    loop it can never leave, and InfiniteLoop is raised.
+
+    The sandbox limits, for running programs nobody has checked, are looked
+    at every `sample` backward jumps too, so they can be gone over by a bit
+    before the run is stopped, and once more by ProgramRun.run() when the
+    run stops:
+
+    `max_outbox` raises OutboxLimitExceeded once more than that many items
+    have been OUTBOXed.
+
+    `max_value` raises ValueLimitExceeded once a number bigger than it (either
+    way) turns up in hands, on the floor or in the outbox. A number which
+    goes out of range and comes back between two checks isn't noticed.
+
+    `max_memory` raises MemoryLimitExceeded once the outbox, floor and hands
+    take up more than that many bytes, roughly (items sent to a sink don't
+    count).
+    """
+    # Forget old fingerprints beyond this many, so a long (but not infinite)
+    # loop doesn't use up all the memory.
+    max_fingerprints = 100000
+
+    def __init__(self, run, *, max_steps=None, timeout=None, detect_loops=False, sample=64,
+                 max_outbox=None, max_value=None, deadline=None, max_memory=None):
+        self.run = run
+        self.max_steps = max_steps
+        self.deadline = deadline
+        self.deadline_error = exceptions.DeadlineExceeded
+        if timeout is not None and (deadline is None or time.monotonic() + timeout < deadline):
+            self.deadline = time.monotonic() + timeout
+            self.deadline_error = exceptions.TimeLimitExceeded
+        self.detect_loops = detect_loops
+        self.sample = sample
+        self.max_outbox = max_outbox
+        self.max_value = max_value
+        self.max_memory = max_memory
+        self.sandboxed = max_outbox is not None or max_value is not None or max_memory is not None
+
+        self.jumps = 0
+        self.progress = None
+        self.fingerprints = set()
+        # How much of run._outbox check_sandbox() has seen, and roughly how
+        # many bytes that takes up.
+        self.outbox_checked = len(run._outbox)
+        self.outbox_bytes = sys.getsizeof(run._outbox)
+
+    def __call__(self, pc, runtime, hands, inbox_pos):
+        if self.max_steps is not None and runtime > self.max_steps:
+            raise exceptions.StepLimitExceeded(
+                f"Program ran for more than {self.max_steps} steps"
+            )
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise self.deadline_error
+
+        if self.detect_loops or self.sandboxed:
+            self.jumps += 1
+            if self.jumps % self.sample == 0:
+                if self.sandboxed:
+                    self.check_sandbox(hands)
+                if self.detect_loops:
+                    self.check_loop(pc, runtime, hands, inbox_pos)
+
+    def check_sandbox(self, hands):
+        run = self.run
+        if self.max_outbox is not None and run.outbox_count > self.max_outbox:
+            raise exceptions.OutboxLimitExceeded(
+                f"Program OUTBOXed more than {self.max_outbox} items"
+            )
+
+        new = run._outbox[self.outbox_checked:]
+        self.outbox_checked += len(new)
+        if self.max_value is not None:
+            limit = self.max_value
+            for value in itertools.chain((hands,), run._floor, new):
+                if type(value) is int and not -limit <= value <= limit:
+                    raise exceptions.ValueLimitExceeded(
+                        f"{value} is outside the range -{limit} to {limit}"
+                    )
+
+        if self.max_memory is not None:
+            self.outbox_bytes += sum(map(sys.getsizeof, new)) + 8 * len(new)
+            used = self.outbox_bytes + sys.getsizeof(hands) + sum(map(sys.getsizeof, run._floor))
+            if used > self.max_memory:
+                raise exceptions.MemoryLimitExceeded(
+                    f"Program used more than {self.max_memory} bytes"
+                )
+
+    def outbox_room(self):
+        """
+        Roughly how many more items the run can OUTBOX before it goes over
+        max_outbox or max_memory, or None if there's no limit on that.
+        """
+        room = None
+        if self.max_outbox is not None:
+            room = max(self.max_outbox - self.run.outbox_count, 0)
+        if self.max_memory is not None:
+            # an int and a pointer to it
+            by_memory = max(self.max_memory - self.outbox_bytes, 0) // 36
+            room = by_memory if room is None else min(room, by_memory)
+        return room
+
+    def check_loop(self, pc, runtime, hands, inbox_pos):
+        run = self.run
+        progress = (run._inbox_pulled, inbox_pos, run.outbox_count)
+        if progress != self.progress or len(self.fingerprints) >= self.max_fingerprints:
+            self.progress = progress
+            self.fingerprints.clear()
+
+        fingerprint = (pc, hands, tuple(run._floor))
+        if fingerprint in self.fingerprints:
+            raise exceptions.InfiniteLoop(
+                f"Program is stuck in a loop at instruction {pc}, after {runtime} steps"
+            )
+        self.fingerprints.add(fingerprint)
+
+
+def make_guard(run, *, max_steps=None, timeout=None, detect_loops=False,
+               max_outbox=None, max_value=None, deadline=None, max_memory=None):
+    """
+    Returns a Guard for the given limits, or None if there aren't any.
+    """
+    sandbox = dict(max_outbox=max_outbox, max_value=max_value, deadline=deadline, max_memory=max_memory)
+    if max_steps is None and timeout is None and not detect_loops and not any(
+        limit is not None for limit in sandbox.values()
+    ):
+        return None
+    return Guard(run, max_steps=max_steps, timeout=timeout, detect_loops=detect_loops, **sandbox)
@@ -0,0 +1,350 @@
+"""
+Loop acceleration: skips over the iterations of simple counting loops
+instead of running them one at a time.
+
+A loop qualifies if its body is straight-line code, from its head to the
+jump back to it, made up only of COPYFROM, COPYTO, ADD, SUB, BUMPUP, BUMPDN
+and OUTBOX with plain (not [pointer]) operands, plus JUMPZ/JUMPN which leave
+the loop. Countdown's
+
+    d:
+        OUTBOX
+        COPYFROM 0
+        JUMPZ    a
+        JUMPN    b
+        BUMPDN   0
+        JUMP     d
+
+is one. On numbers, each iteration of a body like that is a linear function
+of the state it starts with. So once the run arrives at the head, three
+iterations are worked out on the side; if the hands and every tile either
+change by the same amount each time or don't change at all, they go on doing
+so for good, as does every value the body tests or OUTBOXes. That gives the
+iteration where one of the exits is first taken, and everything up to there
+(floor, hands, runtime and outbox) is filled in at once. The run then carries
+on normally from the start of the iteration which leaves the loop.
+
+Anything else (letters, empty tiles, loops which never exit...) just runs
+normally, so results are exactly the same as for the other engines.
+
+This is the 'accelerated' engine. It runs the compiled engine's code with a
+counter kept inline for each loop, and only stops to try accelerating a
+loop once it has gone round WARM_UP times in a row. Loops where that
+doesn't save much are left alone for longer each time (see MIN_SKIPPED).
+So it only pays off for long-running loops: countdown from numbers in the
+thousands goes several times faster than the compiled engine, but where
+loops only go round a few times, the counting makes it some 10% slower.
+"""
+import collections
+import weakref
+
+from . import exceptions
+from . import compiler
+from .analysis import signature
+from .core import MAX_SPECIALIZED
+from .bytecode import (
+    ADD, BUMPDN, BUMPUP, COPYFROM, COPYTO, JUMP, JUMPN, JUMPZ, NOP, OUTBOX, SUB,
+)
+
+
+Loop = collections.namedtuple('Loop', 'head back body steps')
+Loop.__doc__ = """
+A loop from `head` to the backward jump at `back`. `body` is the
+(index, op, arg) of each instruction in it apart from NOPs, ending with the
+backward jump, and `steps` how many steps one iteration takes.
+"""
+
+_BODY_OPS = (COPYFROM, COPYTO, ADD, SUB, BUMPUP, BUMPDN, OUTBOX, NOP, JUMPZ, JUMPN)
+
+# Stop trying to accelerate a loop after it's failed to qualify this many times in a run.
+MAX_FAILURES = 3
+
+# How many times in a row a loop has to go round before it's worth trying to
+# accelerate. Most loops in real solutions only go round a few times.
+WARM_UP = 8
+
+# A try costs about as much as running a few hundred steps, so each time one
+# skips fewer than MIN_SKIPPED steps, the loop's warm up goes up BACK_OFF
+# times over (for later runs of the program too); past MAX_WARM_UP, the
+# loop is left to run normally for the rest of the run.
+MIN_SKIPPED = 500
+BACK_OFF = 4
+MAX_WARM_UP = 512
+
+
+def find_loops(code):
+    """
+    Returns a dict of head -> Loop for the loops in a LinkedProgram's code
+    which can be accelerated.
+    """
+    loops = {}
+    for back, (op, head, _) in enumerate(code):
+        if op not in (JUMP, JUMPZ, JUMPN) or head > back or head in loops:
+            continue
+        body = []
+        for i in range(head, back):
+            body_op, arg, indirect = code[i]
+            if body_op not in _BODY_OPS or indirect:
+                break
+            if body_op in (JUMPZ, JUMPN) and head <= arg <= back:
+                # only jumps out of the loop are allowed
+                break
+            if body_op != NOP:
+                body.append((i, body_op, arg))
+        else:
+            body.append((back, op, head))
+            loops[head] = Loop(head, back, tuple(body), len(body))
+    return loops
+
+
+_loops = weakref.WeakKeyDictionary()
+
+
+def program_loops(program):
+    loops = _loops.get(program)
+    if loops is None:
+        loops = _loops[program] = find_loops(program.link().code)
+    return loops
+
+
+def iterate(loop, hands, floor):
+    """
+    Runs one iteration of `loop` on a copy of the floor, as long as it only
+    deals in numbers and carries on round the loop.
+
+    Returns (hands, floor, outputs, tested) where `tested` holds the value
+    each conditional jump looked at, or None if it would do anything else.
+    """
+    floor = floor[:]
+    outputs = []
+    tested = []
+    for _, op, arg in loop.body:
+        if op == COPYFROM:
+            hands = floor[arg]
+            if type(hands) is not int:
+                return None
+        elif op == OUTBOX:
+            if type(hands) is not int:
+                return None
+            outputs.append(hands)
+            hands = None
+        elif op == BUMPUP or op == BUMPDN:
+            value = floor[arg]
+            if type(value) is not int:
+                return None
+            hands = floor[arg] = value + 1 if op == BUMPUP else value - 1
+        elif op == JUMP:
+            pass
+        elif type(hands) is not int:
+            return None
+        elif op == COPYTO:
+            floor[arg] = hands
+        elif op == ADD or op == SUB:
+            value = floor[arg]
+            if type(value) is not int:
+                return None
+            hands = hands + value if op == ADD else hands - value
+        else:
+            # JUMPZ or JUMPN: the last one is the loop's own; the rest are exits.
+            taken = hands == 0 if op == JUMPZ else hands < 0
+            if taken != (arg == loop.head):
+                return None
+            tested.append(hands)
+    return hands, floor, outputs, tested
+
+
+def _first_exit(loop, tested, deltas):
+    """
+    The first iteration (counting the one `tested` came from as 1) in which
+    one of the loop's conditional jumps sends it out of the loop, or None if
+    that never happens.
+    """
+    first = None
+    jumps = [(op, arg) for _, op, arg in loop.body if op in (JUMPZ, JUMPN)]
+    for (op, arg), value, delta in zip(jumps, tested, deltas):
+        leaves_when_taken = arg != loop.head
+        if op == JUMPZ:
+            if leaves_when_taken:
+                # leaves once value + k * delta == 0
+                if delta == 0 or value % delta != 0 or -value // delta < 0:
+                    continue
+                k = -value // delta
+            else:
+                # leaves as soon as it isn't zero any more
+                if delta == 0:
+                    continue
+                k = 1
+        elif leaves_when_taken:
+            # leaves once value + k * delta < 0
+            if delta >= 0:
+                continue
+            k = value // -delta + 1
+        else:
+            # leaves once value + k * delta >= 0
+            if delta <= 0:
+                continue
+            k = (-value + delta - 1) // delta
+        if first is None or k + 1 < first:
+            first = k + 1
+    return first
+
+
+def accelerate(loop, run, max_steps=None, max_outputs=None):
+    """
+    Skips `run`, which is at the head of `loop`, forward to the start of the
+    iteration which leaves the loop (or as close to max_steps as it can
+    without passing it, or just past OUTBOXing `max_outputs` more items).
+
+    Returns the number of iterations skipped, or None if the loop doesn't
+    qualify from this state, or never ends.
+    """
+    states = []
+    hands, floor = run._hands, run._floor
+    for _ in range(3):
+        result = iterate(loop, hands, floor)
+        if result is None:
+            return None
+        hands, floor, _, _ = result
+        states.append(result)
+    hands1, floor1, outputs0, _ = states[0]
+    hands2, floor2, outputs1, tested1 = states[1]
+    hands3, floor3, outputs2, tested2 = states[2]
+
+    # Check everything keeps moving in step
+    slots1 = [hands1, *floor1]
+    slots2 = [hands2, *floor2]
+    slots3 = [hands3, *floor3]
+    deltas = []
+    for a, b, c in zip(slots1, slots2, slots3):
+        if type(a) is int and type(b) is int and type(c) is int:
+            if b - a != c - b:
+                return None
+            deltas.append(b - a)
+        elif a == b == c and type(a) is type(b) is type(c):
+            deltas.append(None)
+        else:
+            return None
+
+    tested_deltas = [b - a for a, b in zip(tested1, tested2)]
+    exit_iteration = _first_exit(loop, tested1, tested_deltas)
+    if exit_iteration is None:
+        return None
+    # The iterations before the one that leaves (numbering the first from
+    # the head as 0), all of which run in full.
+    count = exit_iteration
+    if max_steps is not None:
+        count = min(count, (max_steps - run.runtime) // loop.steps)
+    if max_outputs is not None and outputs1:
+        count = min(count, max_outputs // len(outputs1) + 1)
+    if count <= 3:
+        return 0
+
+    # Iteration k (for k >= 1) starts from slots1 + (k - 1) * delta.
+    n = count - 1
+    hands = hands1 if deltas[0] is None else hands1 + n * deltas[0]
+    for tile, (value, delta) in enumerate(zip(floor1, deltas[1:])):
+        if delta is not None:
+            run._floor[tile] = value + n * delta
+        else:
+            run._floor[tile] = value
+    run._hands = hands
+
+    values = list(outputs0)
+    if outputs1:
+        steps = [b - a for a, b in zip(outputs1, outputs2)]
+        if len(outputs1) == 1:
+            start, step = outputs1[0], steps[0]
+            values += range(start, start + n * step, step) if step else [start] * n
+        else:
+            for k in range(n):
+                values += [a + k * d for a, d in zip(outputs1, steps)]
+    if run.sink is None:
+        run._outbox += values
+    else:
+        for value in values:
+            run._emit(value)
+    run.runtime += count * loop.steps
+    return count
+
+
+class _Resume(exceptions.RunAborted):
+    """
+    Raised from the guard to get a run resumed from the middle of a block
+    back into the compiled code, at the next backward jump.
+    """
+
+
+_watching = weakref.WeakKeyDictionary()
+# program -> head -> warm up, carried over from one run to the next
+_warm_ups = weakref.WeakKeyDictionary()
+
+
+def _watching_compiled(run, sig, active, loops):
+    """
+    The program's compiled form, specialised for `sig` (see compiler.execute()),
+    which watches the loops in `active` (head -> warm up); or None if the
+    run can't be resumed with it.
+    """
+    program = run.program
+    compiled = _watching.setdefault(program, {})
+    key = sig, frozenset(active.items())
+    if key not in compiled and len(compiled) >= MAX_SPECIALIZED:
+        key = None, key[1]
+    if key not in compiled:
+        watch = {head: (loops[head].back, warm_up) for head, warm_up in active.items()}
+        compiled[key] = compiler.compile_program(program, key[0], watch)
+    if run.program_pointer in compiled[key].leaders or run.program_pointer >= len(program.instructions):
+        return compiled[key]
+    return None
+
+
+def execute(run, guard=None):
+    """
+    Runs `run` to completion with the compiled engine, accelerating any loops
+    it can along the way. Loop detection and max_value need to see every
+    iteration (a skipped one could have gone out of range), so with either
+    of those set this is just the compiled engine.
+    """
+    loops = program_loops(run.program)
+    if not loops or getattr(guard, 'detect_loops', False) or getattr(guard, 'max_value', None) is not None:
+        return compiler.execute(run, guard)
+    max_steps = getattr(guard, 'max_steps', None)
+
+    # head -> warm up, for the loops still worth watching
+    warm_ups = _warm_ups.setdefault(run.program, dict.fromkeys(loops, WARM_UP))
+    active = dict(warm_ups)
+    # Accelerating a loop leaves the run just where it would have got to
+    # anyway, so code specialised for how it started still holds afterwards.
+    sig = signature(run._hands, run._floor) if run.program_pointer == 0 else None
+    failures = collections.Counter()
+
+    def resume(pc, runtime, hands, inbox_pos):
+        if guard is not None:
+            guard(pc, runtime, hands, inbox_pos)
+        raise _Resume
+
+    while True:
+        # (Once there's nothing left to watch, this is the plain compiled code.)
+        compiled = _watching_compiled(run, sig, active, loops)
+        try:
+            if compiled is None:
+                return compiler.execute(run, resume)
+            return compiled(run, guard)
+        except _Resume:
+            pass
+        except compiler.AtLoopHead:
+            head = run.program_pointer
+            room = guard.outbox_room() if getattr(guard, 'sandboxed', False) else None
+            skipped = accelerate(loops[head], run, max_steps, room)
+            if skipped is None:
+                failures[head] += 1
+                if failures[head] >= MAX_FAILURES:
+                    del active[head]
+            elif skipped * loops[head].steps < MIN_SKIPPED:
+                warm_up = active[head] * BACK_OFF
+                if warm_up > MAX_WARM_UP:
+                    del active[head]
+                else:
+                    active[head] = warm_ups[head] = warm_up
+            # Either way, the counts start again, so it has to go round
+            # a few more times before the next try.
@@ -0,0 +1,183 @@
+"""
+Memoises whole runs, keyed by the program and its starting inbox and floor.
+
+Runs are deterministic, so there's no need to run the same program against
+the same inbox twice. A grader which sees the same submissions over and over
+can keep a RunMemo around and run everything through it:
+
+    memo = RunMemo(maxsize=10000)
+    run = program.run(inbox=inbox, engine='compiled', memo=memo)
+
+On a hit, the returned ProgramRun is put straight into the state the first
+run finished in (outbox, floor, hands, runtime and all) without executing
+anything.
+
+Programs are identified by their linked code, so two Programs parsed from
+sources which only differ in comments, labels or layout share their entries.
+"""
+import collections
+import hashlib
+import sys
+import threading
+import weakref
+
+from . import exceptions
+from .core import RunState
+
+
+class _Entry:
+    __slots__ = ('state', 'error', 'size')
+
+    def __init__(self, state, error, size):
+        self.state = state
+        self.error = error
+        self.size = size
+
+
+def fingerprint(program):
+    """
+    A digest of what a program does, ignoring how its source is laid out.
+    """
+    return hashlib.sha256(repr(program.link().code).encode('ascii')).digest()
+
+
+def _key(fingerprint, run, limits):
+    digest = hashlib.blake2b(
+        repr((run._hands, run._floor, run._inbox[run._inbox_pos:])).encode('utf-8'),
+        digest_size=16,
+    )
+    return fingerprint, digest.digest(), limits
+
+
+def _size(values):
+    return sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values)
+
+
+class RunMemo:
+    """
+    A bounded LRU memo of run outcomes.
+
+    At most `maxsize` runs are remembered, and if `maxbytes` is given, the
+    (roughly estimated) memory their outboxes, floors and inboxes take up is
+    kept under that too. The least recently used entries go first.
+
+    With cache_errors=True, runs which raised a RunError are remembered as
+    well, and a hit raises the same kind of error again. Runs that hit a timeout
+    never are, since whether they do depends on how busy the machine was.
+    """
+    def __init__(self, maxsize=4096, maxbytes=None, cache_errors=False):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.cache_errors = cache_errors
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self._fingerprints = weakref.WeakKeyDictionary()
+
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def run(self, program, *, inbox='', floor=None, typed=False, engine='compiled',
+            max_steps=None, timeout=None, detect_loops=False,
+            max_outbox=None, max_value=None, deadline=None, max_memory=None):
+        """
+        Like Program.run(), but reuses the outcome of an earlier run with the
+        same program, inbox, floor and limits if there's one remembered.
+
+        Streamed inboxes (anything that isn't a sequence) are read as they're
+        needed, so they can't be looked up; runs with them are never memoised.
+        """
+        limits = dict(
+            max_steps=max_steps, timeout=timeout, detect_loops=detect_loops,
+            max_outbox=max_outbox, max_value=max_value, deadline=deadline, max_memory=max_memory,
+        )
+        run = program.bind(inbox=inbox, floor=floor, typed=typed)
+        if run._inbox_source is not None:
+            return run.run(engine=engine, **limits)
+
+        fp = self._fingerprints.get(program)
+        if fp is None:
+            fp = self._fingerprints[program] = fingerprint(program)
+        # Time limits aren't part of the key, since they can't change the
+        # outcome of a run that gets remembered.
+        key = _key(fp, run, (max_steps, bool(detect_loops), max_outbox, max_value, max_memory))
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            run.restore(entry.state)
+            if entry.error is not None:
+                # A new one each time, so that no two callers share (and add
+                # tracebacks or context to) the same exception.
+                raise type(entry.error)(*entry.error.args)
+            return run
+
+        error = None
+        try:
+            run.run(engine=engine, **limits)
+        except (exceptions.RunError, exceptions.InvalidFloorIndex) as e:
+            if not self.cache_errors or isinstance(e, exceptions.TimeLimitExceeded):
+                raise
+            # Kept without the traceback, which holds on to the whole run.
+            error = type(e)(*e.args)
+            self._store(key, run, error)
+            raise
+        self._store(key, run, error)
+        return run
+
+    def _store(self, key, run, error):
+        # Copies, so nothing the caller does to the run can change the entry.
+        outbox = tuple(run._outbox)
+        floor = list(run._floor)
+        inbox = run._inbox[run._inbox_pos:]
+        state = RunState(
+            program_pointer=run.program_pointer,
+            runtime=run.runtime,
+            hands=run._hands,
+            floor=floor,
+            inbox=inbox,
+            inbox_pos=0,
+            inbox_source=None,
+            inbox_pulled=0,
+            outbox=((outbox, len(outbox)),),
+            sunk=0,
+        )
+        size = _size(outbox) + _size(floor) + _size(inbox) + 400
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self.entries[key] = _Entry(state, error, size)
+            self.bytes += size
+            while len(self.entries) > self.maxsize or (
+                self.maxbytes is not None and self.bytes > self.maxbytes
+            ):
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
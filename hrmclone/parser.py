@@ -0,0 +1,162 @@
+"""
+The program parser.
+
+Source is read one line at a time, from a string, a file (text or binary),
+bytes, or an mmap, without ever building a list of all the lines. Each line
+is split once and looked up in a table of instruction names, and anything
+that goes wrong is reported with its line and column.
+"""
+import glob
+import io
+import mmap
+import os
+
+from . import exceptions
+from .core import InstructionRegistry
+
+
+# Instruction name (as written in programs) -> Instruction subclass.
+# Built on first use, once every instruction has been registered.
+_OPCODES = {}
+
+
+def opcode_table():
+    if not _OPCODES:
+        for name, klass in InstructionRegistry.instructions.items():
+            _OPCODES[name] = klass
+            _OPCODES[name.upper()] = klass
+    return _OPCODES
+
+
+class LineReader:
+    """
+    Iterates over the lines of a program's source, keeping count of the line
+    number and of the offset in the source of the next line (in characters
+    for a str or text file, bytes otherwise). Lines come out as str, without
+    their line ending.
+    """
+    def __init__(self, source):
+        if isinstance(source, str):
+            lines = io.StringIO(source)
+        elif isinstance(source, mmap.mmap):
+            lines = iter(source.readline, b'')
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            lines = io.BytesIO(source)
+        else:
+            # some sort of file
+            lines = source
+        self._lines = iter(lines)
+        self.lineno = 0
+        self.offset = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self._lines)
+        self.lineno += 1
+        self.offset += len(line)
+        if not isinstance(line, str):
+            line = line.decode('utf-8')
+        return line.rstrip('\r\n')
+
+
+def _column(line, text):
+    """
+    1-based column where `text` first appears in `line`.
+    """
+    return line.find(text) + 1
+
+
+def make_instruction(line, stripped):
+    """
+    Instantiates the instruction on a single (non-blank, non-label) line.
+    """
+    table = opcode_table()
+    command, *arguments = stripped.split()
+    klass = table.get(command)
+    if klass is None:
+        name = command.lower()
+        if name == 'define':
+            if not arguments:
+                raise exceptions.InvalidArgument('DEFINE needs COMMENT or LABEL')
+            name += ' %s' % arguments.pop(0).lower()
+        klass = table.get(name)
+        if klass is None:
+            raise exceptions.NoSuchInstruction(name.upper())
+
+    try:
+        instance = klass(*arguments)
+    except (TypeError, ValueError):
+        e = exceptions.InvalidArgument(f"Bad arguments for {command.upper()}: {' '.join(arguments)!r}")
+        if arguments:
+            e.column = _column(line, arguments[0])
+        raise e
+    instance.text = stripped
+    return instance
+
+
+def parse(program, source):
+    """
+    Parses `source` for `program`.
+
+    Returns (instructions, jump_targets, positions), where positions holds the
+    (line, column) of each instruction.
+    """
+    lines = LineReader(source)
+    instructions = []
+    jump_targets = {}
+    positions = []
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped.startswith('--'):
+            # empty or an actual comment, can discard.
+            # there's one of these comments in the header of each program.
+            continue
+
+        if len(stripped) == 2 and stripped[1] == ':' and 'a' <= stripped[0] <= 'z':
+            # This is a label for a jump target, not an instruction.
+            jump_targets[stripped[0]] = len(instructions)
+            continue
+
+        lineno = lines.lineno
+        column = _column(line, stripped)
+        try:
+            instruction = make_instruction(line, stripped)
+
+            # For complex instructions ('DEFINE COMMENT') extra lines might be
+            # required. Give the instruction access to the line stream so it
+            # can fetch more lines if necessary.
+            instruction.parse_extra_lines(program, lines)
+        except exceptions.ParseError as e:
+            e.locate(lineno, column)
+            raise
+
+        instructions.append(instruction)
+        positions.append((lineno, column))
+    return instructions, jump_targets, positions
+
+
+def open_source(path):
+    """
+    Opens a program file for parsing. Returns (source, file); the file
+    should be closed once the source has been parsed.
+
+    Non-empty files are memory-mapped rather than read.
+    """
+    f = open(path, 'rb')
+    if os.fstat(f.fileno()).st_size == 0:
+        return b'', f
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), f
+
+
+def iter_programs(directory, pattern='*', drawings='keep'):
+    """
+    Parses every file in `directory` matching `pattern`, yielding (path, Program).
+    `drawings` is passed to Program.from_file(); 'skip' or 'offsets' save
+    keeping every solution's drawings in memory when only the code is wanted.
+    """
+    from .core import Program
+    for path in sorted(glob.glob(os.path.join(directory, pattern))):
+        if os.path.isfile(path):
+            yield path, Program.from_file(path, drawings=drawings)
@@ -0,0 +1,277 @@
+"""
+A peephole optimiser for the bytecode encoding, and a loop that runs its output.
+
+Two things are done to a LinkedProgram:
+
+ * Fusing. Most instructions in a real solution are followed by an OUTBOX,
+   COPYTO, COPYFROM or jump (COPYFROM 3; OUTBOX, INBOX; COPYTO 0,
+   BUMPDN 0; JUMPZ a, ...). Each slot which can fall through to the next
+   gets a copy of that next instruction attached as a "then" part, which the
+   dispatch loop runs straight after the first part, without going back
+   round the loop.
+
+ * Jump threading. A jump whose target is another JUMP (possibly with NOPs in
+   between) goes straight to where that one ends up, adding the steps for the
+   hops it skipped. The guard is called after every backward jump, so a
+   chain is only followed while that still happens in the same place and at
+   the same runtime (see thread_jump()).
+
+Every instruction keeps its own slot, so program_pointer, runtime and the
+place errors are raised are all exactly the same as for the other engines;
+a jump into the middle of a fused pair just lands on the second instruction's
+own slot.
+"""
+from . import exceptions
+from .bytecode import (
+    ADD, BUMPUP, COPYFROM, COPYTO, INBOX, JUMP, JUMPN, JUMPS, JUMPZ, NOP,
+    OPCODE_NAMES, OUTBOX, _add, _resolve_pointer, _sub,
+)
+
+
+# Instructions which can be a "then" part.
+THEN_OPS = (OUTBOX, COPYTO, COPYFROM, JUMP, JUMPZ, JUMPN)
+
+
+class OptimizedProgram:
+    """
+    The optimised form of a LinkedProgram.
+
+    `code` holds one (op, arg, indirect, then, then_arg, then_extra) tuple per
+    instruction. For jumps, `arg` is the (threaded) target and `indirect` the
+    number of extra steps the threading skipped. `then` is the opcode of the
+    fused second part (or -1 for none), with its operand in `then_arg`.
+    `then_extra` is the indirect flag for COPYTO and COPYFROM, and the extra
+    steps for jumps.
+    """
+    def __init__(self, code):
+        self.code = tuple(code)
+
+    def __len__(self):
+        return len(self.code)
+
+    def dump(self):
+        """
+        Returns a human readable listing, in the style of LinkedProgram.dump().
+        """
+        lines = []
+        for i, (op, arg, indirect, then, then_arg, then_extra) in enumerate(self.code):
+            line = f'{i:4} {_describe(op, arg, indirect)}'
+            if then >= 0:
+                line += f'; {_describe(then, then_arg, then_extra)}'
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+def _describe(op, arg, extra):
+    name = OPCODE_NAMES[op]
+    if op in (INBOX, OUTBOX, NOP):
+        return name
+    if op in JUMPS:
+        return f'{name} {arg} (+{extra})' if extra else f'{name} {arg}'
+    return f'{name} [{arg}]' if extra else f'{name} {arg}'
+
+
+def thread_jump(code, source, target):
+    """
+    Follows the chain of unconditional jumps starting at `target`, for the
+    jump at `source`.
+
+    Returns (final target, extra steps), where the extra steps are the number
+    of JUMPs skipped. Forward hops can always be skipped. A backward one calls
+    the guard where it lands, so the chain only goes through one if it's the
+    last hop and the jump from `source` then goes backwards to the same place.
+    A backward jump from `source` isn't threaded at all, for the same reason.
+    """
+    if target <= source:
+        return target, 0
+    end = len(code)
+    extra = 0
+    current = target
+    while True:
+        # NOPs don't count towards runtime, so they can be skipped for free.
+        while current < end and code[current][0] == NOP:
+            current += 1
+        if current >= end or code[current][0] != JUMP:
+            return current, extra
+        following = code[current][1]
+        if following <= current:
+            if following <= source:
+                return following, extra + 1
+            return current, extra
+        extra += 1
+        current = following
+
+
+def optimize(linked):
+    """
+    Returns the OptimizedProgram for a LinkedProgram.
+    """
+    code = linked.code
+    end = len(code)
+
+    optimized = []
+    for i, (op, arg, indirect) in enumerate(code):
+        if op in JUMPS:
+            arg, indirect = thread_jump(code, i, arg)
+        then, then_arg, then_extra = -1, 0, 0
+        # A JUMP never falls through to a second part, and neither does a NOP
+        # (it isn't counted as a step, which the fused loop assumes).
+        if op != JUMP and op != NOP and i + 1 < end:
+            next_op, next_arg, next_indirect = code[i + 1]
+            if next_op in THEN_OPS:
+                then, then_arg, then_extra = next_op, next_arg, next_indirect
+                if next_op in JUMPS:
+                    then_arg, then_extra = thread_jump(code, i + 1, next_arg)
+        optimized.append((op, arg, indirect, then, then_arg, then_extra))
+    return OptimizedProgram(optimized)
+
+
+def execute(run, guard=None):
+    """
+    Runs `run` to completion using its program's optimised form.
+
+    Behaves exactly like hrmclone.bytecode.execute(), just with fewer trips
+    round the dispatch loop.
+    """
+    code = run.program.optimize().code
+    floor = run._floor
+    emit = run._emit
+    inbox = run._inbox
+    inbox_pos = run._inbox_pos
+    inbox_len = len(inbox)
+    source = run._inbox_source
+    hands = run._hands
+    pc = run.program_pointer
+    runtime = run.runtime
+    end = len(code)
+
+    try:
+        while pc < end:
+            op, arg, indirect, then, then_arg, then_extra = code[pc]
+
+            # Split the opcodes in two first (see bytecode's numbering), so
+            # no instruction is more than a few comparisons away.
+            if op < ADD:
+                if op == COPYFROM:
+                    hands = None
+                    if indirect:
+                        arg = _resolve_pointer(floor, arg)
+                    hands = floor[arg]
+                    if hands is None:
+                        raise exceptions.EmptyFloorTile
+                elif op == COPYTO:
+                    if hands is None:
+                        raise exceptions.EmptyHands
+                    if indirect:
+                        arg = _resolve_pointer(floor, arg)
+                    floor[arg] = hands
+                elif op == JUMP:
+                    runtime += 1 + indirect
+                    if arg <= pc and guard is not None:
+                        pc = arg
+                        guard(pc, runtime, hands, inbox_pos)
+                    pc = arg
+                    continue
+                else:
+                    # JUMPZ or JUMPN
+                    if hands is None:
+                        raise exceptions.EmptyHands
+                    if hands == 0 if op == JUMPZ else type(hands) is int and hands < 0:
+                        runtime += 1 + indirect
+                        if arg <= pc and guard is not None:
+                            pc = arg
+                            guard(pc, runtime, hands, inbox_pos)
+                        pc = arg
+                        continue
+            elif op == OUTBOX:
+                if hands is None:
+                    raise exceptions.EmptyHands
+                emit(hands)
+                hands = None
+            elif op == INBOX:
+                if inbox_pos >= inbox_len:
+                    if source is None:
+                        # End of the program (see ProgramRun._run)
+                        break
+                    run._inbox_pos = inbox_pos
+                    if not run._pull_inbox():
+                        break
+                    inbox = run._inbox
+                    inbox_pos = 0
+                    inbox_len = len(inbox)
+                hands = inbox[inbox_pos]
+                inbox_pos += 1
+            elif op == NOP:
+                # doesn't count towards runtime
+                pc += 1
+                continue
+            elif op >= BUMPUP:
+                if indirect:
+                    arg = _resolve_pointer(floor, arg)
+                value = floor[arg]
+                if value is None:
+                    raise exceptions.EmptyFloorTile
+                if type(value) is not int:
+                    raise exceptions.MathDomainError
+                hands = floor[arg] = value + 1 if op == BUMPUP else value - 1
+            else:
+                # ADD or SUB
+                if hands is None:
+                    raise exceptions.EmptyHands
+                if indirect:
+                    arg = _resolve_pointer(floor, arg)
+                operand = floor[arg]
+                if operand is None:
+                    raise exceptions.EmptyFloorTile
+                if type(hands) is int and type(operand) is int:
+                    hands = hands + operand if op == ADD else hands - operand
+                elif op == ADD:
+                    hands = _add(None, hands, operand)
+                else:
+                    hands = _sub(None, hands, operand)
+
+            pc += 1
+            runtime += 1
+            if then < 0:
+                continue
+
+            # The second half of a fused pair; pc and runtime already point
+            # at it, so any error is raised from the right place.
+            if then == OUTBOX:
+                if hands is None:
+                    raise exceptions.EmptyHands
+                emit(hands)
+                hands = None
+            elif then == COPYFROM:
+                hands = None
+                if then_extra:
+                    then_arg = _resolve_pointer(floor, then_arg)
+                hands = floor[then_arg]
+                if hands is None:
+                    raise exceptions.EmptyFloorTile
+            elif then == COPYTO:
+                if hands is None:
+                    raise exceptions.EmptyHands
+                if then_extra:
+                    then_arg = _resolve_pointer(floor, then_arg)
+                floor[then_arg] = hands
+            elif (
+                then == JUMP
+                or (hands == 0 if then == JUMPZ else type(hands) is int and hands < 0)
+            ):
+                runtime += 1 + then_extra
+                if then_arg <= pc and guard is not None:
+                    pc = then_arg
+                    guard(pc, runtime, hands, inbox_pos)
+                pc = then_arg
+                continue
+            elif hands is None:
+                # A conditional jump, not taken because there's nothing to test
+                raise exceptions.EmptyHands
+            pc += 1
+            runtime += 1
+    finally:
+        run._inbox_pos = inbox_pos
+        run._hands = hands
+        run.program_pointer = pc
+        run.runtime = runtime
@@ -0,0 +1,168 @@
+"""
+A per-instruction profiler.
+
+    profiler = Profiler()
+    for inbox in inboxes:
+        program.bind(inbox=inbox).run(trace=profiler)
+    print(profiler.format(sort=True))
+
+It's a Tracer, so it only costs anything on runs it's attached to; normal
+runs never look at it. The counts add up to the runs' `runtime`: an INBOX
+which found the inbox empty, or an instruction which raised an error, isn't
+counted (the run stopped there instead, see `stopped_at`).
+"""
+import collections
+import time
+
+from .core import Jump, JumpN, JumpZ, _Noop
+from .tracing import Tracer
+
+
+LineStats = collections.namedtuple(
+    'LineStats', 'index line text count taken not_taken seconds',
+)
+LineStats.__doc__ = """
+The profile of one instruction. `line` is its line in the source, and `text`
+the instruction as written there.
+
+`taken` and `not_taken` are only set for jumps; `seconds` only if the
+profiler was timing.
+"""
+
+
+def _jump_taken(jump, hands):
+    # Jumps leave the hands alone, so they still say which way it went. (The
+    # program pointer doesn't, for a jump to the very next instruction.)
+    if isinstance(jump, JumpZ):
+        return hands == 0
+    if isinstance(jump, JumpN):
+        return type(hands) is int and hands < 0
+    return True
+
+
+class Profiler(Tracer):
+    """
+    Counts how many times each instruction runs, and which way each jump goes.
+    With timing=True it also adds up the time spent on each instruction, which
+    slows the run down a good deal more than counting does.
+
+    A Profiler can be reused for any number of runs of the same Program; the
+    numbers accumulate.
+    """
+    def __init__(self, timing=False):
+        self.timing = timing
+        self.program = None
+        self.runs = 0
+        self.counts = []
+        self.taken = []
+        self.seconds = []
+        # instruction index -> number of runs which stopped there
+        self.stopped_at = collections.Counter()
+
+        self._jumps = ()
+        self._last = None
+        self._last_runtime = 0
+        self._last_taken = False
+        self._clock = 0.0
+
+    def start(self, run):
+        program = run.program
+        if self.program is None:
+            size = len(program.instructions)
+            self.program = program
+            self.counts = [0] * size
+            self.taken = [0] * size
+            self.seconds = [0.0] * size
+            self._jumps = frozenset(
+                i for i, instruction in enumerate(program.instructions)
+                if isinstance(instruction, Jump)
+            )
+        elif program is not self.program:
+            raise ValueError('A Profiler can only profile runs of one Program')
+        self.runs += 1
+        self._last = None
+        if self.timing:
+            self._clock = time.perf_counter()
+
+    def step(self, run, index, instruction):
+        if self.timing:
+            now = time.perf_counter()
+            self.seconds[index] += now - self._clock
+            self._clock = now
+
+        if isinstance(instruction, _Noop):
+            # COMMENTs and DEFINEs don't count towards runtime, so they
+            # aren't counted here either.
+            return
+
+        self.counts[index] += 1
+        taken = index in self._jumps and _jump_taken(instruction, run._hands)
+        if taken:
+            self.taken[index] += 1
+
+        self._last = index
+        self._last_runtime = run.runtime
+        self._last_taken = taken
+
+    def finish(self, run):
+        last = self._last
+        if last is not None and run.runtime == self._last_runtime:
+            # The last instruction never completed (so runtime wasn't bumped
+            # for it); it's where the run stopped.
+            self.counts[last] -= 1
+            if self._last_taken:
+                self.taken[last] -= 1
+            self.stopped_at[last] += 1
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def report(self):
+        """
+        Returns a LineStats for each instruction, in program order.
+        """
+        if self.program is None:
+            return []
+        rows = []
+        for index, instruction in enumerate(self.program.instructions):
+            count = self.counts[index]
+            taken = not_taken = None
+            if index in self._jumps:
+                taken = self.taken[index]
+                not_taken = count - taken
+            rows.append(LineStats(
+                index,
+                self.program.positions[index][0],
+                instruction.text,
+                count,
+                taken,
+                not_taken,
+                self.seconds[index] if self.timing else None,
+            ))
+        return rows
+
+    def format(self, sort=False, top=None):
+        """
+        The report as a table. With sort=True the hottest instructions come
+        first; `top` limits how many are shown.
+        """
+        rows = self.report()
+        if sort:
+            rows.sort(key=lambda row: (-row.count, row.index))
+        if top is not None:
+            rows = rows[:top]
+
+        total = self.total or 1
+        lines = [f'{"line":>5} {"count":>10} {"%":>6} {"taken":>10} {"not taken":>10}'
+                 + (f' {"seconds":>10}' if self.timing else '') + '  instruction']
+        for row in rows:
+            line = f'{row.line:>5} {row.count:>10} {100 * row.count / total:>6.1f}'
+            if row.taken is None:
+                line += f' {"":>10} {"":>10}'
+            else:
+                line += f' {row.taken:>10} {row.not_taken:>10}'
+            if self.timing:
+                line += f' {row.seconds:>10.6f}'
+            lines.append(f'{line}  {row.text}')
+        return '\n'.join(lines)
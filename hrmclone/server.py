@@ -0,0 +1,383 @@
+"""
+A local grading service, so that grading a solution doesn't pay for starting
+Python, importing hrmclone and parsing the program every time.
+
+    python -m hrmclone serve --port 8421 --workers 4
+
+starts a pool of worker processes (each with its own ProgramCache) and an
+HTTP server in front of them. POST a job, or a JSON list of them, to /grade:
+
+    {"program": "-- HUMAN RESOURCE MACHINE PROGRAM --\n...", "level": 19,
+     "cases": 100, "seed": 0, "max_steps": 100000, "id": "anything"}
+
+Only "program" and "level" are needed. "cases" and "max_steps" can't go
+over MAX_CASES and MAX_STEPS, and each job is also held to JOB_TIMEOUT
+seconds and the SANDBOX limits, whatever it asks for. The response is one line of JSON per
+job, written out as each one finishes (so not necessarily in order; "id"
+says which is which). GET /stats reports the queue depth, throughput and
+latency.
+
+Jobs for the same program that arrive close together are sent to a worker
+as one batch, so the program is only parsed (or fetched from the cache) once.
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from . import exceptions
+from .batch import worker_state
+from .cache import ProgramCache, source_key
+from .levels import get_level, score
+
+
+DEFAULT_PORT = 8421
+
+# How long to wait for more jobs for the same program before sending a
+# batch off, and the most jobs in one batch.
+BATCH_WINDOW = 0.005
+MAX_BATCH = 64
+
+# How many of the most recent jobs the latency stats are worked out from.
+LATENCY_WINDOW = 1000
+
+# How many failures to include in each job's result.
+MAX_FAILURES = 5
+
+# The most cases and steps (per case) a job can ask for, and the defaults.
+MAX_CASES = 1000
+DEFAULT_CASES = 100
+MAX_STEPS = 1000000
+DEFAULT_STEPS = 100000
+
+# Seconds a job gets for all its cases.
+JOB_TIMEOUT = 10
+
+# Limits on each case, since the programs can be anything; see
+# hrmclone.limits.Guard. The game itself doesn't allow numbers past 999.
+SANDBOX = dict(max_outbox=10000, max_value=999, max_memory=10 * 2 ** 20)
+
+
+# The default size of each worker's ProgramCache.
+CACHE_SIZE = 1024
+
+
+def _worker_cache(maxsize):
+    return worker_state(('ProgramCache', maxsize), ProgramCache, maxsize)
+
+
+def _warm(maxsize):
+    # Submitting this makes the pool start a worker, which sets up its cache.
+    _worker_cache(maxsize)
+
+
+def _error(e):
+    return f'{type(e).__name__}: {e}'
+
+
+def _bounded(job, name, default, maximum):
+    value = job.get(name, default)
+    if type(value) is not int or value < 1:
+        raise ValueError(f'{name} should be a whole number above 0, not {value!r}')
+    return min(value, maximum)
+
+
+def grade(job, cache=None):
+    """
+    Scores one job (a dict, as POSTed to /grade) and returns its result as
+    a dict which can be turned into JSON.
+    """
+    result = {'id': job.get('id')}
+    try:
+        cases = _bounded(job, 'cases', DEFAULT_CASES, MAX_CASES)
+        max_steps = _bounded(job, 'max_steps', DEFAULT_STEPS, MAX_STEPS)
+        if cache is None:
+            cache = _worker_cache(CACHE_SIZE)
+        program = cache.get(job['program'])
+        level = get_level(job['level'])
+        outcome = score(
+            program, level, cases, seed=job.get('seed', 0), max_steps=max_steps,
+            fail_fast=job.get('fail_fast', False),
+            deadline=time.monotonic() + JOB_TIMEOUT, **SANDBOX,
+        )
+    except (exceptions.ParseError, AttributeError, KeyError, TypeError, ValueError) as e:
+        result['error'] = _error(e)
+        return result
+
+    result.update(
+        level=level.name,
+        passed=outcome.passed,
+        cases=outcome.cases,
+        size=outcome.size,
+        average_runtime=outcome.average_runtime,
+        worst_runtime=outcome.worst_runtime,
+        meets_size=outcome.meets_size,
+        meets_speed=outcome.meets_speed,
+        failures=[
+            {
+                'index': failure.index,
+                'inbox': list(failure.inbox),
+                'expected': list(failure.expected),
+                'outbox': list(failure.outbox),
+                'error': None if failure.error is None else _error(failure.error),
+            }
+            for failure in outcome.failures[:MAX_FAILURES]
+        ],
+    )
+    return result
+
+
+def grade_batch(jobs, cache_size=CACHE_SIZE):
+    """
+    Grades a list of jobs in a worker. They're normally all for the same
+    program, so it's only looked up in the cache once.
+    """
+    cache = _worker_cache(cache_size)
+    return [grade(job, cache) for job in jobs]
+
+
+class _Job:
+    __slots__ = ('data', 'key', 'future', 'submitted')
+
+    def __init__(self, data):
+        self.data = data
+        self.key = source_key(data['program']) if isinstance(data.get('program'), str) else None
+        self.future = concurrent.futures.Future()
+        self.submitted = time.monotonic()
+
+
+class GradingService:
+    """
+    Queues grading jobs, batches them up per program, and runs the batches
+    on a pool of `workers` processes, started (and kept) warm up front.
+    With workers=0 the batches run on a thread in this process instead.
+
+    `cache_size` is the size of each worker's ProgramCache.
+    """
+    def __init__(self, workers=None, *, cache_size=CACHE_SIZE,
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.cache_size = cache_size
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.started = time.monotonic()
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        if workers == 0:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        else:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            # Start every worker now, rather than when the first jobs arrive.
+            for future in [self.executor.submit(_warm, cache_size) for _ in range(self.workers)]:
+                future.result()
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.batches = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        # (time, completed count) every so often, for recent throughput
+        self.history = collections.deque([(self.started, 0)], maxlen=60)
+
+        self.closed = False
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, data):
+        """
+        Queues a job, and returns a concurrent.futures.Future for its result.
+        """
+        if self.closed:
+            raise RuntimeError('The grading service has been closed')
+        job = _Job(data)
+        self.queue.put(job)
+        return job.future
+
+    def _dispatch(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            # Collect whatever else arrives in the next little while, and
+            # group it by program.
+            groups = collections.OrderedDict()
+            groups.setdefault(job.key, []).append(job)
+            deadline = time.monotonic() + self.batch_window
+            stop = False
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    job = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                groups.setdefault(job.key, []).append(job)
+
+            for jobs in groups.values():
+                # Big groups are still spread over all the workers.
+                size = min(self.max_batch, -(-len(jobs) // max(self.workers, 1)))
+                for start in range(0, len(jobs), size):
+                    self._send(jobs[start:start + size])
+            if stop:
+                return
+
+    def _send(self, jobs):
+        with self.lock:
+            self.in_flight += len(jobs)
+            self.batches += 1
+        future = self.executor.submit(grade_batch, [job.data for job in jobs], self.cache_size)
+        future.add_done_callback(lambda f: self._finish(jobs, f))
+
+    def _finish(self, jobs, future):
+        now = time.monotonic()
+        error = future.exception()
+        with self.lock:
+            self.in_flight -= len(jobs)
+            self.completed += len(jobs)
+            for job in jobs:
+                self.latencies.append(now - job.submitted)
+            if now - self.history[-1][0] >= 1:
+                self.history.append((now, self.completed))
+        if error is not None:
+            for job in jobs:
+                job.future.set_result({'id': job.data.get('id'), 'error': _error(error)})
+        else:
+            for job, result in zip(jobs, future.result()):
+                job.future.set_result(result)
+
+    def stats(self):
+        """
+        Queue depth, throughput (jobs per second, overall and over about the
+        last minute) and latency (seconds from submission to result, over the
+        last LATENCY_WINDOW jobs).
+        """
+        now = time.monotonic()
+        with self.lock:
+            latencies = sorted(self.latencies)
+            completed = self.completed
+            in_flight = self.in_flight
+            batches = self.batches
+            oldest = self.history[0]
+
+        def percentile(p):
+            return latencies[min(int(p * len(latencies)), len(latencies) - 1)] if latencies else None
+
+        return {
+            'workers': self.workers,
+            'queued': self.queue.qsize(),
+            'in_flight': in_flight,
+            'completed': completed,
+            'batches': batches,
+            'uptime': now - self.started,
+            'throughput': completed / (now - self.started),
+            'recent_throughput': (completed - oldest[1]) / (now - oldest[0]) if now > oldest[0] else None,
+            'latency': {
+                'mean': sum(latencies) / len(latencies) if latencies else None,
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': latencies[-1] if latencies else None,
+            },
+        }
+
+    def close(self):
+        self.closed = True
+        self.queue.put(None)
+        self.dispatcher.join()
+        self.executor.shutdown()
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server only has this from Python 3.7.
+    daemon_threads = True
+
+
+class GradingHandler(BaseHTTPRequestHandler):
+    """
+    POST /grade with a job or a list of jobs; GET /stats.
+    """
+    # set on the subclass serve() makes
+    service = None
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_error(404)
+            return
+        self._send_json(200, self.service.stats())
+
+    def do_POST(self):
+        if self.path != '/grade':
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            jobs = json.loads(self.rfile.read(length))
+            if isinstance(jobs, dict):
+                jobs = [jobs]
+            if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+                raise ValueError('Expected a job or a list of jobs')
+        except ValueError as e:
+            self._send_json(400, {'error': _error(e)})
+            return
+
+        futures = [self.service.submit(job) for job in jobs]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        for future in concurrent.futures.as_completed(futures):
+            self.wfile.write(json.dumps(future.result()).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Far too chatty at any real volume.
+        pass
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT):
+    """
+    Returns an HTTP server (not yet serving) in front of `service`.
+    Pass port=0 to pick any free port; it's in server.server_address.
+    """
+    handler = type('Handler', (GradingHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m hrmclone serve', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help="programs each worker keeps parsed")
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW,
+                        help='seconds to wait for more jobs for the same program')
+    args = parser.parse_args(argv)
+
+    service = GradingService(args.workers, cache_size=args.cache_size, batch_window=args.batch_window)
+    server = make_server(service, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f'Grading on http://{host}:{port}/grade with {service.workers} workers')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
@@ -0,0 +1,403 @@
+"""
+Tracers watch a ProgramRun while it executes.
+
+Pass one to ProgramRun.run(trace=...). When no tracer is attached the run loop
+never calls into this module at all, so an untraced run pays nothing for it.
+
+BinaryTracer records a run as a compact binary trace, which TraceReader can
+seek around in without reading it all into memory.
+"""
+import collections
+import marshal
+import mmap
+import os
+import struct
+import sys
+
+from .core import BumpUp, CopyTo, Inbox, Outbox, _Noop
+
+
+class Tracer:
+    """
+    Base class for tracers. All the hooks are no-ops, so subclasses only need
+    to override the ones they care about.
+    """
+    def start(self, run):
+        """
+        Called once, just before the first step.
+        """
+
+    def step(self, run, index, instruction):
+        """
+        Called after each instruction has executed (or failed to).
+
+        `index` is the position of `instruction` in the program. Note that
+        jumps have already updated `run.program_pointer` by the time this is called.
+        """
+
+    def error(self, run, index, instruction, exc):
+        """
+        Called when `instruction` raises a RunError (or InvalidFloorIndex, from
+        a pointer off the floor), just before it propagates.
+        """
+
+    def finish(self, run):
+        """
+        Called once when the run stops, however it stopped.
+        """
+
+
+def format_step(run, instruction):
+    return f"{instruction}:\n\tinbox={run.inbox}\n\tfloor={run.floor}\n\toutbox={run.outbox}\n"
+
+
+class StderrTracer(Tracer):
+    """
+    Dumps the inbox, floor and outbox after every step, as soon as it happens.
+    Handy for debugging a single run; far too slow for anything else.
+    """
+    def __init__(self, file=None):
+        self.file = file
+
+    def step(self, run, index, instruction):
+        (self.file or sys.stderr).write(format_step(run, instruction))
+
+
+class BufferedTracer(Tracer):
+    """
+    Produces the same dump as StderrTracer, but collects it in memory and writes
+    it out in batches of `batch_size` steps (and at the end of the run).
+    """
+    def __init__(self, file=None, batch_size=1000):
+        self.file = file
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def step(self, run, index, instruction):
+        self.buffer.append(format_step(run, instruction))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def finish(self, run):
+        self.flush()
+
+    def flush(self):
+        if self.buffer:
+            (self.file or sys.stderr).write(''.join(self.buffer))
+            self.buffer = []
+
+
+# Binary traces
+#
+# A binary trace is a header, then one fixed-width record per step, then a
+# footer written when the run finishes. Each record holds the index of the
+# instruction executed, what it did (flags), the hands after it, and an
+# operand: the tile and new value for a floor write, or the value OUTBOXed.
+#
+# Values are stored as a kind and an int64: None, a number, a letter (as
+# its code point) or, for anything else (numbers too big for an int64, and
+# strings which aren't a single character), an index into a table of extra
+# values kept in the footer.
+#
+# The header holds the state the run started in, and the footer a keyframe
+# (a full copy of the state) every so many steps, so any step can be found
+# by replaying from the keyframe before it. A trace whose run never
+# finished (the process was killed, say) has no footer, but can still be
+# replayed from the start.
+
+TRACE_MAGIC = b'HRMT'
+TRACE_FOOTER_MAGIC = b'HRMF'
+TRACE_VERSION = 2
+
+_TRACE_HEADER = struct.Struct('<4sHHI32sI')
+_TRACE_RECORD = struct.Struct('<IBBqBBq')
+_TRACE_FOOTER = struct.Struct('<Q4s')
+
+# Record flags
+INBOX_READ = 1
+OUTBOX_WRITE = 2
+FLOOR_WRITE = 4
+FAILED = 8
+COUNTED = 16
+
+_NONE, _NUMBER, _LETTER, _EXTRA = range(4)
+_INT64 = (-2 ** 63, 2 ** 63 - 1)
+
+
+TraceStep = collections.namedtuple('TraceStep', 'index flags hands tile operand')
+TraceStep.__doc__ = """
+One step of a binary trace: the index of the instruction executed, its
+flags (INBOX_READ, OUTBOX_WRITE, FLOOR_WRITE, FAILED and COUNTED), the
+hands after it, and for a floor write the tile and its new value (for an
+OUTBOX, the value sent; otherwise None).
+"""
+
+TraceState = collections.namedtuple(
+    'TraceState', 'step program_pointer runtime hands floor inbox_count outbox_count',
+)
+TraceState.__doc__ = """
+The state of a traced run after `step` steps. `inbox_count` and
+`outbox_count` are how many items had been read and written since the
+trace started. `program_pointer` is None at the end of a trace whose run
+never finished.
+"""
+
+
+class BinaryTracer(Tracer):
+    """
+    Records a run to `file` (a path, or a file opened for binary writing) as
+    a compact binary trace, which TraceReader can read back.
+
+    Each step takes TRACE_RECORD_SIZE bytes. Records are collected in memory
+    and written out `batch_size` at a time, and a keyframe is kept every
+    `keyframe_every` steps. Traces one run() call.
+    """
+    def __init__(self, file, batch_size=4096, keyframe_every=16384):
+        self.file = file
+        self.batch_size = batch_size
+        self.keyframe_every = keyframe_every
+        self.buffer = []
+        self.keyframes = []
+        self.extra = []
+        # value -> its index in self.extra
+        self._extra_index = {}
+
+    def _encode(self, value):
+        if value is None:
+            return _NONE, 0
+        if type(value) is str:
+            if len(value) == 1:
+                return _LETTER, ord(value)
+        elif _INT64[0] <= value <= _INT64[1]:
+            return _NUMBER, value
+        index = self._extra_index.get(value)
+        if index is None:
+            index = self._extra_index[value] = len(self.extra)
+            self.extra.append(value)
+        return _EXTRA, index
+
+    def start(self, run):
+        from .memo import fingerprint
+        self._own_file = isinstance(self.file, (str, os.PathLike))
+        self._out = open(self.file, 'wb') if self._own_file else self.file
+
+        self.steps = 0
+        self.runtime = run.runtime
+        self.hands = run._hands
+        self.floor = list(run._floor)
+        self.inbox_count = 0
+        self.outbox_count = run.outbox_count
+        self.inbox_at = (run._inbox_pulled, run._inbox_pos)
+        self.failed = False
+
+        initial = marshal.dumps(self._keyframe())
+        self._out.write(_TRACE_HEADER.pack(
+            TRACE_MAGIC, TRACE_VERSION, _TRACE_RECORD.size, self.keyframe_every,
+            fingerprint(run.program), len(initial),
+        ))
+        self._out.write(initial)
+
+    def _keyframe(self):
+        return (self.steps, self.runtime, self.hands, tuple(self.floor),
+                self.inbox_count, self.outbox_count)
+
+    def error(self, run, index, instruction, exc):
+        self.failed = True
+
+    def step(self, run, index, instruction):
+        flags = 0
+        tile = 0
+        operand = None
+        if self.failed:
+            flags = FAILED
+            self.failed = False
+        elif isinstance(instruction, Inbox):
+            inbox_at = (run._inbox_pulled, run._inbox_pos)
+            if inbox_at != self.inbox_at:
+                self.inbox_at = inbox_at
+                self.inbox_count += 1
+                flags = INBOX_READ | COUNTED
+        elif isinstance(instruction, Outbox):
+            operand = self.hands
+            self.outbox_count += 1
+            flags = OUTBOX_WRITE | COUNTED
+        elif isinstance(instruction, (CopyTo, BumpUp)):
+            tile = instruction.floor_index
+            if instruction.pointer:
+                tile = self.floor[tile]
+            operand = self.floor[tile] = run._floor[tile]
+            flags = FLOOR_WRITE | COUNTED
+        elif not isinstance(instruction, _Noop):
+            flags = COUNTED
+
+        if flags & COUNTED:
+            self.runtime += 1
+        self.hands = run._hands
+        self.buffer.append(_TRACE_RECORD.pack(
+            index, flags, *self._encode(self.hands), tile, *self._encode(operand),
+        ))
+        self.steps += 1
+        if self.steps % self.keyframe_every == 0:
+            self.keyframes.append(self._keyframe())
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self._out.write(b''.join(self.buffer))
+            self.buffer = []
+
+    def finish(self, run):
+        self.flush()
+        footer = marshal.dumps({
+            'keyframes': self.keyframes,
+            'extra': self.extra,
+            'final': self._keyframe(),
+            'program_pointer': run.program_pointer,
+        })
+        self._out.write(footer)
+        self._out.write(_TRACE_FOOTER.pack(len(footer), TRACE_FOOTER_MAGIC))
+        if self._own_file:
+            self._out.close()
+        else:
+            self._out.flush()
+
+
+TRACE_RECORD_SIZE = _TRACE_RECORD.size
+
+
+class TraceReader:
+    """
+    Reads a trace written by BinaryTracer from the file at `path`, which is
+    memory-mapped rather than read, so a trace can be far bigger than memory.
+
+    len(reader) is the number of steps, reader[n] the TraceStep for step n,
+    and reader.state(n) the state after n steps.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = self._map
+
+        magic, version, record_size, self.keyframe_every, self.fingerprint, initial_size = (
+            _TRACE_HEADER.unpack_from(view)
+        )
+        if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != _TRACE_RECORD.size:
+            raise ValueError(f'{path} is not a trace this version can read')
+        self._start = _TRACE_HEADER.size + initial_size
+        initial = marshal.loads(view[_TRACE_HEADER.size:self._start])
+
+        end = len(view)
+        footer = None
+        if end - self._start >= _TRACE_FOOTER.size:
+            length, magic = _TRACE_FOOTER.unpack_from(view, end - _TRACE_FOOTER.size)
+            footer_start = end - _TRACE_FOOTER.size - length
+            if (magic == TRACE_FOOTER_MAGIC and footer_start >= self._start
+                    and (footer_start - self._start) % record_size == 0):
+                footer = marshal.loads(view[footer_start:end - _TRACE_FOOTER.size])
+                end = footer_start
+        # Without a footer (the run never finished), any partly written
+        # record at the end is ignored.
+        self._count = (end - self._start) // record_size
+
+        self.finished = footer is not None
+        if footer is not None:
+            self._keyframes = [initial] + footer['keyframes']
+            self._extra = footer['extra']
+            self._final = footer['final']
+            self._final_pc = footer['program_pointer']
+        else:
+            self._keyframes = [initial]
+            self._extra = None
+            self._final = None
+            self._final_pc = None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _decode(self, kind, value):
+        if kind == _NUMBER:
+            return value
+        if kind == _LETTER:
+            return chr(value)
+        if kind == _EXTRA:
+            if self._extra is None:
+                raise ValueError("This trace never finished, so its extra values weren't saved")
+            return self._extra[value]
+        return None
+
+    def _records(self, start, stop):
+        view = memoryview(self._map)[
+            self._start + start * _TRACE_RECORD.size:self._start + stop * _TRACE_RECORD.size
+        ]
+        try:
+            yield from _TRACE_RECORD.iter_unpack(view)
+        finally:
+            view.release()
+
+    def _step(self, record):
+        index, flags, hands_kind, hands, tile, operand_kind, operand = record
+        return TraceStep(
+            index, flags, self._decode(hands_kind, hands),
+            tile if flags & FLOOR_WRITE else None, self._decode(operand_kind, operand),
+        )
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += self._count
+        if not 0 <= n < self._count:
+            raise IndexError('trace step out of range')
+        return self._step(next(self._records(n, n + 1)))
+
+    def __iter__(self):
+        for record in self._records(0, self._count):
+            yield self._step(record)
+
+    def outputs(self):
+        """
+        Yields each value OUTBOXed, in order.
+        """
+        for record in self._records(0, self._count):
+            if record[1] & OUTBOX_WRITE:
+                yield self._decode(record[5], record[6])
+
+    def state(self, n):
+        """
+        Returns the TraceState after `n` steps, replayed from the keyframe
+        before it.
+        """
+        if n < 0:
+            n += self._count
+        if not 0 <= n <= self._count:
+            raise IndexError('trace step out of range')
+        if n == self._count and self._final is not None:
+            step, runtime, hands, floor, inbox_count, outbox_count = self._final
+            return TraceState(step, self._final_pc, runtime, hands, list(floor),
+                              inbox_count, outbox_count)
+
+        keyframe = self._keyframes[min(n // self.keyframe_every, len(self._keyframes) - 1)]
+        step, runtime, hands, floor, inbox_count, outbox_count = keyframe
+        floor = list(floor)
+        for record in self._records(step, n):
+            flags = record[1]
+            if flags & COUNTED:
+                runtime += 1
+            if flags & INBOX_READ:
+                inbox_count += 1
+            elif flags & OUTBOX_WRITE:
+                outbox_count += 1
+            elif flags & FLOOR_WRITE:
+                floor[record[4]] = self._decode(record[5], record[6])
+            hands = self._decode(record[2], record[3])
+        program_pointer = self[n].index if n < self._count else None
+        return TraceState(n, program_pointer, runtime, hands, floor, inbox_count, outbox_count)
@@ -0,0 +1,399 @@
+"""
+A lockstep engine that runs one Program over many inboxes at once, using NumPy.
+
+Each inbox is a "lane". Hands, floor, inbox cursor, program pointer and
+runtime are all NumPy arrays with one entry (or row) per lane. On every step
+the live lanes are grouped by program pointer, and each group executes its
+instruction as a handful of array operations. Lanes that finish or fail drop
+out, keeping their own state, runtime and exception.
+
+Only numbers can be held in the arrays, so lanes whose inbox or floor
+contains letters are run by the scalar engines instead, as are lanes whose
+numbers grow too big for an int64 along the way.
+
+NumPy is optional; it's only needed if this engine is actually used.
+"""
+import time
+
+from . import exceptions
+from .batch import RunResult, run_case
+from .bytecode import (
+    ADD, BUMPDN, BUMPUP, COPYFROM, COPYTO, INBOX, JUMP, JUMPN, JUMPZ, NOP, OUTBOX, SUB,
+)
+from .core import FLOOR_TILES, format_value, parse_value
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Lane status codes. Anything above FINISHED is an index into ERRORS.
+RUNNING = 0
+FINISHED = 1
+ERRORS = [
+    None,
+    None,
+    exceptions.EmptyHands,
+    exceptions.EmptyFloorTile,
+    exceptions.InvalidFloorIndex,
+    exceptions.StepLimitExceeded,
+    exceptions.TimeLimitExceeded,
+    exceptions.Overflow,
+]
+EMPTY_HANDS, EMPTY_FLOOR_TILE, INVALID_FLOOR_INDEX = 2, 3, 4
+STEP_LIMIT_EXCEEDED, TIME_LIMIT_EXCEEDED = 5, 6
+# A number went outside _INT_RANGE. run_lanes() runs these lanes again with
+# a scalar engine; from run_arrays() they're left failed with Overflow.
+OUT_OF_RANGE = 7
+
+# Lanes which don't fit in an int64 go to the scalar engines. Numbers are
+# kept inside this range, so adding or subtracting two of them can't wrap.
+_INT_RANGE = (-2 ** 62, 2 ** 62)
+
+
+def _numeric(values):
+    lo, hi = _INT_RANGE
+    for v in values:
+        if v is not None and (type(v) is not int or not lo < v < hi):
+            return False
+    return True
+
+
+def _bind_floor(floor):
+    # Same as ProgramRun.__init__, without the rest of the ProgramRun.
+    if floor is None:
+        return [None] * FLOOR_TILES
+    elif isinstance(floor, dict):
+        values = [None] * FLOOR_TILES
+        for i, v in floor.items():
+            values[i] = parse_value(v)
+        return values
+    return [parse_value(v) for v in floor]
+
+
+class LaneRun:
+    """
+    The state of every lane.
+
+    `inbox` is an (N, width) array of inbox values; `inbox_len` says how many of
+    each row are actually used. `floor` and `floor_empty` are (N, FLOOR_TILES)
+    arrays, with floor_empty marking the tiles with nothing on them.
+
+    After run(), the results are left in the arrays; results() turns them
+    into RunResults, but for really big batches it's quicker to use the
+    arrays directly.
+    """
+    def __init__(self, program, inbox, inbox_len, floor, floor_empty):
+        n = len(inbox)
+        self.code = program.link().code
+        self.end = len(self.code)
+
+        self.inbox = inbox
+        self.inbox_len = inbox_len
+        self.inbox_pos = numpy.zeros(n, dtype=numpy.int64)
+        self.floor = floor
+        self.floor_empty = floor_empty
+
+        self.hands = numpy.zeros(n, dtype=numpy.int64)
+        self.hands_empty = numpy.ones(n, dtype=bool)
+        self.pc = numpy.zeros(n, dtype=numpy.int64)
+        self.runtime = numpy.zeros(n, dtype=numpy.int64)
+        self.status = numpy.zeros(n, dtype=numpy.int8)
+
+        # Every OUTBOX appends (lanes, values) here, in execution order.
+        self.outputs = []
+
+    @classmethod
+    def from_lists(cls, program, inboxes, floors):
+        """
+        Builds the arrays from a list of inboxes and a list of bound floors
+        (lists of FLOOR_TILES ints or Nones).
+        """
+        n = len(inboxes)
+        lengths = [len(inbox) for inbox in inboxes]
+        width = max(lengths, default=0)
+        inbox = numpy.zeros((n, max(width, 1)), dtype=numpy.int64)
+        for lane, values in enumerate(inboxes):
+            inbox[lane, :len(values)] = values
+
+        floor_empty = numpy.array(
+            [[v is None for v in values] for values in floors], dtype=bool,
+        ).reshape(n, FLOOR_TILES)
+        floor = numpy.array(
+            [[0 if v is None else v for v in values] for values in floors], dtype=numpy.int64,
+        ).reshape(n, FLOOR_TILES)
+        return cls(program, inbox, numpy.array(lengths, dtype=numpy.int64), floor, floor_empty)
+
+    @property
+    def errors(self):
+        """
+        The exception class each lane failed with (or None), as a list.
+        """
+        return [ERRORS[status] for status in self.status.tolist()]
+
+    def fail(self, lanes, mask, code):
+        """
+        Marks the lanes in lanes[mask] as failed with `code`, and returns the
+        rest of the lanes.
+        """
+        if mask.any():
+            self.status[lanes[mask]] = code
+            return lanes[~mask]
+        return lanes
+
+    def resolve(self, lanes, arg, indirect):
+        """
+        Works out the floor index for each lane. Returns (lanes, indices) for
+        the lanes which didn't fail doing so.
+        """
+        if not indirect:
+            return lanes, arg
+        lanes = self.fail(lanes, self.floor_empty[lanes, arg], EMPTY_FLOOR_TILE)
+        index = self.floor[lanes, arg]
+        bad = (index < 0) | (index >= FLOOR_TILES)
+        if bad.any():
+            lanes = self.fail(lanes, bad, INVALID_FLOOR_INDEX)
+            index = index[~bad]
+        return lanes, index
+
+    def check_range(self, lanes, values):
+        """
+        Fails the lanes whose new value has gone outside _INT_RANGE, and
+        returns the rest of the lanes and their values.
+        """
+        lo, hi = _INT_RANGE
+        bad = (values <= lo) | (values >= hi)
+        if bad.any():
+            lanes = self.fail(lanes, bad, OUT_OF_RANGE)
+            values = values[~bad]
+        return lanes, values
+
+    def step(self, lanes, op, arg, indirect):
+        """
+        Executes one instruction for `lanes`, which are all at the same pointer.
+        """
+        if op == NOP:
+            self.pc[lanes] += 1
+            return
+
+        if op == JUMP:
+            self.pc[lanes] = arg
+            self.runtime[lanes] += 1
+            return
+
+        if op == INBOX:
+            dry = self.inbox_pos[lanes] >= self.inbox_len[lanes]
+            lanes = self.fail(lanes, dry, FINISHED)
+            pos = self.inbox_pos[lanes]
+            self.hands[lanes] = self.inbox[lanes, pos]
+            self.hands_empty[lanes] = False
+            self.inbox_pos[lanes] = pos + 1
+        elif op == OUTBOX:
+            lanes = self.fail(lanes, self.hands_empty[lanes], EMPTY_HANDS)
+            self.outputs.append((lanes, self.hands[lanes]))
+            self.hands_empty[lanes] = True
+        elif op == JUMPZ or op == JUMPN:
+            lanes = self.fail(lanes, self.hands_empty[lanes], EMPTY_HANDS)
+            hands = self.hands[lanes]
+            taken = hands == 0 if op == JUMPZ else hands < 0
+            self.pc[lanes] = numpy.where(taken, arg, self.pc[lanes] + 1)
+            self.runtime[lanes] += 1
+            return
+        elif op == COPYFROM:
+            self.hands_empty[lanes] = True
+            lanes, index = self.resolve(lanes, arg, indirect)
+            lanes = self.fail(lanes, self.floor_empty[lanes, index], EMPTY_FLOOR_TILE)
+            if indirect:
+                index = self.floor[lanes, arg]
+            self.hands[lanes] = self.floor[lanes, index]
+            self.hands_empty[lanes] = False
+        elif op == COPYTO:
+            lanes = self.fail(lanes, self.hands_empty[lanes], EMPTY_HANDS)
+            lanes, index = self.resolve(lanes, arg, indirect)
+            self.floor[lanes, index] = self.hands[lanes]
+            self.floor_empty[lanes, index] = False
+        elif op == ADD or op == SUB:
+            lanes = self.fail(lanes, self.hands_empty[lanes], EMPTY_HANDS)
+            lanes, index = self.resolve(lanes, arg, indirect)
+            empty = self.floor_empty[lanes, index]
+            if empty.any():
+                lanes = self.fail(lanes, empty, EMPTY_FLOOR_TILE)
+                if indirect:
+                    index = self.floor[lanes, arg]
+            if op == ADD:
+                values = self.hands[lanes] + self.floor[lanes, index]
+            else:
+                values = self.hands[lanes] - self.floor[lanes, index]
+            lanes, values = self.check_range(lanes, values)
+            self.hands[lanes] = values
+        elif op == BUMPUP or op == BUMPDN:
+            lanes, index = self.resolve(lanes, arg, indirect)
+            empty = self.floor_empty[lanes, index]
+            if empty.any():
+                lanes = self.fail(lanes, empty, EMPTY_FLOOR_TILE)
+                if indirect:
+                    index = self.floor[lanes, arg]
+            values = self.floor[lanes, index] + (1 if op == BUMPUP else -1)
+            lanes, values = self.check_range(lanes, values)
+            if indirect:
+                index = self.floor[lanes, arg]
+            self.floor[lanes, index] = values
+            self.hands[lanes] = values
+            self.hands_empty[lanes] = False
+        else:
+            raise AssertionError(f'unknown opcode {op}')
+
+        self.pc[lanes] += 1
+        self.runtime[lanes] += 1
+
+    def run(self, max_steps=None, timeout=None):
+        """
+        Runs every lane until it finishes or fails.
+
+        Lanes which go over `max_steps` fail with StepLimitExceeded, checked
+        just after they jump backwards, as with the other engines. Once
+        `timeout` seconds have passed, all the lanes still running fail with
+        TimeLimitExceeded; that's checked once per lockstep step.
+        """
+        code = self.code
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            live = numpy.flatnonzero(self.status == RUNNING)
+            if not len(live):
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                self.status[live] = TIME_LIMIT_EXCEEDED
+                break
+            pcs = self.pc[live]
+            done = pcs >= self.end
+            if done.any():
+                self.status[live[done]] = FINISHED
+                live = live[~done]
+                pcs = pcs[~done]
+            for pc in numpy.unique(pcs):
+                op, arg, indirect = code[pc]
+                lanes = live[pcs == pc]
+                self.step(lanes, op, arg, indirect)
+                if max_steps is not None and op in (JUMP, JUMPZ, JUMPN) and arg <= pc:
+                    jumped = lanes[(self.pc[lanes] == arg) & (self.status[lanes] == RUNNING)]
+                    self.fail(jumped, self.runtime[jumped] > max_steps, STEP_LIMIT_EXCEEDED)
+
+    def outboxes(self):
+        """
+        Returns each lane's outbox, as a list of lists of ints.
+        """
+        n = len(self.status)
+        if not self.outputs:
+            return [[] for _ in range(n)]
+        lanes = numpy.concatenate([lanes for lanes, values in self.outputs])
+        values = numpy.concatenate([values for lanes, values in self.outputs])
+        # A stable sort by lane keeps each lane's items in the order they were made.
+        order = numpy.argsort(lanes, kind='stable')
+        lanes, values = lanes[order], values[order].tolist()
+        bounds = numpy.searchsorted(lanes, numpy.arange(n + 1)).tolist()
+        return [values[bounds[i]:bounds[i + 1]] for i in range(n)]
+
+    def results(self, indexes, typed):
+        """
+        Returns a RunResult for each lane. `indexes` gives their RunResult.index.
+        """
+        outboxes = self.outboxes()
+        floors = self.floor.tolist()
+        floor_empty = self.floor_empty.tolist()
+        hands = self.hands.tolist()
+        hands_empty = self.hands_empty.tolist()
+        runtimes = self.runtime.tolist()
+        statuses = self.status.tolist()
+        results = []
+        for lane, index in enumerate(indexes):
+            outbox = outboxes[lane]
+            floor = [None if e else v for v, e in zip(floors[lane], floor_empty[lane])]
+            hand = None if hands_empty[lane] else hands[lane]
+            if not typed:
+                outbox = [str(v) for v in outbox]
+                floor = [format_value(v) for v in floor]
+                hand = format_value(hand)
+            status = statuses[lane]
+            error = ERRORS[status]() if status > FINISHED else None
+            results.append(RunResult(index, outbox, floor, hand, runtimes[lane], error))
+        return results
+
+
+def run_lanes(program, cases, *, engine='compiled', typed=False,
+              max_steps=None, timeout=None, detect_loops=False,
+              max_outbox=None, max_value=None, deadline=None, max_memory=None):
+    """
+    Runs `program` for each (index, inbox, floor) in `cases`, and returns a
+    list of RunResults in the same order.
+
+    Cases with letters in them are run one at a time with `engine` instead.
+
+    `max_steps` and `timeout` work as for ProgramRun.run(), but lockstep runs
+    can't detect infinite loops, so detect_loops=True is an error, and
+    neither can they be sandboxed.
+    """
+    if numpy is None:
+        raise ImportError("The 'vector' engine needs NumPy installed")
+    if detect_loops:
+        raise ValueError("The 'vector' engine can't detect infinite loops; use max_steps")
+    if (max_outbox, max_value, deadline, max_memory) != (None,) * 4:
+        raise ValueError("The 'vector' engine doesn't support sandbox limits")
+    limits = dict(max_steps=max_steps, timeout=timeout)
+
+    results = [None] * len(cases)
+    lane_cases = []
+    lane_inboxes = []
+    lane_floors = []
+    for position, (index, inbox, floor) in enumerate(cases):
+        inbox = [parse_value(v) for v in inbox]
+        floor = _bind_floor(floor)
+        if _numeric(inbox) and _numeric(floor):
+            lane_cases.append((position, index))
+            lane_inboxes.append(inbox)
+            lane_floors.append(floor)
+        else:
+            results[position] = run_case(program, index, inbox, floor, engine, typed, limits)
+
+    if lane_cases:
+        lanes = LaneRun.from_lists(program, lane_inboxes, lane_floors)
+        lanes.run(**limits)
+        lane_results = lanes.results([index for position, index in lane_cases], typed)
+        statuses = lanes.status.tolist()
+        for lane, ((position, index), result) in enumerate(zip(lane_cases, lane_results)):
+            if statuses[lane] == OUT_OF_RANGE:
+                result = run_case(
+                    program, index, lane_inboxes[lane], lane_floors[lane], engine, typed, limits,
+                )
+            results[position] = result
+    return results
+
+
+def run_arrays(program, inbox, inbox_len=None, floor=None, floor_empty=None, *,
+               max_steps=None, timeout=None):
+    """
+    Runs `program` over each row of the (N, width) integer array `inbox`, and
+    returns the finished LaneRun.
+
+    `inbox_len` gives the number of values used in each row (by default, all of
+    them). `floor` is a single floor shared by every lane, as accepted by
+    Program.bind(), or an (N, FLOOR_TILES) array with a matching `floor_empty`.
+    """
+    if numpy is None:
+        raise ImportError("The 'vector' engine needs NumPy installed")
+    inbox = numpy.asarray(inbox, dtype=numpy.int64)
+    n = len(inbox)
+    if inbox_len is None:
+        inbox_len = numpy.full(n, inbox.shape[1], dtype=numpy.int64)
+    if floor_empty is None:
+        values = _bind_floor(floor)
+        if not _numeric(values):
+            raise ValueError("The 'vector' engine only works with numbers")
+        floor_empty = numpy.tile(numpy.array([v is None for v in values]), (n, 1))
+        floor = numpy.tile(numpy.array([v or 0 for v in values], dtype=numpy.int64), (n, 1))
+    lanes = LaneRun(
+        program, inbox, numpy.asarray(inbox_len, dtype=numpy.int64),
+        numpy.array(floor, dtype=numpy.int64), numpy.array(floor_empty, dtype=bool),
+    )
+    lanes.run(max_steps=max_steps, timeout=timeout)
+    return lanes
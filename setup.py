@@ -22,4 +22,8 @@ setup(
     packages=[
         "hrmclone",
     ],
+
+    extras_require={
+        "vector": ["numpy"],
+    },
 )
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from hrmclone.aio import run_async
+from hrmclone.core import Program
+from hrmclone import exceptions
+from tests.testengines import COUNTDOWN, ENGINES
+
+
+def run_until_complete(coroutine):
+    # run_until_complete() is only in Python 3.7 and up.
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def numbers(values):
+    for value in values:
+        await asyncio.sleep(0)
+        yield value
+
+
+@pytest.mark.parametrize('engine', ['object'] + ENGINES)
+def test_run_async(engine):
+    program = Program(COUNTDOWN)
+    received = []
+
+    async def sink(value):
+        received.append(value)
+
+    run = program.bind()
+    run_until_complete(run_async(run, numbers(['3', '-2', '0']), sink, engine=engine, quantum=5))
+    expected = program.run(inbox=['3', '-2', '0'])
+    assert received == expected.outbox
+    assert run.runtime == expected.runtime
+    assert run.waiting
+
+
+def test_plain_inbox_and_outbox():
+    run = Program('a:\nINBOX\nOUTBOX\nJUMP a').bind()
+    run_until_complete(run_async(run, 'abc'))
+    assert run.outbox == ['a', 'b', 'c']
+
+
+def test_busy_loop_does_not_starve_others():
+    spinner = Program('COPYFROM 0\na:\nBUMPUP 0\nJUMP a').bind(floor={0: '0'})
+    echo = Program(COUNTDOWN).bind()
+    finished = []
+
+    async def main():
+        async def spin():
+            with pytest.raises(exceptions.StepLimitExceeded):
+                await run_async(spinner, [], quantum=100, max_steps=200000)
+            finished.append('spinner')
+
+        async def count():
+            await run_async(echo, numbers(['5', '5', '5']), quantum=100)
+            finished.append('echo')
+
+        await asyncio.gather(spin(), count())
+
+    run_until_complete(main())
+    assert finished == ['echo', 'spinner']
+    assert spinner.runtime <= 200100
+
+
+def test_backpressure():
+    run = Program('COPYFROM 0\na:\nOUTBOX\nBUMPUP 0\nJUMP a').bind(floor={0: '0'})
+
+    async def main():
+        queue = asyncio.Queue(maxsize=2)
+        task = asyncio.ensure_future(run_async(run, [], queue.put, quantum=50))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        # The producer is stuck behind the full queue, not racing ahead.
+        assert run.outbox_count <= 100
+        assert [await queue.get() for _ in range(3)] == ['0', '1', '2']
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    run_until_complete(main())
+
+
+def test_outputs_delivered_before_error():
+    received = []
+    run = Program('INBOX\nOUTBOX\nOUTBOX').bind()
+    with pytest.raises(exceptions.EmptyHands):
+        run_until_complete(run_async(run, numbers('A'), received.append))
+    assert received == ['A']
+
+
+def test_buffer():
+    run = Program('COPYFROM 0\na:\nOUTBOX\nBUMPUP 0\nJUMP a').bind(floor={0: '0'})
+    waiting = []
+
+    async def sink(value):
+        waiting.append(run.outbox_count - len(waiting))
+        if len(waiting) == 100:
+            raise ValueError
+
+    # The quantum alone would let thousands of outputs pile up.
+    with pytest.raises(ValueError):
+        run_until_complete(run_async(run, [], sink, quantum=100000, buffer=10))
+    assert max(waiting) <= 10
+
+
+def test_sink_restored():
+    received = []
+    run = Program('a:\nINBOX\nOUTBOX\nJUMP a').bind()
+    run_until_complete(run_async(run, 'ab', received.append))
+    assert received == ['a', 'b']
+    assert run.sink is None
+    run.feed(['c'])
+    run.run()
+    assert run.outbox == ['c']
+    assert received == ['a', 'b']
@@ -0,0 +1,112 @@
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+from hrmclone.analysis import analyse, number, signature
+
+
+COUNTDOWN = '''
+    -- HUMAN RESOURCE MACHINE PROGRAM --
+    a:
+        INBOX
+        COPYTO   0
+        JUMP     c
+    b:
+        BUMPUP   0
+    c:
+    d:
+        OUTBOX
+        COPYFROM 0
+        JUMPZ    a
+        JUMPN    b
+        BUMPDN   0
+        JUMP     d
+'''
+
+
+def test_proves_checks_safe():
+    analysis = analyse(Program(COUNTDOWN))
+
+    assert analysis.unreachable == []
+    assert analysis.unused_tiles == list(range(1, 20))
+    # COPYTO 0 always has something in hands, and BUMPUP 0 is only reached
+    # after JUMPN has seen that tile 0 is a negative number
+    assert analysis.needed(1) == []
+    assert analysis.needed(3) == []
+    assert analysis.needed(4) == []
+    # but the inbox could hold a letter, so these have to check
+    assert analysis.needed(7) == ['numbers']
+    assert analysis.needed(8) == ['numbers']
+    assert analysis.states[3][1][0] == number(high=-1)
+
+
+def test_unreachable_code():
+    program = Program('''
+        -- HUMAN RESOURCE MACHINE PROGRAM --
+        a:
+            INBOX
+            OUTBOX
+            JUMP     a
+            COPYFROM 3
+            OUTBOX
+    ''')
+    analysis = analyse(program)
+    assert analysis.graph == [[1], [2], [0], [4], [5]]
+    assert analysis.unreachable == [3, 4]
+    assert analysis.report().split('\n')[3].endswith('unreachable')
+
+
+def test_floor_values():
+    program = Program('''
+        -- HUMAN RESOURCE MACHINE PROGRAM --
+            COPYFROM [5]
+            OUTBOX
+            COPYFROM 6
+            OUTBOX
+    ''')
+    analysis = analyse(program)
+    # with nothing on the floor, the first COPYFROM always fails
+    assert analysis.reachable == {0}
+    assert analysis.needed(0) == ['tile', 'pointer']
+
+    analysis = analyse(program, [None, 'A', None, None, None, 1, 'B'])
+    assert analysis.needed(0) == []
+    assert analysis.needed(2) == []
+    assert analysis.unused_tiles == [0, 2, 3, 4]
+
+
+@pytest.mark.parametrize('floor', [{5: 1, 6: 'B'}, {5: 'X'}, {6: 2}, {}])
+def test_compiled_specialisation(floor):
+    program = Program('''
+        -- HUMAN RESOURCE MACHINE PROGRAM --
+        a:
+            INBOX
+            COPYTO   [5]
+            BUMPUP   5
+            ADD      6
+            OUTBOX
+            JUMP     a
+    ''')
+    results = []
+    for engine in ('bytecode', 'compiled'):
+        run = program.bind(inbox=['1', '2'], floor=floor, typed=True)
+        try:
+            run.run(engine=engine)
+            error = None
+        except exceptions.RunError as e:
+            error = type(e)
+        results.append((error, run.outbox, run.floor, run.runtime, run.program_pointer))
+    assert results[0] == results[1]
+
+
+def test_compile_signature():
+    program = Program(COUNTDOWN)
+    run = program.bind(inbox=['3'], typed=True)
+    run.run(engine='compiled')
+
+    key = signature(None, [None] * 20)
+    specialised = program.compile(key)
+    assert program.compile(key) is specialised
+    assert specialised is not program.compile()
+    # the check on COPYTO 0 was proven unnecessary
+    assert specialised.source.count('raise EmptyHands') < program.compile().source.count('raise EmptyHands')
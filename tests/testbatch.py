@@ -0,0 +1,89 @@
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+from hrmclone.batch import worker_state
+
+
+PROGRAM = '''
+    a:
+        INBOX
+        COPYTO   0
+        INBOX
+        ADD      0
+        OUTBOX
+        JUMP     a
+'''
+
+
+def expected(inbox):
+    return Program(PROGRAM).run(inbox=inbox)
+
+
+INBOXES = [
+    ['1', '2'],
+    ['3', '4', '5', '6'],
+    ['A', '1'],
+    [],
+] * 5
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_run_many(workers):
+    program = Program(PROGRAM)
+    results = list(program.run_many(INBOXES, workers=workers, chunksize=3))
+    assert [r.index for r in results] == list(range(len(INBOXES)))
+
+    for inbox, result in zip(INBOXES, results):
+        if 'A' in inbox:
+            assert isinstance(result.error, exceptions.MathDomainError)
+            assert not result.ok
+            assert result.runtime == 3
+        else:
+            run = expected(inbox)
+            assert result.ok
+            assert result.outbox == run.outbox
+            assert result.floor == run.floor
+            assert result.runtime == run.runtime
+
+
+def test_run_many_unordered():
+    program = Program(PROGRAM)
+    results = list(program.run_many(INBOXES, workers=2, chunksize=2, ordered=False))
+    assert sorted(r.index for r in results) == list(range(len(INBOXES)))
+
+
+def test_run_many_floors():
+    program = Program('COPYFROM 0\nOUTBOX')
+    results = list(program.run_many(
+        [[], [], []], floors=[{0: 'A'}, None, {0: 7}], workers=0, typed=True,
+    ))
+    assert results[0].outbox == ['A']
+    assert isinstance(results[1].error, exceptions.EmptyFloorTile)
+    assert results[2].outbox == [7]
+
+
+def test_run_many_limits():
+    program = Program('''
+        a:
+            INBOX
+            JUMPZ    a
+        b:
+            JUMP     b
+    ''')
+    results = list(program.run_many([['0', '0'], ['0', '1']], workers=0, max_steps=100))
+    assert results[0].ok
+    assert isinstance(results[1].error, exceptions.StepLimitExceeded)
+
+
+def test_worker_state():
+    made = []
+
+    def make(value):
+        made.append(value)
+        return [value]
+
+    first = worker_state(('test', 1), make, 'a')
+    assert worker_state(('test', 1), make, 'b') is first == ['a']
+    assert worker_state(('test', 2), make, 'c') == ['c']
+    assert made == ['a', 'c']
@@ -0,0 +1,37 @@
+import json
+
+from hrmclone import benchmark
+
+
+def test_benchmark_and_compare(tmp_path):
+    results = benchmark.run_benchmarks(
+        levels=['level_19_countdown'], engines=['object', 'compiled'],
+        size=50, runs=5, repeat=1,
+    )
+    level = results['levels']['level_19_countdown']
+    assert set(level['engines']) == {'object', 'compiled'}
+    # both engines ran the same program on the same inbox
+    assert level['engines']['object']['steps'] == level['engines']['compiled']['steps'] > 0
+    assert benchmark.compare(results, results) == []
+
+    slower = json.loads(json.dumps(results))
+    slower['levels']['level_19_countdown']['engines']['compiled']['run_seconds'] *= 2
+    regressions = benchmark.compare(results, slower)
+    assert [r[:3] for r in regressions] == [('level_19_countdown', 'compiled', 'run_seconds')]
+
+
+def test_main_saves_json(tmp_path, capsys):
+    output = tmp_path / 'results.json'
+    args = ['--levels', 'level_2_mail_room', '--engines', 'bytecode',
+            '--size', '20', '--runs', '3', '--repeat', '1']
+    assert benchmark.main(args + ['--output', str(output)]) == 0
+    saved = json.loads(output.read_text())
+    assert list(saved['levels']) == ['level_2_mail_room']
+    assert benchmark.main(['compare', str(output), str(output)]) == 0
+    assert 'No regressions.' in capsys.readouterr().out
+
+
+def test_bench_memory():
+    results = benchmark.bench_memory(levels=['level_2_mail_room'], count=200)
+    level = results['levels']['level_2_mail_room']
+    assert 0 < level['packed'] < level['compact'] < level['waiting']
@@ -0,0 +1,60 @@
+import pytest
+
+from hrmclone.cache import ProgramCache, source_key
+from hrmclone.core import Program
+from hrmclone import exceptions
+
+
+SOURCE = '''
+    -- HUMAN RESOURCE MACHINE PROGRAM --
+    a:
+        INBOX
+        OUTBOX
+        JUMP     a
+'''
+
+
+def test_source_key_ignores_layout():
+    assert source_key(SOURCE) == source_key(SOURCE.replace('PROGRAM --', 'SOLUTION --  '))
+    assert source_key(SOURCE) != source_key(SOURCE.replace('OUTBOX', 'COPYFROM 0'))
+    # Anything which moves the instructions changes their positions
+    assert source_key(SOURCE) != source_key('a:\nINBOX\nOUTBOX\nJUMP     a')
+    assert source_key(SOURCE) != source_key(SOURCE.replace('    a:', '\n    a:'))
+
+
+def test_positions():
+    cache = ProgramCache()
+    Program.from_source(SOURCE, cache=cache)
+    moved = '-- another comment --\n' + SOURCE
+    assert Program.from_source(moved, cache=cache).positions == Program(moved).positions
+
+
+def test_memory_cache():
+    cache = ProgramCache(maxsize=2)
+    program = Program.from_source(SOURCE, cache=cache)
+    assert Program.from_source(SOURCE, cache=cache) is program
+    assert cache.stats() == {'size': 1, 'hits': 1, 'disk_hits': 0, 'misses': 1}
+
+    Program.from_source('INBOX', cache=cache)
+    Program.from_source('OUTBOX', cache=cache)
+    assert len(cache) == 2
+    # least recently used was dropped
+    assert Program.from_source(SOURCE, cache=cache) is not program
+
+
+def test_parse_errors_not_cached():
+    cache = ProgramCache()
+    for i in range(2):
+        with pytest.raises(exceptions.NoSuchInstruction):
+            Program.from_source('FROGS', cache=cache)
+    assert len(cache) == 0
+
+
+def test_disk_cache(tmp_path):
+    Program.from_source(SOURCE, cache=ProgramCache(directory=tmp_path))
+
+    cache = ProgramCache(directory=tmp_path)
+    program = Program.from_source(SOURCE, cache=cache)
+    assert cache.stats()['disk_hits'] == 1
+    assert cache.stats()['misses'] == 0
+    assert program.run(inbox='ABC', engine='compiled').outbox == ['A', 'B', 'C']
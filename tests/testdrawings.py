@@ -0,0 +1,93 @@
+import mmap
+
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import drawings
+from hrmclone.drawings import DrawingSpan
+
+
+STROKES = [[(100, 200), (300, 400), (500, 200)], [(1000, 1000)]]
+
+
+def source(blob):
+    lines = '\n'.join('    ' + blob[i:i + 20] for i in range(0, len(blob), 20))
+    return f'''-- HUMAN RESOURCE MACHINE PROGRAM --
+
+    INBOX
+    COMMENT  0
+    OUTBOX
+
+
+DEFINE COMMENT 0
+{lines};
+
+DEFINE LABEL 3
+{lines};
+'''
+
+
+def test_decode():
+    blob = drawings.encode(STROKES)
+    drawing = drawings.decode(blob)
+    assert list(drawing.strokes) == [0, 3, 4]
+    assert drawing.lines() == STROKES
+    assert drawings.decode(blob) is drawing
+
+    with pytest.raises(ValueError):
+        drawings.decode('not a drawing')
+
+
+def test_keep():
+    blob = drawings.encode(STROKES)
+    program = Program(source(blob))
+    assert program.comment_data == {0: blob}
+    assert program.label_data == {3: blob}
+    assert program.drawing(3, label=True).lines() == STROKES
+
+
+@pytest.mark.parametrize('kind', [str, bytes, mmap.mmap])
+def test_offsets(kind, tmp_path):
+    blob = drawings.encode(STROKES)
+    text = source(blob)
+    if kind is str:
+        program = Program(text, drawings='offsets')
+        original = text
+    else:
+        path = tmp_path / 'program.asm'
+        path.write_text(text.replace('\n', '\r\n'))
+        program = Program.from_file(path, drawings='offsets')
+        original = path.read_bytes()
+        if kind is mmap.mmap:
+            f = open(path, 'rb')
+            original = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    span = program.comment_data[0]
+    assert isinstance(span, DrawingSpan)
+    assert drawings.read(original, span) == blob
+    assert program.drawing(0, source=original).lines() == STROKES
+    with pytest.raises(ValueError):
+        program.drawing(0)
+    assert program.run(inbox='x').outbox == ['x']
+
+
+def test_skip():
+    program = Program(source(drawings.encode(STROKES)), drawings='skip')
+    assert program.comment_data == {0: None}
+    assert program.label_data == {3: None}
+    assert program.run(inbox='x').outbox == ['x']
+    with pytest.raises(ValueError):
+        program.drawing(0)
+
+    with pytest.raises(ValueError):
+        Program('INBOX', drawings='sometimes')
+
+
+def test_iter_programs(tmp_path):
+    from hrmclone.parser import iter_programs
+
+    (tmp_path / 'program.asm').write_text(source(drawings.encode(STROKES)))
+    [(path, program)] = iter_programs(str(tmp_path), drawings='skip')
+    assert program.comment_data == {0: None}
+    [(path, program)] = iter_programs(str(tmp_path))
+    assert program.drawing(0).lines() == STROKES
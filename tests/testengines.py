@@ -0,0 +1,271 @@
+"""
+Checks that every execution engine behaves exactly like the object engine:
+same outbox, floor, hands, runtime and program pointer, and the same
+exception when things go wrong.
+"""
+import io
+
+import pytest
+
+from hrmclone.core import Program, get_engine
+from hrmclone import exceptions
+
+
+ENGINES = ['bytecode', 'peephole', 'compiled', 'accelerated']
+
+COUNTDOWN = '''
+    a:
+        INBOX
+        COPYTO   0
+        JUMP     c
+    b:
+        BUMPUP   0
+    c:
+    d:
+        OUTBOX
+        COPYFROM 0
+        JUMPZ    a
+        JUMPN    b
+        BUMPDN   0
+        JUMP     d
+'''
+
+MAXIMIZATION = '''
+        JUMP     c
+    a:
+        COPYFROM 0
+    b:
+        OUTBOX
+    c:
+        INBOX
+        COPYTO   0
+        INBOX
+        SUB      0
+        JUMPN    a
+        ADD      0
+        JUMP     b
+'''
+
+DUPLICATE_REMOVAL = '''
+        INBOX
+        COPYTO   [14]
+    a:
+        COPYFROM [14]
+        OUTBOX
+        BUMPUP   14
+    b:
+        INBOX
+        COPYTO   [14]
+        COPYFROM 14
+        COPYTO   13
+    c:
+        BUMPDN   13
+        JUMPN    a
+        COPYFROM [13]
+        SUB      [14]
+        JUMPZ    b
+        JUMP     c
+'''
+
+CASES = [
+    ('INBOX\nOUTBOX\nINBOX\nOUTBOX', 'ABCDEF', None),
+    ('INBOX\nOUTBOX\nOUTBOX', 'AB', None),
+    ('JUMP a\nINBOX\nOUTBOX\na:', 'DAWG', None),
+    ('a:\nINBOX\nCOPYTO 0\nINBOX\nOUTBOX\nCOPYFROM 0\nOUTBOX\nJUMP a', 'badcfe', None),
+    ('COPYFROM 4\nOUTBOX\nCOPYFROM 0\nOUTBOX', '', {4: 'A', 0: 'B'}),
+    ('COPYTO 0', '', None),
+    ('ADD 1', '', None),
+    ('COPYFROM 0\nADD 1', '', {0: '5', 1: '-3'}),
+    ('COPYFROM 0\nADD 1', '', {0: 'A', 1: '3'}),
+    ('COPYFROM 0\nADD 1', '', {0: '0'}),
+    ('COPYFROM 0\nSUB 1', '', {0: '1', 1: '-3'}),
+    ('COPYFROM 0\nSUB 1', '', {0: 'A', 1: '1'}),
+    ('COPYFROM 0\nSUB 1', '', {0: 'A', 1: 'B'}),
+    ('COPYFROM 0\nSUB 1', '', {0: 'B', 1: 'A'}),
+    ('JUMPZ a\na:', '', None),
+    ('a:\nb:\nINBOX\nJUMPZ b\nOUTBOX\nJUMP a', '0abc08000A00', None),
+    ('a:\nINBOX\nJUMPN b\nJUMP a\nb:\nOUTBOX\nJUMP a', ['3', '-1', 'A', '-0', '-7'], None),
+    ('COPYFROM [0]', '', {0: '8', 8: 'A'}),
+    ('COPYFROM [0]', '', None),
+    ('COPYFROM [0]', '', {0: 'A'}),
+    ('COPYFROM [0]', '', {0: '25'}),
+    ('COPYTO [1]', 'A', {1: '-1'}),
+    ('INBOX\nCOPYTO [1]\nBUMPUP [1]', ['4'], {1: '2'}),
+    ('BUMPDN 3', '', {3: 'A'}),
+    ('COMMENT 0\nDEFINE COMMENT 0\nabc;\nINBOX\nOUTBOX', 'xy', None),
+    (COUNTDOWN, ['8', '2', '0', '-3'], None),
+    (MAXIMIZATION, ['1', '2', '-4', '-4', '9', '-3', '5', '0'], None),
+    (DUPLICATE_REMOVAL, ['5', '5', '3'], {14: '0'}),
+    (DUPLICATE_REMOVAL, ['A', 'B', 'A'], {14: '0'}),
+    # jump chains, and errors in the second half of a fused pair
+    ('JUMP a\nb:\nJUMP c\na:\nCOMMENT 0\nJUMP b\nc:\nINBOX\nOUTBOX\nDEFINE COMMENT 0\nabc;', 'A', None),
+    ('a:\nINBOX\nJUMPZ b\nOUTBOX\nb:\nJUMP a', '1020', None),
+    ('INBOX\nCOPYTO [1]', 'A', {1: 'B'}),
+    ('INBOX\nCOPYTO 2\nOUTBOX\nJUMPN a\na:', 'A', None),
+    ('BUMPDN 0\nJUMPN a\nOUTBOX\na:\nOUTBOX', '', {0: '0'}),
+]
+
+
+def outcome(program, inbox, floor, engine):
+    run = program.bind(inbox=inbox, floor=floor)
+    try:
+        run.run(engine=engine)
+    except (exceptions.RunError, exceptions.InvalidFloorIndex) as e:
+        # (a pointer to a bad floor tile is an InvalidFloorIndex, even at runtime)
+        error = type(e)
+    else:
+        error = None
+    return (
+        error, run.outbox, run.floor, run.hands,
+        run.runtime, run.program_pointer, run.inbox,
+    )
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('source, inbox, floor', CASES)
+def test_engine_matches_object_engine(engine, source, inbox, floor):
+    program = Program(source)
+    expected = outcome(program, inbox, floor, 'object')
+    assert outcome(program, inbox, floor, engine) == expected
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_engine_resets_runtime(engine):
+    run = Program('INBOX\nOUTBOX').bind(inbox='AB')
+    run.run(engine=engine)
+    assert run.runtime == 2
+    assert run.outbox == ['A']
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        Program('INBOX').run(engine='frogs')
+
+
+def test_link():
+    program = Program(COUNTDOWN)
+    linked = program.link()
+    assert program.link() is linked
+    assert len(linked) == len(program.instructions)
+    assert linked.dump().split('\n')[:3] == [
+        '   0 INBOX',
+        '   1 COPYTO 0',
+        '   2 JUMP 4',
+    ]
+
+
+def test_compile():
+    program = Program(COUNTDOWN)
+    compiled = program.compile()
+    assert program.compile() is compiled
+    assert compiled.leaders == {0, 3, 4, 7, 8}
+    assert 'def run_compiled(run, guard):' in compiled.source
+
+
+def test_compiled_resumes_mid_block():
+    program = Program('INBOX\nOUTBOX\nOUTBOX')
+    run = program.bind(inbox='AB')
+    with pytest.raises(exceptions.EmptyHands):
+        run.run(engine='compiled')
+    assert run.program_pointer == 2
+
+    # Not a block leader, so this goes via the bytecode engine.
+    run.hands = 'C'
+    run.run(engine='compiled')
+    assert run.outbox == ['A', 'C']
+    # runtime carries on from the first run() call
+    assert run.runtime == 3
+
+
+@pytest.mark.parametrize('engine', ['object'] + ENGINES)
+def test_streamed_inbox_and_sink(engine):
+    program = Program(COUNTDOWN)
+    pulled = []
+
+    def numbers():
+        for n in ['3', '-2', '1']:
+            pulled.append(n)
+            yield n
+
+    received = []
+    run = program.bind(inbox=numbers(), sink=received.append)
+    run.run(engine=engine)
+    assert received == ['3', '2', '1', '0', '-2', '-1', '0', '1', '0']
+    assert run.outbox == []
+    assert run.inbox == []
+    assert pulled == ['3', '-2', '1']
+    assert run.runtime == program.run(inbox=['3', '-2', '1']).runtime
+
+
+@pytest.mark.parametrize('engine', ['object'] + ENGINES)
+def test_streamed_inbox_is_read_lazily(engine):
+    program = Program('INBOX\nOUTBOX\nINBOX\nOUTBOX')
+    source = io.StringIO('A\nB\nC\nD\n')
+    run = program.bind(inbox=source, typed=True)
+    run.run(engine=engine)
+    assert run.outbox == ['A', 'B']
+    # Only what the program asked for was read
+    assert source.readline() == 'C\n'
+
+
+def test_peephole_fuses_and_threads():
+    program = Program('''
+        a:
+            INBOX
+            COPYTO   0
+            JUMP     c
+        b:
+            JUMP     a
+        c:
+            COPYFROM 0
+            OUTBOX
+            JUMP     b
+    ''')
+    assert program.optimize().dump() == '\n'.join([
+        '   0 INBOX; COPYTO 0',
+        '   1 COPYTO 0; JUMP 4',
+        '   2 JUMP 4',
+        '   3 JUMP 0',
+        '   4 COPYFROM 0; OUTBOX',
+        '   5 OUTBOX; JUMP 3',
+        # Backward to a JUMP: the guard is called on the way through.
+        '   6 JUMP 3',
+    ])
+    run = program.bind(inbox='xyz').run(engine='peephole')
+    assert run.outbox == list('xyz')
+    assert run.runtime == program.bind(inbox='xyz').run().runtime
+
+
+def test_peephole_endless_jumps():
+    program = Program('a:\nJUMP b\nb:\nJUMP a')
+    # One hop forward and one back again, which is where the guard gets called.
+    assert program.optimize().dump() == '   0 JUMP 0 (+1)\n   1 JUMP 0'
+    with pytest.raises(exceptions.StepLimitExceeded):
+        program.bind().run(engine='peephole', max_steps=100)
+
+
+@pytest.mark.parametrize('source', [
+    'a:\nJUMP b\nb:\nJUMP a',
+    'a:\nINBOX\nJUMP c\nb:\nJUMP a\nc:\nOUTBOX\nJUMP b',
+    'a:\nINBOX\nJUMPZ c\nJUMP a\nb:\nJUMP a\nc:\nJUMP b',
+    'INBOX\nJUMP b\na:\nJUMP c\nb:\nJUMP a\nc:\nOUTBOX',
+])
+def test_peephole_threading_keeps_guard_calls(source):
+    # The guard sees the same pointers and runtimes as it does with bytecode.
+    def calls(engine):
+        seen = []
+
+        def guard(pc, runtime, hands, inbox_pos):
+            seen.append((pc, runtime))
+            if runtime > 50:
+                raise exceptions.StepLimitExceeded
+
+        run = Program(source).bind(inbox=[0, 1] * 10)
+        run.runtime = 0
+        try:
+            get_engine(engine)(run, guard)
+        except exceptions.StepLimitExceeded:
+            pass
+        return seen, run.runtime, run.program_pointer
+
+    assert calls('peephole') == calls('bytecode')
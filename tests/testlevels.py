@@ -387,3 +387,29 @@ def test_level_35_duplicate_removal():
         floor={14: '0'},
     )
     assert run.outbox == ['A', 'B', 'C', 'D', 'E', 'Z']
+
+
+def test_typed_values():
+    program = Program('''
+        a:
+            INBOX
+            COPYTO   0
+            INBOX
+            ADD      0
+            OUTBOX
+            JUMP     a
+    ''')
+
+    # ints and numeric strings are interchangeable on the way in...
+    run = program.run(inbox=[1, '2', '-4', 7])
+    assert run.outbox == ['3', '3']
+    assert run.floor[0] == '-4'
+
+    # ...and typed=True keeps them as ints on the way out.
+    run = program.run(inbox=[1, '2', '-4', 7], typed=True)
+    assert run.outbox == [3, 3]
+    assert run.floor[0] == -4
+    assert run.hands is None
+
+    run = Program('INBOX').run(inbox='A', typed=True)
+    assert run.hands == 'A'
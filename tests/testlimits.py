@@ -0,0 +1,223 @@
+import time
+
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+
+
+ENGINES = ['object', 'bytecode', 'peephole', 'compiled', 'accelerated']
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_max_steps(engine):
+    program = Program('''
+        a:
+            JUMP a
+    ''')
+    run = program.bind()
+    with pytest.raises(exceptions.StepLimitExceeded):
+        run.run(engine=engine, max_steps=1000)
+    assert run.runtime == 1001
+    assert run.program_pointer == 0
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_max_steps_is_plenty(engine):
+    program = Program('''
+        a:
+            INBOX
+            OUTBOX
+            JUMP a
+    ''')
+    run = program.run(inbox='ABC', engine=engine, max_steps=9)
+    assert run.outbox == ['A', 'B', 'C']
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_timeout(engine):
+    program = Program('''
+        a:
+            BUMPUP 0
+            JUMP a
+    ''')
+    run = program.bind(floor={0: 0})
+    with pytest.raises(exceptions.TimeLimitExceeded):
+        run.run(engine=engine, timeout=0.05)
+    assert run.floor[0] == str(run.runtime // 2)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_detect_loops(engine):
+    program = Program('''
+        a:
+            INBOX
+            COPYTO 0
+        b:
+            COPYFROM 0
+            JUMPZ    b
+            OUTBOX
+            JUMP     a
+    ''')
+    run = program.bind(inbox=['1', '2', '0', '3'])
+    with pytest.raises(exceptions.InfiniteLoop):
+        run.run(engine=engine, detect_loops=True, max_steps=10 ** 6)
+    assert run.outbox == ['1', '2']
+    assert run.runtime < 1000
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_detect_loops_allows_long_loops(engine):
+    # Counts up to 5000: never the same state twice, so not infinite.
+    program = Program('''
+        a:
+            BUMPUP 0
+            SUB    1
+            JUMPN  a
+    ''')
+    run = program.run(floor={0: 0, 1: 5000}, engine=engine, detect_loops=True)
+    assert run.floor[0] == '5000'
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_detect_loops_streamed_inbox(engine):
+    # The same inbox item over and over isn't a loop, it's progress.
+    program = Program('''
+        a:
+            INBOX
+            JUMP a
+    ''')
+    run = program.run(inbox=iter(['A'] * 1000), engine=engine, detect_loops=True)
+    assert run.runtime == 2000
+
+
+COUNT_UP = '''
+    a:
+        BUMPUP 0
+        OUTBOX
+        JUMP a
+'''
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_max_outbox(engine):
+    run = Program(COUNT_UP).bind(floor={0: 0}, typed=True)
+    with pytest.raises(exceptions.OutboxLimitExceeded):
+        run.run(engine=engine, max_outbox=1000, max_steps=10 ** 7)
+    # checked every so often, so it can go over by a bit
+    assert 1000 < len(run.outbox) < 1200
+    assert run.outbox[-1] == run.floor[0] == len(run.outbox)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_max_value(engine):
+    program = Program('''
+        a:
+            COPYFROM 0
+            ADD      0
+            COPYTO   0
+            JUMP     a
+    ''')
+    run = program.bind(floor={0: 1}, typed=True)
+    with pytest.raises(exceptions.ValueLimitExceeded) as info:
+        run.run(engine=engine, max_value=999)
+    # it's still an Overflow, as far as the game is concerned
+    assert isinstance(info.value, exceptions.Overflow)
+    assert run.hands == run.floor[0] > 999
+    assert run.hands < 2 ** 100
+
+    run = Program(COUNT_UP).bind(floor={0: 0}, typed=True)
+    with pytest.raises(exceptions.ValueLimitExceeded):
+        run.run(engine=engine, max_value=999)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_deadline(engine):
+    program = Program('''
+        a:
+            JUMP a
+    ''')
+    with pytest.raises(exceptions.DeadlineExceeded):
+        program.run(engine=engine, deadline=time.monotonic() + 0.05)
+    # whichever comes first
+    with pytest.raises(exceptions.TimeLimitExceeded) as info:
+        program.run(engine=engine, deadline=time.monotonic() + 10, timeout=0.05)
+    assert type(info.value) is exceptions.TimeLimitExceeded
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_max_memory(engine):
+    run = Program(COUNT_UP).bind(floor={0: 0})
+    with pytest.raises(exceptions.MemoryLimitExceeded):
+        run.run(engine=engine, max_memory=100000)
+    assert 1000 < len(run.outbox) < 5000
+
+
+def test_sandbox_through_run_many():
+    program = Program(COUNT_UP)
+    results = list(program.run_many([''], floor={0: 0}, workers=0, max_outbox=10))
+    assert isinstance(results[0].error, exceptions.OutboxLimitExceeded)
+
+
+def test_max_outbox_accelerated():
+    # a long countdown which the accelerated engine would skip through
+    program = Program('''
+            COPYFROM 0
+        a:
+            OUTBOX
+            BUMPDN 0
+            JUMPZ  b
+            JUMP   a
+        b:
+    ''')
+    run = program.bind(floor={0: 10 ** 9}, typed=True)
+    with pytest.raises(exceptions.OutboxLimitExceeded):
+        run.run(engine='accelerated', max_outbox=1000)
+    assert 1000 < len(run.outbox) < 1200
+
+
+def test_max_value_same_on_every_engine():
+    # a countdown the accelerated engine could otherwise skip through
+    program = Program('''
+            INBOX
+            COPYTO 0
+        a:
+            BUMPDN 0
+            JUMPZ  b
+            JUMP   a
+        b:
+            OUTBOX
+    ''')
+    states = set()
+    for engine in ENGINES:
+        run = program.bind(inbox=[100000], typed=True)
+        with pytest.raises(exceptions.ValueLimitExceeded):
+            run.run(engine=engine, max_value=999)
+        states.add((run.runtime, run.program_pointer, run.hands))
+    assert len(states) == 1
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_sandbox_short_runs(engine):
+    # neither of these gets as far as a check on the way
+    program = Program('''
+        INBOX
+        COPYTO 0
+        ADD    0
+        ADD    0
+        OUTBOX
+    ''')
+    with pytest.raises(exceptions.ValueLimitExceeded):
+        program.run(inbox=[900], engine=engine, max_value=999)
+    assert program.run(inbox=[300], engine=engine, max_value=999).outbox == ['900']
+
+    program = Program('''
+        a:
+            INBOX
+            OUTBOX
+            JUMP a
+    ''')
+    run = program.bind(inbox=range(10))
+    with pytest.raises(exceptions.OutboxLimitExceeded):
+        run.run(engine=engine, max_outbox=2)
+    assert program.run(inbox=range(2), engine=engine, max_outbox=2).outbox == ['0', '1']
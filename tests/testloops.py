@@ -0,0 +1,128 @@
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+from hrmclone import loops
+from hrmclone.loops import WARM_UP, accelerate, find_loops
+
+
+COUNTDOWN = '''
+    -- HUMAN RESOURCE MACHINE PROGRAM --
+    a:
+        INBOX
+        COPYTO   0
+        JUMP     c
+    b:
+        BUMPUP   0
+    c:
+    d:
+        OUTBOX
+        COPYFROM 0
+        JUMPZ    a
+        JUMPN    b
+        BUMPDN   0
+        JUMP     d
+'''
+
+# Multiplies the two inputs by repeated addition
+MULTIPLY = '''
+    -- HUMAN RESOURCE MACHINE PROGRAM --
+    a:
+        COPYFROM 9
+        COPYTO   2
+        INBOX
+        COPYTO   0
+        INBOX
+        COPYTO   1
+    b:
+        COPYFROM 1
+        JUMPZ    c
+        BUMPDN   1
+        COPYFROM 2
+        ADD      0
+        COPYTO   2
+        JUMP     b
+    c:
+        COPYFROM 2
+        OUTBOX
+        JUMP     a
+'''
+
+
+def compare(source, inbox, floor=None, **limits):
+    outcomes = []
+    for engine in ('bytecode', 'accelerated'):
+        run = Program(source).bind(inbox=inbox, floor=floor, typed=True)
+        try:
+            run.run(engine=engine, **limits)
+            error = None
+        except exceptions.RunError as e:
+            error = type(e)
+        outcomes.append((error, run.outbox, run.floor, run.hands, run.runtime, run.program_pointer))
+    assert outcomes[0] == outcomes[1]
+    return outcomes[1]
+
+
+def test_find_loops():
+    loops = find_loops(Program(COUNTDOWN).link().code)
+    # d: OUTBOX ... JUMP d, and b: BUMPUP ... JUMPN b
+    assert sorted(loops) == [3, 4]
+    assert loops[4].steps == 6
+    assert loops[3].steps == 5
+
+
+@pytest.mark.parametrize('inbox', [[5000, -3000, 0, 7], [12, -12]])
+def test_countdown(inbox):
+    error, outbox, *_ = compare(COUNTDOWN, inbox)
+    assert error is None
+    assert outbox[:3] == [inbox[0], inbox[0] - 1, inbox[0] - 2]
+
+
+@pytest.mark.parametrize('inbox', [[7, 4000, 0, 3, 123, 456]])
+def test_accumulation(inbox):
+    error, outbox, *_ = compare(MULTIPLY, inbox, floor={9: 0})
+    assert outbox == [28000, 0, 56088]
+
+
+def test_respects_max_steps():
+    error, outbox, floor, hands, runtime, pc = compare(COUNTDOWN, [100000], max_steps=5000)
+    assert error is exceptions.StepLimitExceeded
+    assert 5000 < runtime < 5010
+
+
+def test_letters_run_normally():
+    # ADD on a letter raises part way through
+    compare(MULTIPLY, [5, 20], floor={9: 'A'})
+    compare(COUNTDOWN, ['A'])
+
+
+def test_sink():
+    items = []
+    run = Program(COUNTDOWN).bind(inbox=[30], typed=True, sink=items.append)
+    run.run(engine='accelerated')
+    assert items == list(range(30, -1, -1))
+
+
+@pytest.mark.parametrize('inbox', [[40, -40] * 20, [3, 600, 9, -2000]])
+def test_mixed_lengths(inbox):
+    # Loops which aren't worth accelerating get left to run normally.
+    compare(COUNTDOWN, inbox)
+
+
+def test_tries(monkeypatch):
+    tries = []
+
+    def counting(loop, run, *args):
+        tries.append(loop.head)
+        return accelerate(loop, run, *args)
+    monkeypatch.setattr(loops, 'accelerate', counting)
+
+    # Never goes round enough times to be worth a try
+    Program(COUNTDOWN).run(inbox=[WARM_UP - 1] * 100, engine='accelerated')
+    assert tries == []
+    # Worth a try, but doesn't skip enough to keep on trying, even next time
+    program = Program(COUNTDOWN)
+    program.run(inbox=[WARM_UP * 2] * 100, engine='accelerated')
+    assert tries == [4]
+    program.run(inbox=[WARM_UP * 2] * 100, engine='accelerated')
+    assert tries == [4]
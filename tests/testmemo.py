@@ -0,0 +1,122 @@
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+from hrmclone.memo import RunMemo
+
+
+COUNTDOWN = '''
+    -- HUMAN RESOURCE MACHINE PROGRAM --
+    a:
+        INBOX
+        COPYTO   0
+        JUMP     c
+    b:
+        BUMPUP   0
+    c:
+    d:
+        OUTBOX
+        COPYFROM 0
+        JUMPZ    a
+        JUMPN    b
+        BUMPDN   0
+        JUMP     d
+'''
+
+
+def test_hit_returns_same_state():
+    program = Program(COUNTDOWN)
+    memo = RunMemo()
+    first = program.run(inbox=['3', '-1'], engine='compiled', memo=memo)
+    second = program.run(inbox=['3', '-1'], engine='bytecode', memo=memo)
+    assert memo.stats()['hits'] == 1 and memo.stats()['misses'] == 1
+
+    for attr in ('outbox', 'floor', 'hands', 'runtime', 'program_pointer', 'inbox'):
+        assert getattr(first, attr) == getattr(second, attr)
+    assert second.outbox == ['3', '2', '1', '0', '-1', '0']
+
+    # typed only changes how the results are reported
+    typed = program.run(inbox=['3', '-1'], typed=True, memo=memo)
+    assert typed.outbox == [3, 2, 1, 0, -1, 0]
+    assert memo.hits == 2
+
+
+def test_key_covers_inputs_and_limits():
+    program = Program(COUNTDOWN)
+    memo = RunMemo()
+    program.run(inbox=['3'], memo=memo)
+    program.run(inbox=['2'], memo=memo)
+    program.run(inbox=['3'], floor={5: 'A'}, memo=memo)
+    program.run(inbox=['3'], max_steps=1000, memo=memo)
+    assert memo.misses == 4 and memo.hits == 0
+
+    # the same program, written out differently
+    program.run(inbox=['3'], memo=memo)
+    Program(COUNTDOWN.replace('    ', '  ')).run(inbox=['3'], memo=memo)
+    assert memo.hits == 2
+
+
+def test_hit_is_unaffected_by_changes_to_the_first_run():
+    program = Program(COUNTDOWN)
+    memo = RunMemo()
+    first = program.run(inbox=['2'], typed=True, memo=memo)
+    first.floor[0] = 'Z'
+    first.outbox.append(99)
+    again = program.run(inbox=['2'], typed=True, memo=memo)
+    assert again.outbox == [2, 1, 0]
+    assert again.floor[0] == 0
+
+
+def test_errors():
+    program = Program('''
+        -- HUMAN RESOURCE MACHINE PROGRAM --
+            INBOX
+            OUTBOX
+            OUTBOX
+    ''')
+    memo = RunMemo()
+    for _ in range(2):
+        with pytest.raises(exceptions.EmptyHands):
+            program.run(inbox=['1'], memo=memo)
+    assert (memo.hits, len(memo)) == (0, 0)
+
+    memo = RunMemo(cache_errors=True)
+    errors = []
+    for _ in range(3):
+        with pytest.raises(exceptions.EmptyHands) as info:
+            program.run(inbox=['1'], memo=memo)
+        errors.append(info.value)
+    assert (memo.hits, len(memo)) == (2, 1)
+    # every hit raises an exception of its own
+    assert errors[1] is not errors[2]
+
+
+def test_eviction():
+    program = Program(COUNTDOWN)
+    memo = RunMemo(maxsize=3)
+    for n in range(5):
+        program.run(inbox=[str(n)], memo=memo)
+    assert len(memo) == 3
+    assert memo.evictions == 2
+    program.run(inbox=['0'], memo=memo)
+    assert memo.hits == 0
+
+    memo = RunMemo(maxbytes=3000)
+    for n in range(50):
+        program.run(inbox=[str(n)], memo=memo)
+    assert 0 < len(memo) < 50
+    assert memo.bytes <= 3000
+    # the most recent one is still there
+    program.run(inbox=['49'], memo=memo)
+    assert memo.hits == 1
+
+
+def test_streams_and_sinks():
+    program = Program(COUNTDOWN)
+    memo = RunMemo()
+    run = program.run(inbox=iter(['2']), memo=memo)
+    assert run.outbox == ['2', '1', '0']
+    assert len(memo) == 0
+
+    with pytest.raises(ValueError):
+        program.run(inbox=['2'], sink=print, memo=memo)
@@ -0,0 +1,69 @@
+import io
+
+import pytest
+
+from hrmclone.core import Program
+from hrmclone.parser import iter_programs
+from hrmclone import exceptions
+
+
+SOURCE = '''-- HUMAN RESOURCE MACHINE PROGRAM --
+
+a:
+    INBOX
+    OUTBOX
+    JUMP     a
+'''
+
+
+def test_error_positions():
+    with pytest.raises(exceptions.NoSuchInstruction) as info:
+        Program('INBOX\n\n   FROGS 1\n')
+    assert (info.value.line, info.value.column) == (3, 4)
+    assert str(info.value) == 'FROGS (line 3, column 4)'
+
+    with pytest.raises(exceptions.InvalidArgument) as info:
+        Program('INBOX\nCOPYTO   x')
+    assert (info.value.line, info.value.column) == (2, 10)
+
+    with pytest.raises(exceptions.InvalidArgument) as info:
+        Program('OUTBOX 3')
+    assert info.value.line == 1
+
+    # errors found while validating are located too
+    with pytest.raises(exceptions.InvalidJumpTarget) as info:
+        Program('a:\n  INBOX\n  JUMP b')
+    assert (info.value.line, info.value.column) == (3, 3)
+
+    with pytest.raises(exceptions.ParseError) as info:
+        Program('DEFINE COMMENT 0\nabc')
+    assert info.value.line == 1
+
+
+def test_lowercase_instructions():
+    program = Program('a:\ninbox\nOutBox\njump a')
+    assert program.run(inbox='xy').outbox == ['x', 'y']
+
+
+@pytest.mark.parametrize('source', [
+    SOURCE,
+    SOURCE.replace('\n', '\r\n'),
+    SOURCE.encode(),
+    io.StringIO(SOURCE),
+    io.BytesIO(SOURCE.encode()),
+])
+def test_sources(source):
+    program = Program(source)
+    assert program.positions == [(4, 5), (5, 5), (6, 5)]
+    assert program.run(inbox='xy').outbox == ['x', 'y']
+
+
+def test_files(tmp_path):
+    (tmp_path / 'one.txt').write_text(SOURCE)
+    (tmp_path / 'two.txt').write_text('INBOX\nOUTBOX\n')
+    (tmp_path / 'empty.txt').write_text('')
+    programs = dict(iter_programs(str(tmp_path), '*.txt'))
+    assert len(programs) == 3
+    assert programs[str(tmp_path / 'one.txt')].run(inbox='xy').outbox == ['x', 'y']
+    assert programs[str(tmp_path / 'two.txt')].run(inbox='xy').outbox == ['x']
+    assert programs[str(tmp_path / 'empty.txt')].instructions == []
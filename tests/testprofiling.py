@@ -0,0 +1,106 @@
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+from hrmclone.profiling import Profiler
+
+
+COUNTDOWN = '''
+    -- HUMAN RESOURCE MACHINE PROGRAM --
+    a:
+        INBOX
+        COPYTO   0
+        JUMP     c
+    b:
+        BUMPUP   0
+    c:
+    d:
+        OUTBOX
+        COPYFROM 0
+        JUMPZ    a
+        JUMPN    b
+        BUMPDN   0
+        JUMP     d
+'''
+
+
+def test_counts_add_up_to_runtime():
+    program = Program(COUNTDOWN)
+    profiler = Profiler()
+    run = program.bind(inbox=['3', '-2']).run(trace=profiler)
+
+    assert profiler.total == run.runtime
+    assert profiler.runs == 1
+    # the final INBOX found nothing, and that's where the run stopped
+    assert profiler.stopped_at == {0: 1}
+
+    rows = profiler.report()
+    assert [row.count for row in rows] == [2, 2, 2, 2, 7, 7, 7, 5, 3, 3]
+    jumpz, jumpn = rows[6], rows[7]
+    assert (jumpz.text, jumpz.taken, jumpz.not_taken) == ('JUMPZ    a', 2, 5)
+    assert (jumpn.text, jumpn.taken, jumpn.not_taken) == ('JUMPN    b', 2, 3)
+    assert rows[0].taken is None
+    assert rows[0].line == 4
+    assert rows[0].seconds is None
+
+
+def test_accumulates_and_formats():
+    program = Program(COUNTDOWN)
+    profiler = Profiler(timing=True)
+    total = 0
+    for inbox in (['5'], ['-5'], ['0']):
+        total += program.bind(inbox=inbox).run(trace=profiler).runtime
+    assert profiler.total == total
+    assert profiler.runs == 3
+    assert all(row.seconds >= 0 for row in profiler.report())
+
+    table = profiler.format(sort=True, top=3)
+    assert len(table.splitlines()) == 4
+    assert 'seconds' in table.splitlines()[0]
+
+
+def test_jump_to_next_instruction():
+    program = Program('''
+        INBOX
+        JUMPZ    a
+    a:
+        OUTBOX
+    ''')
+    profiler = Profiler()
+    program.bind(inbox=[0]).run(trace=profiler)
+    program.bind(inbox=[1]).run(trace=profiler)
+    jumpz = profiler.report()[1]
+    assert (jumpz.taken, jumpz.not_taken) == (1, 1)
+
+
+def test_comments_not_counted():
+    program = Program('''
+    a:
+        INBOX
+        COMMENT  0
+        OUTBOX
+        JUMP     a
+    DEFINE COMMENT 0
+    abc;
+    ''')
+    profiler = Profiler()
+    run = program.bind(inbox='ABC').run(trace=profiler)
+    assert profiler.total == run.runtime == 9
+    assert [row.count for row in profiler.report()] == [3, 0, 3, 3, 0]
+    assert profiler.stopped_at == {0: 1}
+
+
+def test_error_not_counted():
+    profiler = Profiler()
+    run = Program('INBOX\nADD 0').bind(inbox='1')
+    with pytest.raises(exceptions.EmptyFloorTile):
+        run.run(trace=profiler)
+    assert [row.count for row in profiler.report()] == [1, 0]
+    assert profiler.stopped_at == {1: 1}
+
+
+def test_one_program_per_profiler():
+    profiler = Profiler()
+    Program('INBOX').run(trace=profiler)
+    with pytest.raises(ValueError):
+        Program('OUTBOX').run(trace=profiler)
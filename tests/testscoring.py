@@ -0,0 +1,111 @@
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+from hrmclone.levels import LEVELS, get_level, score
+from tests.testengines import COUNTDOWN, MAXIMIZATION
+
+
+MAIL_ROOM = '''
+    a:
+        INBOX
+        OUTBOX
+        JUMP     a
+'''
+
+SCRAMBLER = '''
+    a:
+        INBOX
+        COPYTO   0
+        INBOX
+        OUTBOX
+        COPYFROM 0
+        OUTBOX
+        JUMP     a
+'''
+
+
+@pytest.mark.parametrize('level, source', [
+    (2, MAIL_ROOM),
+    (4, SCRAMBLER),
+    (14, MAXIMIZATION),
+    (19, COUNTDOWN),
+])
+def test_solutions_pass(level, source):
+    result = score(Program(source), level, cases=50)
+    assert result.passed, result.failures[:1]
+    assert result.cases == 50
+    assert result.size == Program(source).size
+    assert result.worst_runtime >= result.average_runtime > 0
+
+
+def test_size_and_speed_targets():
+    result = score(MAIL_ROOM, 'busy mail room', cases=20)
+    assert result.meets_size
+    assert result.size == 3
+    # 12 items, 3 steps each
+    assert result.average_runtime == 36
+    assert not result.meets_speed
+
+
+def test_wrong_solution():
+    result = score(MAIL_ROOM, 4, cases=40)
+    assert not result.passed
+    assert len(result.failures) == 40
+    failure = result.failures[0]
+    assert failure.outbox == list(failure.inbox)
+    assert failure.error is None
+
+    result = score(MAIL_ROOM, 4, cases=1000, fail_fast=True)
+    assert result.cases < 1000
+    assert len(result.failures) == 1
+
+
+def test_errors_and_runaways_fail():
+    result = score('INBOX\nADD 3\nOUTBOX', 6, cases=5)
+    assert [type(f.error) for f in result.failures] == [exceptions.EmptyFloorTile] * 5
+
+    result = score('a:\nJUMP a', 2, cases=2, max_steps=1000)
+    assert isinstance(result.failures[0].error, exceptions.StepLimitExceeded)
+
+    result = score('INBOX\nCOPYTO 0\na:\nBUMPUP 0\nJUMP a', 19, cases=2, max_value=999)
+    assert isinstance(result.failures[0].error, exceptions.ValueLimitExceeded)
+
+
+def test_cases_are_cached_and_stable():
+    level = get_level(19)
+    first = level.cases(10, seed=3)
+    assert level.cases(5, seed=3) == first[:5]
+    assert level.cases(20, seed=3)[:10] == first
+    assert level.cases(10, seed=4) != first
+    for inbox, expected in first:
+        assert expected == tuple(Program(COUNTDOWN).run(inbox=inbox, typed=True).outbox)
+
+    # only the most recently used seeds are kept
+    for seed in range(100, 100 + level.max_seeds):
+        level.cases(1, seed=seed)
+    assert 3 not in level._cases and len(level._cases) == level.max_seeds
+    assert level.cases(10, seed=3) == first
+
+
+def test_check():
+    level = get_level(3)
+    run = Program('''
+        COPYFROM 4
+        OUTBOX
+        COPYFROM 0
+        OUTBOX
+        COPYFROM 3
+        OUTBOX
+    ''').run(floor=level.floor)
+    assert level.check(run, [])
+
+
+def test_levels():
+    assert len({level.number for level in LEVELS}) == len(LEVELS)
+    assert get_level('Countdown') is get_level(19)
+    with pytest.raises(KeyError):
+        get_level(99)
+    for level in LEVELS:
+        for inbox, expected in level.cases(3):
+            assert all(type(v) in (int, str) for v in inbox + expected)
@@ -0,0 +1,98 @@
+import json
+import threading
+import urllib.request
+
+import pytest
+
+from hrmclone import server
+from hrmclone.cache import ProgramCache
+from hrmclone.__main__ import main
+from tests.testscoring import MAIL_ROOM, SCRAMBLER
+
+
+@pytest.fixture
+def service():
+    service = server.GradingService(workers=0, batch_window=0.05)
+    yield service
+    service.close()
+
+
+def test_grading_and_batching(service):
+    futures = [
+        service.submit({'program': MAIL_ROOM, 'level': 2, 'cases': 20, 'id': 1}),
+        service.submit({'program': SCRAMBLER, 'level': 'Scrambler Handler', 'id': 2}),
+        service.submit({'program': MAIL_ROOM, 'level': 4, 'cases': 20, 'id': 3}),
+        service.submit({'program': 'FROGS', 'level': 2, 'id': 4}),
+        service.submit({'program': MAIL_ROOM, 'level': 999, 'id': 5}),
+    ]
+    results = {result['id']: result for result in (f.result(timeout=10) for f in futures)}
+
+    assert results[1]['passed'] and results[1]['cases'] == 20
+    assert results[2]['passed'] and results[2]['size'] == 7
+    assert not results[3]['passed']
+    assert results[3]['failures'][0]['expected'] != results[3]['failures'][0]['outbox']
+    assert results[4]['error'].startswith('NoSuchInstruction')
+    assert results[5]['error'].startswith('KeyError')
+
+    stats = service.stats()
+    assert stats['completed'] == 5 and stats['queued'] == stats['in_flight'] == 0
+    # the three MAIL_ROOM jobs went as one batch
+    assert stats['batches'] == 3
+    assert stats['latency']['max'] >= stats['latency']['p50'] > 0
+
+
+def test_worker_processes():
+    service = server.GradingService(workers=1, cache_size=10)
+    try:
+        result = service.submit({'program': MAIL_ROOM, 'level': 2, 'cases': 5}).result(timeout=30)
+        assert result['passed']
+    finally:
+        service.close()
+
+
+def test_limits(monkeypatch):
+    cache = ProgramCache()
+    result = server.grade({'program': MAIL_ROOM, 'level': 2, 'cases': 10 ** 9}, cache)
+    assert result['passed'] and result['cases'] == server.MAX_CASES
+
+    runaway = {'program': 'a:\nJUMP a', 'level': 2, 'cases': 1, 'max_steps': 10 ** 12}
+    error = server.grade(runaway, cache)['failures'][0]['error']
+    assert error.startswith('StepLimitExceeded') and str(server.MAX_STEPS) in error
+
+    for bad in [None, 0, -5, 1.5, '100', True]:
+        assert server.grade(dict(runaway, max_steps=bad), cache)['error'].startswith('ValueError')
+        assert server.grade(dict(runaway, cases=bad), cache)['error'].startswith('ValueError')
+
+    result = server.grade({'program': 'INBOX\nCOPYTO 0\na:\nBUMPUP 0\nJUMP a', 'level': 19, 'cases': 1}, cache)
+    assert result['failures'][0]['error'].startswith('ValueLimitExceeded')
+
+    monkeypatch.setattr(server, 'JOB_TIMEOUT', 0)
+    error = server.grade(runaway, cache)['failures'][0]['error']
+    assert error.startswith('DeadlineExceeded')
+
+
+def test_http(service):
+    httpd = server.make_server(service, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    host, port = httpd.server_address[:2]
+    try:
+        jobs = [{'program': MAIL_ROOM, 'level': 2, 'id': n} for n in range(3)]
+        request = urllib.request.Request(
+            f'http://{host}:{port}/grade', data=json.dumps(jobs).encode(), method='POST',
+        )
+        with urllib.request.urlopen(request) as response:
+            lines = [json.loads(line) for line in response]
+        assert sorted(line['id'] for line in lines) == [0, 1, 2]
+        assert all(line['passed'] for line in lines)
+
+        with urllib.request.urlopen(f'http://{host}:{port}/stats') as response:
+            assert json.load(response)['completed'] == 3
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_main_usage(capsys):
+    assert main([]) == 2
+    assert 'serve' in capsys.readouterr().err
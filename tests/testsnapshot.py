@@ -0,0 +1,93 @@
+import pickle
+
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+from tests.testengines import COUNTDOWN, ENGINES
+
+
+def interrupted(program, inbox, steps):
+    """
+    A run of `program` stopped (by the step limit) somewhere in the middle.
+    """
+    run = program.bind(inbox=inbox)
+    with pytest.raises(exceptions.StepLimitExceeded):
+        run.run(max_steps=steps)
+    return run
+
+
+def outcome(run):
+    return run.outbox, run.floor, run.hands, run.runtime, run.program_pointer
+
+
+@pytest.mark.parametrize('engine', ['object'] + ENGINES)
+def test_restore_and_carry_on(engine):
+    program = Program(COUNTDOWN)
+    inbox = ['4', '-3', '2']
+    expected = outcome(program.run(inbox=inbox))
+
+    run = interrupted(program, inbox, 10)
+    state = run.snapshot()
+    run.run(engine=engine)
+    assert outcome(run) == expected
+
+    # The snapshot wasn't disturbed by the run carrying on
+    again = program.bind().restore(state)
+    assert again.runtime == state.runtime
+    again.run(engine=engine)
+    assert outcome(again) == expected
+
+
+def test_forks_are_independent():
+    program = Program(COUNTDOWN)
+    run = interrupted(program, ['3', '5'], 6)
+    before = run.outbox
+    fork = run.fork()
+    assert fork.floor == run.floor
+
+    fork.floor = ['9'] + fork.floor[1:]
+    fork.run()
+    run.run()
+    assert run.outbox == program.run(inbox=['3', '5']).outbox
+    assert fork.outbox[:len(before)] == before
+    assert fork.outbox != run.outbox
+    assert run.floor[0] == '0'
+
+
+def test_fork_streamed_inbox():
+    program = Program(COUNTDOWN)
+    run = program.bind(inbox=iter(['2', '1', '3']))
+    with pytest.raises(exceptions.StepLimitExceeded):
+        run.run(max_steps=3)
+    forks = [run.fork() for _ in range(3)]
+    expected = program.run(inbox=['2', '1', '3']).outbox
+    for fork in forks + [run]:
+        assert fork.run().outbox == expected
+
+
+def test_explore_inbox_suffixes():
+    program = Program('''
+        INBOX
+        COPYTO   0
+    a:
+        INBOX
+        ADD      0
+        OUTBOX
+        JUMP     a
+    ''')
+    setup = program.bind(inbox=['10']).run()
+    state = setup.snapshot()
+    results = [
+        program.bind().restore(state, inbox=suffix).run().outbox
+        for suffix in (['1', '2'], ['-10'], [])
+    ]
+    assert results == [['11', '12'], ['0'], []]
+
+
+def test_pickled_state():
+    program = Program(COUNTDOWN)
+    run = interrupted(program, ['3', '7', '-2'], 12)
+    state = pickle.loads(pickle.dumps(run.snapshot()))
+    restored = program.bind().restore(state).run()
+    assert outcome(restored) == outcome(run.run())
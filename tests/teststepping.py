@@ -0,0 +1,136 @@
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+from tests.testengines import COUNTDOWN, ENGINES
+
+
+def test_step():
+    run = Program('INBOX\nCOMMENT 0\nOUTBOX\nDEFINE COMMENT 0\nabc;').bind(inbox='A')
+    assert not run.finished and not run.waiting
+    assert run.step()
+    assert run.hands == 'A'
+    assert run.step()
+    # the comment isn't counted
+    assert run.runtime == 1
+    assert run.step()
+    assert run.outbox == ['A']
+    # DEFINE COMMENT
+    assert run.step()
+    assert run.runtime == 2
+    assert not run.step()
+    assert run.finished and not run.waiting
+
+
+def test_step_raises():
+    run = Program('OUTBOX').bind()
+    with pytest.raises(exceptions.EmptyHands):
+        run.step()
+    assert run.program_pointer == 0
+
+
+def test_run_until():
+    program = Program(COUNTDOWN)
+    run = program.bind(inbox=['5'])
+    assert run.run_until(4)
+    assert run.runtime == 4
+    assert run.run_until(lambda r: r.outbox_count == 3)
+    assert run.outbox == ['5', '4', '3']
+    assert not run.run_until(1000)
+    assert run.waiting
+    assert run.outbox == program.run(inbox=['5']).outbox
+
+
+@pytest.mark.parametrize('engine', ['object'] + ENGINES)
+def test_feed_and_resume(engine):
+    program = Program(COUNTDOWN)
+    run = program.bind(inbox=['2'])
+    run.run(engine=engine)
+    assert run.waiting and not run.finished
+
+    run.feed(['-1', '1'])
+    run.run(engine=engine)
+    expected = program.run(inbox=['2', '-1', '1'])
+    assert run.outbox == expected.outbox
+    assert run.runtime == expected.runtime
+    assert run.waiting
+
+
+@pytest.mark.parametrize('engine', ['object'] + ENGINES)
+def test_compact(engine):
+    program = Program(COUNTDOWN)
+    run = program.bind(inbox=['2', 'A'], floor={3: 'B'})
+    run.run_until(lambda r: r.outbox_count == 3)
+    before = (run.outbox, run.floor, run.hands, run.inbox, run.runtime)
+    assert run.compact() is run
+    assert (run.outbox, run.floor, run.hands, run.inbox, run.runtime) == before
+    assert run.snapshot().floor[3] == 'B'
+
+    with pytest.raises(exceptions.RunError):
+        run.run(engine=engine)
+    assert run.outbox == ['2', '1', '0', 'A']
+
+    # an untouched run shares its starting floor with other runs
+    other = program.bind(inbox=['2']).compact()
+    assert other._floor is program.bind()._floor
+    other.feed(['3'])
+    other.run(engine=engine)
+    assert other.outbox == program.run(inbox=['2', '3']).outbox
+
+
+@pytest.mark.parametrize('engine', ['object'] + ENGINES)
+def test_pack(engine):
+    program = Program(COUNTDOWN)
+    run = program.bind(inbox=['2', 'A'], floor={3: 'B', 4: 10 ** 30})
+    run.run_until(lambda r: r.outbox_count == 3)
+    data = run.pack()
+    unpacked = program.unpack(data)
+    assert (unpacked.outbox, unpacked.floor, unpacked.hands, unpacked.inbox, unpacked.runtime) == (
+        run.outbox, run.floor, run.hands, run.inbox, run.runtime,
+    )
+    with pytest.raises(exceptions.RunError):
+        unpacked.run(engine=engine)
+    assert unpacked.outbox == ['2', '1', '0', 'A']
+
+    # waiting for more inbox, which is what it's for
+    run = program.bind(inbox=['300'], typed=True).run(engine=engine)
+    unpacked = program.unpack(run.pack())
+    assert unpacked.typed and unpacked.waiting and unpacked.outbox == list(range(300, -1, -1))
+    unpacked.feed([-2])
+    unpacked.run(engine=engine)
+    assert unpacked.outbox == program.run(inbox=[300, -2], typed=True).outbox
+    assert unpacked.runtime == program.run(inbox=[300, -2]).runtime
+
+    # a sink and an inbox stream are passed back in
+    received = []
+    run = program.bind(inbox=iter(['1', '1']), sink=received.append)
+    run.step()
+    unpacked = program.unpack(run.pack(), inbox=iter(['1']), sink=received.append)
+    unpacked.run(engine=engine)
+    assert received == ['1', '0', '1', '0']
+    assert unpacked.outbox_count == 4
+
+    fresh = program.unpack(program.bind(inbox='5').pack())
+    assert fresh.runtime is None and fresh.inbox == ['5']
+
+
+def test_outputs():
+    run = Program(COUNTDOWN).bind(inbox=['2'])
+    outputs = run.outputs()
+    assert list(zip(range(4), outputs)) == [(0, '2'), (1, '1'), (2, '0'), (3, None)]
+    assert outputs.send(['-1']) == '-1'
+    assert next(outputs) == '0'
+    assert next(outputs) is None
+    run.feed('')
+    assert list(outputs) == []
+    assert run.waiting
+
+
+def test_outputs_until_finished():
+    run = Program('INBOX\nOUTBOX\nINBOX\nOUTBOX').bind(inbox='A', typed=True)
+    outputs = run.outputs()
+    assert next(outputs) == 'A'
+    assert next(outputs) is None
+    assert outputs.send('B') == 'B'
+    assert list(outputs) == []
+    assert run.finished
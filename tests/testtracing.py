@@ -0,0 +1,165 @@
+import io
+
+import pytest
+
+from hrmclone.core import Program
+from hrmclone import exceptions
+from hrmclone.tracing import (
+    BinaryTracer, BufferedTracer, StderrTracer, Tracer, TraceReader,
+    FAILED, FLOOR_WRITE, OUTBOX_WRITE, TRACE_RECORD_SIZE,
+)
+
+
+class RecordingTracer(Tracer):
+    def __init__(self):
+        self.events = []
+
+    def step(self, run, index, instruction):
+        self.events.append(('step', index, str(instruction).strip()))
+
+    def error(self, run, index, instruction, exc):
+        self.events.append(('error', index, type(exc)))
+
+    def finish(self, run):
+        self.events.append(('finish',))
+
+
+def test_tracer_hooks():
+    program = Program('''
+        INBOX
+        OUTBOX
+        OUTBOX
+    ''')
+    tracer = RecordingTracer()
+    with pytest.raises(exceptions.EmptyHands):
+        program.bind(inbox='AB').run(trace=tracer)
+
+    assert tracer.events == [
+        ('step', 0, 'INBOX'),
+        ('step', 1, 'OUTBOX'),
+        ('error', 2, exceptions.EmptyHands),
+        ('step', 2, 'OUTBOX'),
+        ('finish',),
+    ]
+
+
+def test_tracer_sees_empty_inbox_step():
+    tracer = RecordingTracer()
+    run = Program('INBOX').bind().run(trace=tracer)
+    assert run.runtime == 0
+    assert tracer.events == [('step', 0, 'INBOX'), ('finish',)]
+
+
+def test_stderr_and_buffered_tracers_agree():
+    program = Program('''
+        a:
+            INBOX
+            COPYTO   0
+            OUTBOX
+            JUMP     a
+    ''')
+    immediate = io.StringIO()
+    buffered = io.StringIO()
+    program.bind(inbox='abc').run(trace=StderrTracer(file=immediate))
+
+    tracer = BufferedTracer(file=buffered, batch_size=4)
+    program.bind(inbox='abc').run(trace=tracer)
+
+    assert immediate.getvalue() == buffered.getvalue()
+    assert immediate.getvalue().startswith(
+        "INBOX:\n\tinbox=['b', 'c']\n\tfloor=[None"
+    )
+    assert tracer.buffer == []
+
+
+TRACED = '''
+    a:
+        INBOX
+        COPYTO   [0]
+        COMMENT  0
+        ADD      5
+        OUTBOX
+        BUMPUP   0
+        JUMP     a
+    DEFINE COMMENT 0
+    abc;
+'''
+
+
+def test_binary_trace(tmp_path):
+    program = Program(TRACED)
+    inbox = [7, 10 ** 30, -2, 'B']
+    floor = {0: 1, 5: 3}
+    path = tmp_path / 'run.trace'
+    traced = program.bind(inbox=inbox, floor=floor, typed=True)
+    with pytest.raises(exceptions.MathDomainError):
+        traced.run(trace=BinaryTracer(path, batch_size=3, keyframe_every=4))
+
+    with TraceReader(path) as trace:
+        assert trace.finished
+        # the letter can't be added to
+        assert trace[-1].flags == FAILED
+        assert trace[1].flags & FLOOR_WRITE and trace[1].tile == 1
+
+        # replaying gets the same state as stepping through the run
+        run = program.bind(inbox=inbox, floor=floor, typed=True)
+        for n in range(len(trace)):
+            state = trace.state(n)
+            assert (state.program_pointer, state.runtime, state.hands, state.floor) == (
+                run.program_pointer, run.runtime or 0, run.hands, run.floor,
+            )
+            assert state.outbox_count == len(run.outbox)
+            if n < len(trace) - 1:
+                run.step()
+
+        final = trace.state(len(trace))
+        assert (final.program_pointer, final.runtime, final.hands, final.floor) == (
+            traced.program_pointer, traced.runtime, traced.hands, traced.floor,
+        )
+        assert list(trace.outputs()) == traced.outbox == [10, 10 ** 30 + 3, 1]
+        assert sum(1 for step in trace if step.flags & OUTBOX_WRITE) == 3
+
+
+def test_binary_trace_strings(tmp_path):
+    # untyped inboxes (blank lines from a file, say) needn't be one letter each
+    program = Program('a:\nINBOX\nOUTBOX\nJUMP a')
+    inbox = ['AB', '', 'x', 'AB']
+    path = tmp_path / 'run.trace'
+    program.run(inbox=inbox, trace=BinaryTracer(path))
+    with TraceReader(path) as trace:
+        assert list(trace.outputs()) == inbox
+        assert trace.state(len(trace)).outbox_count == 4
+
+
+def test_binary_trace_without_footer(tmp_path):
+    # As if the process died partway through: the footer never got written.
+    program = Program(TRACED)
+    path = tmp_path / 'run.trace'
+    program.bind(inbox=[1, 2, 3], floor={0: 1, 5: 3}).run(trace=BinaryTracer(path, keyframe_every=4))
+    with TraceReader(path) as trace:
+        steps = len(trace)
+        expected = trace.state(steps - 2)
+        size = trace._start + steps * TRACE_RECORD_SIZE
+    with open(path, 'r+b') as f:
+        f.truncate(size - 5)
+
+    with TraceReader(path) as trace:
+        assert not trace.finished
+        assert len(trace) == steps - 1
+        assert trace.state(steps - 2) == expected
+        assert trace.state(steps - 1).program_pointer is None
+
+
+@pytest.mark.parametrize('source', ['COPYFROM [0]', 'COPYFROM 1\nADD [0]', 'COPYTO [0]', 'BUMPUP [0]'])
+def test_binary_trace_pointer_off_floor(source, tmp_path):
+    program = Program(source)
+    path = tmp_path / 'run.trace'
+    run = program.bind(floor={0: -3, 1: 5}, typed=True)
+    if source.startswith('COPYTO'):
+        run.hands = 1
+    with pytest.raises(exceptions.InvalidFloorIndex):
+        run.run(trace=BinaryTracer(path))
+    with TraceReader(path) as trace:
+        assert trace[-1].flags == FAILED
+        final = trace.state(len(trace))
+        assert (final.runtime, final.hands, final.floor) == (run.runtime, run.hands, run.floor)
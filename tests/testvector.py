@@ -0,0 +1,120 @@
+import random
+
+import pytest
+
+from hrmclone.core import Program
+from hrmclone.batch import run_case
+from hrmclone import exceptions
+
+from tests.testengines import CASES, COUNTDOWN, DUPLICATE_REMOVAL, MAXIMIZATION
+
+numpy = pytest.importorskip('numpy')
+
+from hrmclone.vector import run_lanes  # noqa: E402
+
+
+def as_tuple(result):
+    return (
+        type(result.error), result.outbox, result.floor, result.hands, result.runtime,
+    )
+
+
+def test_vector_matches_scalar_engines():
+    # Every case from the engine tests, including the ones with letters in
+    # (which fall back to the scalar engine) and the ones which fail.
+    for source, inbox, floor in CASES:
+        program = Program(source)
+        [result] = run_lanes(program, [(0, inbox, floor)])
+        assert as_tuple(result) == as_tuple(run_case(program, 0, inbox, floor, 'object', False)), source
+
+
+@pytest.mark.parametrize('source, floor', [
+    (COUNTDOWN, None),
+    (MAXIMIZATION, None),
+    (DUPLICATE_REMOVAL, {14: 0}),
+])
+def test_many_lanes(source, floor):
+    program = Program(source)
+    rng = random.Random(1)
+    cases = [
+        (i, [rng.randint(-9, 9) for _ in range(rng.randint(0, 12))], floor)
+        for i in range(200)
+    ]
+    results = run_lanes(program, cases, typed=True)
+    for (index, inbox, floor), result in zip(cases, results):
+        assert result.index == index
+        assert as_tuple(result) == as_tuple(run_case(program, index, inbox, floor, 'object', True))
+
+
+def test_run_many_vector():
+    program = Program(COUNTDOWN)
+    inboxes = [['3', '-1'], ['A'], ['0']]
+    results = list(program.run_many(inboxes, workers=0, engine='vector'))
+    assert [r.outbox for r in results] == [['3', '2', '1', '0', '-1', '0'], ['A'], ['0']]
+
+
+def test_run_arrays():
+    from hrmclone.vector import run_arrays
+
+    program = Program(MAXIMIZATION)
+    inbox = numpy.array([[1, 2, -4, -4], [9, -3, 5, 0], [3, 3, 0, 0]])
+    lanes = run_arrays(program, inbox, inbox_len=[4, 4, 3])
+    assert lanes.outboxes() == [[2, -4], [9, 5], [3]]
+    assert lanes.runtime.tolist() == [
+        program.run(inbox=row[:n]).runtime
+        for row, n in zip(inbox.tolist(), [4, 4, 3])
+    ]
+    assert lanes.errors == [None, None, None]
+
+
+def test_vector_max_steps():
+    program = Program('''
+        a:
+            INBOX
+            JUMPZ    a
+        b:
+            JUMP     b
+    ''')
+    results = list(program.run_many(
+        [['0', '0'], ['0', '1']], workers=0, engine='vector', max_steps=100,
+    ))
+    assert results[0].ok
+    assert isinstance(results[1].error, exceptions.StepLimitExceeded)
+
+
+def test_vector_max_steps_matches_compiled():
+    # Only checked at backward jumps, so straight-line code is never stopped.
+    straight = Program('INBOX\nOUTBOX\n' * 5)
+    loop = Program(COUNTDOWN)
+    cases = [(0, [1], None), (1, [9, 2], None), (2, [], None)]
+    for program, max_steps in [(straight, 3), (loop, 10), (loop, 25)]:
+        limits = {'max_steps': max_steps}
+        results = run_lanes(program, cases, typed=True, **limits)
+        for (index, inbox, floor), result in zip(cases, results):
+            expected = run_case(program, index, inbox, floor, 'compiled', True, limits)
+            assert as_tuple(result) == as_tuple(expected)
+    assert results[1].error is not None and results[0].ok
+
+
+def test_vector_out_of_int64_range():
+    # Doubles the number 70 times, way past what an int64 holds.
+    program = Program('''
+            INBOX
+            COPYTO   0
+        a:
+            COPYFROM 0
+            ADD      0
+            COPYTO   0
+            BUMPDN   1
+            JUMPZ    b
+            JUMP     a
+        b:
+            COPYFROM 0
+            OUTBOX
+    ''')
+    cases = [(0, [3], {1: 70}), (1, [3], {1: 5})]
+    results = run_lanes(program, cases, typed=True)
+    for (index, inbox, floor), result in zip(cases, results):
+        assert as_tuple(result) == as_tuple(run_case(program, index, inbox, floor, 'compiled', True))
+    assert results[0].outbox == [3 * 2 ** 70]
+    assert results[1].outbox == [3 * 2 ** 5]